@@ -6,6 +6,7 @@ import sqlite3
 from collections.abc import Mapping
 from typing import Any
 
+from r8 import database
 from r8 import util
 from r8.challenge import Challenge
 from r8.challenge import challenges
@@ -13,6 +14,7 @@ from r8.util import echo
 from r8.util import log
 
 db: sqlite3.Connection
+async_db: database.Database
 settings: Mapping[str, Any] = {}
 
 __all__ = ["Challenge", "challenges", "db", "util", "log", "echo"]
@@ -0,0 +1,143 @@
+"""
+Fan-out of messages to many WebSocket connections.
+
+Each message is encoded once and pushed into a small bounded queue per connection,
+which is drained by a dedicated sender task. If a client cannot keep up, its queue is
+replaced with a single snapshot of the current state (or, without a snapshot function,
+older messages are dropped in favor of newer ones). Clients whose sends stall for longer
+than `send_timeout` are disconnected.
+"""
+
+import asyncio
+import collections
+import json
+import statistics
+import time
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+
+import r8
+
+
+class BroadcastHub:
+    def __init__(
+        self,
+        queue_size: int = 4,
+        send_timeout: float = 10,
+        snapshot: Optional[Callable[[], str]] = None,
+    ):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.snapshot = snapshot
+        """returns the encoded full state, sent on connect and when a client falls behind"""
+        self.subscribers: dict[web.WebSocketResponse, _Subscriber] = {}
+        self.latencies: collections.deque[float] = collections.deque(maxlen=1000)
+        """seconds between publishing and sending a message, for the most recent deliveries"""
+        self.coalesced = 0
+        """number of times a client's queue overflowed and older messages were dropped"""
+        self.dropped = 0
+        """number of connections that have been closed because they were stuck"""
+
+    def subscribe(
+        self, ws: web.WebSocketResponse, replay: Optional[list[str]] = None
+    ) -> None:
+        """
+        Start sending messages to `ws`. The client first receives the messages in `replay`
+        (e.g. to resume a previous session), or a snapshot if `replay` is `None`.
+        """
+        sub = _Subscriber(self, ws)
+        self.subscribers[ws] = sub
+        published = time.monotonic()
+        if replay is not None:
+            for message in replay:
+                sub.push(published, message)
+        elif self.snapshot:
+            sub.push(published, self.snapshot())
+
+    def unsubscribe(self, ws: web.WebSocketResponse) -> None:
+        if sub := self.subscribers.pop(ws, None):
+            sub.task.cancel()
+
+    def publish(self, data: Any) -> None:
+        """Encode `data` as JSON and send it to all subscribers."""
+        self.publish_str(json.dumps(data))
+
+    def publish_str(self, message: str) -> None:
+        published = time.monotonic()
+        snapshot = None
+        for sub in self.subscribers.values():
+            if len(sub.queue) < self.queue_size:
+                sub.push(published, message)
+                continue
+            self.coalesced += 1
+            if self.snapshot:
+                # the snapshot already includes this message.
+                snapshot = snapshot or self.snapshot()
+                sub.queue.clear()
+                sub.push(published, snapshot)
+            else:
+                sub.queue.popleft()
+                sub.push(published, message)
+
+    def stats(self) -> dict:
+        """Fan-out latency and backpressure statistics."""
+        latencies = sorted(self.latencies)
+        return {
+            "connections": len(self.subscribers),
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "latency_median": statistics.median(latencies) if latencies else None,
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+    async def close(self) -> None:
+        """Close all connections, e.g. on server shutdown."""
+        await asyncio.gather(*[sub.close() for sub in list(self.subscribers.values())])
+
+
+class _Subscriber:
+    def __init__(self, hub: BroadcastHub, ws: web.WebSocketResponse):
+        self.hub = hub
+        self.ws = ws
+        self.queue: collections.deque[tuple[float, str]] = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    def push(self, published: float, message: str) -> None:
+        self.queue.append((published, message))
+        self.wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.queue:
+                published, message = self.queue.popleft()
+                try:
+                    await asyncio.wait_for(
+                        self.ws.send_str(message), self.hub.send_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.hub.dropped += 1
+                    r8.echo("broadcast", "Dropping stuck WebSocket connection.")
+                    await self.close(aiohttp.WSCloseCode.TRY_AGAIN_LATER, b"too slow")
+                    return
+                except ConnectionError:
+                    return
+                self.hub.latencies.append(time.monotonic() - published)
+
+    async def close(
+        self,
+        code: int = aiohttp.WSCloseCode.GOING_AWAY,
+        message: bytes = b"server shutdown",
+    ) -> None:
+        try:
+            await asyncio.wait_for(
+                self.ws.close(code=code, message=message), self.hub.send_timeout
+            )
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
@@ -21,12 +21,17 @@ class DockerHelloWorld(r8.challenge_mixins.DockerChallenge):
                 <div class="response"></div>
             </form>
             """
-            + r8.util.challenge_form_js(self.id),
+            + r8.util.challenge_form_js(self.id)
+            + self.queue_status_js(),
         )
 
     async def handle_post_request(self, user: str, request: web.Request):
         json = await request.json()
         try:
             return await self.docker_run(user, *shlex.split(json.get("command", "")))
+        except r8.challenge_mixins.DockerBusy as e:
+            raise web.HTTPServiceUnavailable(
+                reason=str(e), headers={"Retry-After": str(e.retry_after)}
+            ) from e
         except r8.challenge_mixins.DockerError as e:
-            raise web.HTTPInternalServerError(reason=str(e))
+            raise web.HTTPInternalServerError(reason=str(e)) from e
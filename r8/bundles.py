@@ -0,0 +1,128 @@
+"""
+Precompiled frontend bundles.
+
+r8's pages embed their React code as `<script type="text/babel">`, which is compiled in the
+browser by default. `r8 static build` compiles these scripts ahead of time into minified,
+fingerprinted bundles and records them in a manifest, keyed by a hash of the script source.
+When a page is rendered, its scripts are swapped for their bundles and babel.js is not loaded.
+If a template has changed since the last build (or a custom template in `static_dir` has not
+been built), the hashes do not match and the page falls back to in-browser compilation.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import re
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Union
+
+import jinja2
+
+from r8 import jsx
+from r8 import staticfiles
+
+MANIFEST = "js/bundles/manifest.json"
+
+BABEL_SCRIPT = re.compile(r'<script type="text/babel">(.*?)</script>', re.DOTALL)
+BABEL_LOADER = re.compile(r'<script src="js/babel\.js"></script>\n?')
+
+TStaticDir = Union[str, Path, Iterable[Union[str, Path]]]
+
+
+def source_hash(source: str) -> str:
+    return hashlib.sha256(source.strip().encode()).hexdigest()[:20]
+
+
+def build(directories: TStaticDir, output: Path, context: dict) -> dict[str, str]:
+    """
+    Compile the babel scripts of all pages in `directories` into bundles in `output`,
+    replacing any previous build.
+
+    Pages are rendered with `context` first, so that template inheritance is resolved.
+
+    Returns:
+        A mapping from bundle path to the page it has been compiled from.
+    """
+    directories = _normalize(directories)
+    # same configuration as aiohttp_jinja2, so that scripts are rendered identically.
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(directories), autoescape=True
+    )
+    pages = sorted(
+        {p.name for d in directories for p in Path(d).glob("*.html") if p.is_file()},
+        # name bundles after pages rather than the base templates they extend.
+        key=lambda name: (name.startswith("_"), name),
+    )
+
+    prefix = MANIFEST.rpartition("/")[0]
+    (output / prefix).mkdir(parents=True, exist_ok=True)
+    manifest: dict[str, str] = {}
+    built: dict[str, str] = {}
+    for page in pages:
+        scripts = BABEL_SCRIPT.findall(env.get_template(page).render(context))
+        for n, source in enumerate(scripts):
+            key = source_hash(source)
+            if key in manifest:
+                continue
+            code = jsx.compile(source, minify=True).encode()
+            name = Path(page).stem + (f"-{n}" if n else "")
+            path = f"{prefix}/{name}.{hashlib.sha256(code).hexdigest()[:12]}.js"
+            (output / path).write_bytes(code)
+            (output / f"{path}.gz").write_bytes(
+                gzip.compress(code, compresslevel=9, mtime=0)
+            )
+            manifest[key] = path
+            built[path] = page
+
+    # remove bundles of previous builds.
+    for old in (output / prefix).iterdir():
+        name = old.name.removesuffix(".gz")
+        if name.endswith(".js") and f"{prefix}/{name}" not in built:
+            old.unlink()
+    (output / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return built
+
+
+_manifests: dict[tuple[Path, float], dict[str, str]] = {}
+_no_manifest: dict[str, str] = {}
+
+
+def manifest(directories: TStaticDir) -> dict[str, str]:
+    """The manifest of the current build. The same object is returned until it changes."""
+    file = staticfiles.get(_normalize(directories)).lookup(MANIFEST)
+    if file is None:
+        return _no_manifest
+    key = (file.path, file.mtime)
+    if key not in _manifests:
+        _manifests.clear()
+        try:
+            _manifests[key] = json.loads(file.body(None))
+        except ValueError:
+            _manifests[key] = {}
+    return _manifests[key]
+
+
+def apply(page: str, directories: TStaticDir) -> str:
+    """
+    Replace the babel scripts of a rendered page with their precompiled bundles.
+    The page is returned unchanged unless all of its scripts have been built.
+    """
+    scripts = BABEL_SCRIPT.findall(page)
+    if not scripts:
+        return page
+    current = manifest(directories)
+    bundles = [current.get(source_hash(source)) for source in scripts]
+    if not all(bundles):
+        return page
+    it = iter(bundles)
+    page = BABEL_SCRIPT.sub(lambda _: f'<script src="{next(it)}"></script>', page)
+    return BABEL_LOADER.sub("", page)
+
+
+def _normalize(directories: TStaticDir) -> list[Path]:
+    if isinstance(directories, (str, Path)):
+        directories = [directories]
+    return [Path(x) for x in directories]
@@ -1,13 +1,14 @@
 import abc
 import asyncio
-import functools
 import inspect
 import json
+import sqlite3
 import time
 import traceback
 from pathlib import Path
 from typing import Any
 from typing import ClassVar
+from typing import Hashable
 from typing import Optional
 from typing import Union
 
@@ -39,8 +40,16 @@ class Challenge:
     If unset, points are automatically adjusted by the number of solves.
     """
 
+    description_cache_ttl: ClassVar[Optional[float]] = None
+    """
+    If set, rendered descriptions are cached for the given number of seconds
+    instead of calling :meth:`description` on every challenge list request.
+    See also :meth:`description_cache_key`.
+    """
+
     def __init__(self, cid: str) -> None:
         self.id = cid
+        self._description_cache: dict[Hashable, tuple[float, str]] = {}
         if self.static_dir is None:
             self.static_dir = (
                 Path(inspect.getfile(type(self))).parent.absolute() / "static"
@@ -60,6 +69,34 @@ class Challenge:
         """
         return ""
 
+    def description_cache_key(self, user: str, solved: bool) -> Hashable:
+        """
+        Key under which a rendered description is cached if :attr:`description_cache_ttl` is set.
+        Defaults to `(user, solved)`. Challenges whose description does not depend on the user
+        can return `solved` instead, so that the description is only rendered twice.
+        """
+        return user, solved
+
+    async def cached_description(self, user: str, solved: bool) -> str:
+        """
+        Like :meth:`description`, but honors :attr:`description_cache_ttl`.
+        Exceptions are not cached.
+        """
+        if self.description_cache_ttl is None:
+            return await self.description(user, solved)
+        key = self.description_cache_key(user, solved)
+        now = time.monotonic()
+        try:
+            expiry, desc = self._description_cache[key]
+        except KeyError:
+            pass
+        else:
+            if now < expiry:
+                return desc
+        desc = await self.description(user, solved)
+        self._description_cache[key] = (now + self.description_cache_ttl, desc)
+        return desc
+
     async def visible(self, user: str) -> bool:
         """
         Determine if the challenge is visible for a given user.
@@ -70,18 +107,7 @@ class Challenge:
     @property
     def active(self) -> bool:
         """`True` if the challenge is currently active, `False` otherwise (read-only)."""
-        t_start, t_stop = self._active_times()
-        return t_start <= time.time() <= t_stop
-
-    @functools.cache
-    def _active_times(self) -> tuple[int, int]:
-        with r8.db:
-            return r8.db.execute(
-                """
-                SELECT CAST(strftime('%s', t_start) AS INT), CAST(strftime('%s', t_stop) AS INT) FROM challenges WHERE cid = ?
-            """,
-                (self.id,),
-            ).fetchone()
+        return r8.state.get_solves().is_active(self.id)
 
     @property
     def args(self) -> str:
@@ -127,9 +153,9 @@ class Challenge:
     ) -> None:
         """
         Log an event for the current challenge.
-        See :func:`r8.log`.
+        See :func:`r8.util.log_entry`.
         """
-        r8.log(ip, type, data, uid=uid, cid=self.id)
+        r8.util.log_entry(ip, type, data, uid=uid, cid=self.id)
 
     def log_and_create_flag(
         self,
@@ -161,7 +187,7 @@ class Challenge:
             challenge = self.id
 
         flag = r8.util.create_flag(challenge, max_submissions, flag)
-        r8.log(ip, "flag-create", flag, uid=user, cid=challenge)
+        r8.util.log_entry(ip, "flag-create", flag, uid=user, cid=challenge)
         return flag
 
     def api_url(
@@ -193,7 +219,9 @@ class Challenge:
         The request path can be accessed using `request.match_info["path"]`.
         """
         if self.static_dir:
-            return r8.util.serve_static(self.static_dir, request.match_info["path"])
+            return r8.util.serve_static(
+                self.static_dir, request.match_info["path"], request
+            )
         else:
             return web.HTTPNotFound()
 
@@ -210,39 +238,58 @@ class Challenge:
     def get_data(self, key: str, *, cid: Optional[str] = None) -> Any:
         """
         Get persistent challenge data for a specific key.
+        This blocks until all pending writes have been committed,
+        coroutines should use :meth:`get_data_async` instead.
 
         Args:
             cid: If given, override the challenge for which data should be accessed.
         """
-        with r8.db:
-            data = r8.db.execute(
-                """
-                SELECT value FROM data WHERE cid = ? AND key = ?
-            """,
-                (cid or self.id, key),
-            ).fetchone()
-            if data:
-                return json.loads(data[0])
-            else:
-                return None
+        return r8.async_db.write_blocking(_get_data, cid or self.id, key)
+
+    async def get_data_async(self, key: str, *, cid: Optional[str] = None) -> Any:
+        """
+        Like :meth:`get_data`, but does not block the event loop.
+
+        Args:
+            cid: If given, override the challenge for which data should be accessed.
+        """
+        # Read on the writer connection so that preceding calls to set_data are reflected.
+        return await r8.async_db.write(_get_data, cid or self.id, key)
 
     def set_data(self, key: str, value: Any, *, cid: Optional[str] = None):
         """
         Set persistent challenge data for a specific key.
+        Within the event loop, this returns immediately and the value is committed in the background.
 
         Args:
             cid: If given, override the challenge for which data should be modified.
         """
-        with r8.db:
-            r8.db.execute(
-                """INSERT OR REPLACE INTO data (cid, key, value) VALUES (?,?,?)""",
-                (cid or self.id, key, json.dumps(value)),
-            )
+        r8.async_db.write_nowait(_set_data, cid or self.id, key, json.dumps(value))
 
     def __init_subclass__(cls, **kwargs):
         challenges.add_class(cls)  # register challenge with r8 on init.
 
 
+def _get_data(conn: sqlite3.Connection, cid: str, key: str) -> Any:
+    data = conn.execute(
+        """
+        SELECT value FROM data WHERE cid = ? AND key = ?
+    """,
+        (cid, key),
+    ).fetchone()
+    if data:
+        return json.loads(data[0])
+    else:
+        return None
+
+
+def _set_data(conn: sqlite3.Connection, cid: str, key: str, value: str) -> None:
+    conn.execute(
+        """INSERT OR REPLACE INTO data (cid, key, value) VALUES (?,?,?)""",
+        (cid, key, value),
+    )
+
+
 def get_challenges() -> list[str]:
     with r8.db:
         cursor = r8.db.execute("SELECT cid FROM challenges")
@@ -290,6 +337,9 @@ class _Challenges:
     def __contains__(self, item):
         return item in self._instances
 
+    def __iter__(self):
+        return iter(self._instances)
+
     async def start(self):
         await asyncio.gather(*[self._start(cid) for cid in self._instances])
 
@@ -1,9 +1,13 @@
 from .docker import DockerChallenge
 from .docker import DockerError
+from .docker import DockerTimeout
+from .docker_scheduler import DockerBusy
 from .web_server import WebServerChallenge
 
 __all__ = [
+    "DockerBusy",
     "DockerChallenge",
     "DockerError",
+    "DockerTimeout",
     "WebServerChallenge",
 ]
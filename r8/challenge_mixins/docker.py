@@ -1,15 +1,27 @@
 import asyncio
 import binascii
+import collections
+import hashlib
+import json
+import os
 import re
 import secrets
-import shlex
 import shutil
 import time
 from pathlib import Path
 from typing import ClassVar
 from typing import Optional
+from typing import Union
+
+from aiohttp import web
 
 import r8
+from r8.challenge_mixins import docker_backends
+from r8.challenge_mixins.docker_backends import DockerBackend
+from r8.challenge_mixins.docker_backends import DockerError
+from r8.challenge_mixins.docker_backends import DockerTimeout
+from r8.challenge_mixins.docker_scheduler import AdaptiveLimit
+from r8.challenge_mixins.docker_scheduler import Scheduler
 
 
 def docker_tagify(cid: str) -> str:
@@ -20,13 +32,132 @@ def docker_tagify(cid: str) -> str:
     return tag
 
 
-class DockerError(RuntimeError):
-    def __init__(self, reason, cmd=None, proc=None, stdout=None, stderr=None):
-        super().__init__(reason)
-        self.cmd = cmd
-        self.proc = proc
-        self.stdout = stdout
-        self.stderr = stderr
+BUILD_LABEL = "r8.context-hash"
+"""Image label that stores the hash of the build context an image was built from."""
+
+
+def context_hash(directory: Path) -> str:
+    """Hash a docker build context, i.e. the names, permissions and contents of all files."""
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = Path(root) / name
+            h.update(path.relative_to(directory).as_posix().encode() + b"\0")
+            h.update(b"x" if os.access(path, os.X_OK) else b"-")
+            with path.open("rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    h.update(chunk)
+            h.update(b"\0")
+    return h.hexdigest()
+
+
+class ContainerPool:
+    """
+    Idle containers that have been started in advance, so that runs only need a
+    `docker exec` instead of a full `docker run`. Every container is used for a single run
+    only and then discarded, replacements are started in the background.
+    """
+
+    def __init__(self, challenge: "DockerChallenge", size: int, max_age: float):
+        self.challenge = challenge
+        self.size = size
+        self.max_age = max_age
+        self.idle: collections.deque[tuple[str, float]] = collections.deque()
+        """(container name, start time) of all containers that are ready to use"""
+        self.starting = 0
+        self.containers: set[str] = set()
+        """names of all containers that have been started and not removed yet"""
+        self.tasks: set[asyncio.Task] = set()
+        self._expiry: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+
+    def acquire(self) -> Optional[str]:
+        """
+        Take an idle container out of the pool, or return `None` if none is ready.
+        The caller is responsible for passing the container to :meth:`discard` afterwards.
+        """
+        self._expire()
+        container = self.idle.popleft()[0] if self.idle else None
+        self.refill()
+        return container
+
+    def discard(self, name: str) -> None:
+        """Remove a container (in the background) and start a replacement."""
+        self._spawn(self._remove(name))
+        self.refill()
+
+    def refill(self) -> None:
+        """Start containers in the background until the pool is full."""
+        if self.size and self._expiry is None:
+            self._expiry = asyncio.create_task(self._expire_loop())
+        if time.monotonic() < self._retry_at:
+            return
+        while len(self.idle) + self.starting < self.size:
+            self.starting += 1
+            self._spawn(self._start_container())
+
+    async def close(self) -> None:
+        """Stop refilling and remove all containers of this pool."""
+        self.size = 0
+        if self._expiry:
+            self._expiry.cancel()
+        self.idle.clear()
+        # containers that are still starting remove themselves once they are up.
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await asyncio.gather(*[self._remove(name) for name in list(self.containers)])
+
+    def _expire(self) -> None:
+        """Replace idle containers that have exceeded their maximum age."""
+        now = time.monotonic()
+        while self.idle and now - self.idle[0][1] >= self.max_age:
+            self.discard(self.idle.popleft()[0])
+
+    async def _expire_loop(self) -> None:
+        while self.size:
+            # idle containers are ordered by start time.
+            oldest = self.idle[0][1] if self.idle else time.monotonic()
+            await asyncio.sleep(max(1.0, oldest + self.max_age - time.monotonic()))
+            self._expire()
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _start_container(self) -> None:
+        name = "r8_pool_" + secrets.token_hex(8)
+        self.containers.add(name)
+        try:
+            await self.challenge.docker.run(
+                name,
+                self.challenge.docker_tag,
+                self.challenge.docker_args,
+                self.challenge.docker_pool_command[1:],
+                detach=True,
+                entrypoint=self.challenge.docker_pool_command[0],
+            )
+        except DockerError as e:
+            self.challenge.echo(f"Docker: Cannot start pool container: {e}", err=True)
+            # don't hammer the docker daemon if something is broken.
+            self._retry_at = time.monotonic() + 10
+            self.containers.discard(name)
+        else:
+            if self.size:
+                self.idle.append((name, time.monotonic()))
+            else:
+                await self._remove(name)
+        finally:
+            self.starting -= 1
+
+    async def _remove(self, name: str) -> None:
+        try:
+            await self.challenge.docker.remove(name)
+        except DockerError as e:
+            if "No such container" not in str(e):
+                self.challenge.echo(str(e), err=True)
+                return
+        self.containers.discard(name)
 
 
 class DockerChallenge(r8.Challenge):
@@ -54,16 +185,47 @@ class DockerChallenge(r8.Challenge):
         "nobody",
     )
     docker_started: bool = False
+    docker: DockerBackend
+    """The backend that is used to talk to docker, available once the challenge is started."""
+
+    docker_pool_size: ClassVar[int] = 0
+    """
+    Number of idle containers that are kept running for this challenge (disabled by default).
+    Pooled runs use `docker exec` instead of `docker run`, so the image's entrypoint is not
+    applied and the image needs to provide :attr:`docker_pool_command`.
+    """
+    docker_pool_max_age: ClassVar[float] = 600
+    """Idle containers that are older than this (in seconds) are replaced."""
+    docker_pool_command: ClassVar[tuple[str, ...]] = ("sleep", "infinity")
+    """Command that keeps idle containers running."""
 
-    max_concurrent: ClassVar[asyncio.Semaphore] = asyncio.Semaphore(
-        r8.settings.get("docker_max_concurrent", 5)
+    scheduler: ClassVar[Scheduler] = Scheduler(
+        AdaptiveLimit(
+            r8.settings.get("docker_max_concurrent", 5),
+            r8.settings.get("docker_concurrency_min", 1),
+            r8.settings.get(
+                "docker_concurrency_max", r8.settings.get("docker_max_concurrent", 5)
+            ),
+        ),
+        r8.settings.get("docker_max_queue", 50),
+        r8.settings.get("docker_max_wait", 30),
     )
-    """Maximum number of concurrent `docker run` commands."""
-    max_concurrent_build: ClassVar[asyncio.Semaphore] = asyncio.Semaphore(1)
-    """Maximum number of concurrent `docker build` commands on startup."""
+    """Fair queue for `docker run` commands, shared by all challenges."""
+    docker_weight: ClassVar[float] = 1
+    """Relative share of the scheduler that runs of this challenge get."""
+    docker_quota: ClassVar[Optional[int]] = None
+    """Maximum number of concurrent runs of this challenge (unlimited by default)."""
+    max_concurrent_build: ClassVar[asyncio.Semaphore] = asyncio.Semaphore(
+        r8.settings.get("docker_max_concurrent_build", 2)
+    )
+    """
+    Maximum number of concurrent `docker build` commands on startup.
+    Images are only rebuilt if their build context has changed.
+    """
+    builds: ClassVar[dict[str, asyncio.Future[str]]] = {}
+    """Running builds by context hash, so that challenges with the same context share a build."""
     timeout = r8.settings.get("docker_timeout", 10)
     debug = r8.settings.get("docker_debug", False)
-    active_users: ClassVar[set[str]] = set()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -73,6 +235,11 @@ class DockerChallenge(r8.Challenge):
             )
         if not self.docker_tag:
             self.docker_tag = docker_tagify(self.id)
+        self.docker_pool: Optional[ContainerPool] = None
+        if self.docker_pool_size:
+            self.docker_pool = ContainerPool(
+                self, self.docker_pool_size, self.docker_pool_max_age
+            )
 
     async def spin(self):
         """progress indicator when building images"""
@@ -89,95 +256,93 @@ class DockerChallenge(r8.Challenge):
         except asyncio.CancelledError:
             pass
 
-    async def _exec(self, *cmd) -> tuple[asyncio.subprocess.Process, bytes, bytes]:
+    async def start(self):
+        await super().start()
+        self.docker = await docker_backends.acquire()
+        if isinstance(self.docker, docker_backends.APIBackend):
+            try:
+                docker_backends.container_config(self.docker_args)
+            except ValueError as e:
+                self.echo(f"Docker: {e}, falling back to the docker CLI.")
+                self.docker = docker_backends.CLIBackend()
+        if isinstance(self.docker, docker_backends.CLIBackend) and not shutil.which(
+            "docker"
+        ):
+            self.echo("Docker not installed. Cannot start challenge.", err=True)
+            return
         spin = asyncio.ensure_future(self.spin())
         try:
-            proc = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-        except ValueError as e:
-            raise DockerError(str(e), cmd) from e
+            if self.dockerfile:
+                await self._build()
+            elif await self.docker.image_labels(self.docker_tag) is None:
+                self.echo(f"Docker: Pulling {self.docker_tag}...")
+                await self.docker.pull(self.docker_tag)
+                self.echo(f"Docker: {self.docker_tag} pulled.")
         finally:
             spin.cancel()
-        if self.debug:
+        if await self.docker.image_labels(self.docker_tag) is None:
+            raise DockerError(f"No such image: {self.docker_tag}")
+        self.docker_started = True
+        self.echo(f"Docker: {self.docker_tag} ready.")
+        if self.docker_pool:
+            self.docker_pool.refill()
+
+    async def _build(self) -> None:
+        """Build the image, unless it has already been built from the same context."""
+        h = await asyncio.get_running_loop().run_in_executor(
+            None, context_hash, self.dockerfile
+        )
+        labels = await self.docker.image_labels(self.docker_tag)
+        if labels and labels.get(BUILD_LABEL) == h:
+            self.echo(f"Docker: {self.docker_tag} is up to date.")
+            return
+        build = self.builds.get(h)
+        if build is None:
+            build = self.builds[h] = asyncio.ensure_future(self._build_image(h))
+            build.add_done_callback(lambda _: self.builds.pop(h, None))
+        source = await asyncio.shield(build)
+        if source != self.docker_tag:
+            await self.docker.tag(source, self.docker_tag)
+            self.echo(f"Docker: {self.docker_tag} tagged from {source}.")
+
+    async def _build_image(self, h: str) -> str:
+        async with self.max_concurrent_build:
+            self.echo(f"Docker: Building {self.docker_tag}...")
+            start = time.time()
+            await self.docker.build(self.docker_tag, self.dockerfile, {BUILD_LABEL: h})
             self.echo(
-                f"\"{' '.join(shlex.quote(x) for x in cmd)}\" returned {proc.returncode}:"
-                + (f"\n[stdout]\n{stdout.decode()}" if stdout else "")
-                + (f"\n[stderr]\n{stderr.decode()}" if stderr else ""),
-                err=True,
-            )
-        if proc.returncode != 0:
-            err = (
-                f"Execution error (return code: {proc.returncode})\n"
-                f"[command]\n"
-                f"{shlex.join(cmd)}"
+                f"Docker: {self.docker_tag} built "
+                f"(time elapsed: {round(time.time() - start, 2)}s)."
             )
-            if stdout:
-                err += (
-                    f"\n[stdout]"
-                    f"\n{stdout.decode(errors='backslashreplace').strip()}"
-                )
-            if stderr:
-                err += (
-                    f"\n[stderr]"
-                    f"\n{stderr.decode(errors='backslashreplace').strip()}"
-                )
-            raise DockerError(err)
-        return proc, stdout, stderr
+        return self.docker_tag
 
-    async def start(self):
-        await super().start()
-        if self.dockerfile:
-            if shutil.which("docker") is None:
-                self.echo("Docker not installed. Cannot build challenge.", err=True)
-                return
-            async with self.max_concurrent_build:
-                self.echo(f"Docker: Building {self.docker_tag}...")
-                await self._exec(
-                    "docker",
-                    "build",
-                    "-t",
-                    self.docker_tag,
-                    str(self.dockerfile.absolute()),
-                )
-                self.echo(f"Docker: {self.docker_tag} built.")
-        else:
-            _, stdout, _ = await self._exec("docker", "images", "-q", self.docker_tag)
-            if not stdout:
-                self.echo(f"Docker: Pulling {self.docker_tag}...")
-                await self._exec("docker", "pull", self.docker_tag)
-                self.echo(f"Docker: {self.docker_tag} pulled.")
-        await self._exec("docker", "inspect", self.docker_tag)
-        self.docker_started = True
+    async def stop(self):
+        if self.docker_pool:
+            await self.docker_pool.close()
+        await docker_backends.release()
+        await super().stop()
 
     async def docker_run_unlimited(self, *args) -> str:
         """`docker run` without rate limits"""
         if not self.docker_started:
             raise DockerError("Docker service not started.")
         self.echo(f"Docker: run {' '.join(args)}")
-        name = "r8_" + secrets.token_hex(8)
         start = time.time()
 
-        cmd = [
-            "docker",
-            "run",
-            "--rm",
-            "--name",
-            name,
-            *self.docker_args,
-            self.docker_tag,
-            *args,
-        ]
+        pooled = self.docker_pool and self.docker_pool.acquire()
+        if pooled:
+            name = pooled
+            run = self.docker.exec(name, args)
+        else:
+            name = "r8_" + secrets.token_hex(8)
+            run = self.docker.run(name, self.docker_tag, self.docker_args, args)
 
         try:
-            proc, stdout, stderr = await asyncio.wait_for(
-                self._exec(*cmd), timeout=self.timeout
-            )
-        except asyncio.TimeoutError:
+            stdout = await asyncio.wait_for(run, timeout=self.timeout)
+        except asyncio.TimeoutError as timeout:
             self.echo("Docker: Timeout. Killing...")
             try:
-                await self._exec("docker", "kill", name)
+                await self.docker.kill(name)
             except DockerError as e:
                 not_running = "No such container" in str(e) or "is not running" in str(
                     e
@@ -189,20 +354,55 @@ class DockerChallenge(r8.Challenge):
                     raise
             else:
                 self.echo("Docker: Killed.")
-            raise DockerError("Process timed out.", cmd)
+            raise DockerTimeout("Process timed out.", args) from timeout
         else:
             self.echo(
                 f"Docker: finished (time elapsed: {round(time.time() - start, 2)}s)"
             )
             return stdout.strip().decode()
+        finally:
+            if pooled:
+                self.docker_pool.discard(pooled)
 
     async def docker_run(self, user: str, *args) -> str:
-        if user in self.active_users:
-            raise DockerError("Please wait for your previous request to complete.")
-        else:
-            self.active_users.add(user)
-            try:
-                async with self.max_concurrent:
-                    return await self.docker_run_unlimited(*args)
-            finally:
-                self.active_users.remove(user)
+        """
+        `docker run` once it is the user's turn.
+        Raises :class:`DockerBusy` if the queue is full.
+        """
+        async with self.scheduler.slot(user, self):
+            return await self.docker_run_unlimited(*args)
+
+    async def handle_get_request(
+        self, user: str, request: web.Request
+    ) -> Union[str, web.StreamResponse]:
+        if request.match_info["path"] == "/queue":
+            return web.json_response(self.scheduler.status(user, self))
+        return await super().handle_get_request(user, request)
+
+    def queue_status_js(self) -> str:
+        """
+        JS that shows the queue position while a form created with
+        :func:`r8.util.challenge_form_js` is waiting for a response.
+        """
+        return (
+            """
+            <script>{
+            let form = document.currentScript.parentElement.querySelector("form");
+            let response = form.querySelector(".response");
+            let busy = () => form.querySelector('button[type="submit"]').disabled;
+            form.addEventListener("submit", () => {
+                let poll = setInterval(() => {
+                    if (!busy()) return clearInterval(poll);
+                    fetchApi("/api/challenges/" + %s + "/queue").then(json => {
+                        if (busy() && json.position > 0) {
+                            response.textContent = `Queue position ${json.position}, `
+                                + `about ${Math.ceil(json.wait)}s remaining...`;
+                        }
+                    });
+                }, 1000);
+            });
+            }</script>
+            """
+            # challenge ids may contain arbitrary characters, including `</script>`.
+            % json.dumps(self.id).replace("</", "<\\/")
+        )
@@ -0,0 +1,525 @@
+"""
+Backends that talk to the docker daemon for :class:`r8.challenge_mixins.DockerChallenge`.
+
+By default, r8 talks to the Docker Engine API directly if the docker socket is available,
+and falls back to the `docker` command line client otherwise.
+
+Settings:
+    docker_backend: `"auto"` (default), `"api"`, or `"cli"`.
+    docker_socket: Path of the Docker Engine API socket. Defaults to `$DOCKER_HOST`
+        if that is a `unix://` address, otherwise `/var/run/docker.sock`.
+"""
+
+import abc
+import asyncio
+import io
+import json
+import os
+import re
+import shlex
+import struct
+import tarfile
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any
+from typing import Optional
+
+import aiohttp
+
+import r8
+
+API_VERSION = "v1.41"
+"""Docker Engine API version (Docker 20.10 and above)."""
+
+
+class DockerError(RuntimeError):
+    def __init__(self, reason, cmd=None, proc=None, stdout=None, stderr=None):
+        super().__init__(reason)
+        self.cmd = cmd
+        self.proc = proc
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class DockerTimeout(DockerError):
+    """Raised if a container has been killed because it exceeded its timeout."""
+
+
+def execution_error(
+    cmd: Sequence[str], returncode: int, stdout: bytes, stderr: bytes
+) -> DockerError:
+    err = f"Execution error (return code: {returncode})\n[command]\n{shlex.join(cmd)}"
+    if stdout:
+        err += f"\n[stdout]\n{stdout.decode(errors='backslashreplace').strip()}"
+    if stderr:
+        err += f"\n[stderr]\n{stderr.decode(errors='backslashreplace').strip()}"
+    return DockerError(err, cmd, stdout=stdout, stderr=stderr)
+
+
+class DockerBackend(abc.ABC):
+    """
+    Interface to the docker daemon.
+
+    Containers are created with `docker run`-style arguments (see
+    :attr:`r8.challenge_mixins.DockerChallenge.docker_args`). Methods raise
+    :class:`DockerError` if something fails, or if a command exits with a non-zero status.
+    """
+
+    debug: bool = r8.settings.get("docker_debug", False)
+
+    @abc.abstractmethod
+    async def image_labels(self, tag: str) -> Optional[dict[str, str]]:
+        """Get the labels of an image, or `None` if the image does not exist."""
+
+    @abc.abstractmethod
+    async def pull(self, tag: str) -> None:
+        """Pull an image from its registry."""
+
+    @abc.abstractmethod
+    async def build(
+        self, tag: str, context: Path, labels: Optional[dict[str, str]] = None
+    ) -> None:
+        """Build an image from a build context directory."""
+
+    @abc.abstractmethod
+    async def tag(self, source: str, target: str) -> None:
+        """Add another tag to an existing image."""
+
+    @abc.abstractmethod
+    async def run(
+        self,
+        name: str,
+        image: str,
+        args: Sequence[str],
+        cmd: Sequence[str],
+        *,
+        detach: bool = False,
+        entrypoint: Optional[str] = None,
+    ) -> bytes:
+        """
+        Run a container and return its output once it exits.
+        Detached containers are removed automatically once they exit.
+        """
+
+    @abc.abstractmethod
+    async def exec(self, name: str, cmd: Sequence[str]) -> bytes:
+        """Run a command in a running container and return its output."""
+
+    @abc.abstractmethod
+    async def kill(self, name: str) -> None:
+        """Kill a running container."""
+
+    @abc.abstractmethod
+    async def remove(self, name: str) -> None:
+        """Forcefully remove a container."""
+
+    async def close(self) -> None:  # noqa: B027
+        """Release the backend's resources. Optional, most backends do not hold any."""
+
+
+class CLIBackend(DockerBackend):
+    """Run the `docker` command line client for every operation."""
+
+    async def _exec(self, *cmd) -> tuple[asyncio.subprocess.Process, bytes, bytes]:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await proc.communicate()
+        except (ValueError, OSError) as e:
+            raise DockerError(str(e), cmd) from e
+        if self.debug:
+            r8.echo(
+                "docker",
+                f'"{" ".join(shlex.quote(x) for x in cmd)}" returned {proc.returncode}:'
+                + (f"\n[stdout]\n{stdout.decode()}" if stdout else "")
+                + (f"\n[stderr]\n{stderr.decode()}" if stderr else ""),
+                err=True,
+            )
+        if proc.returncode != 0:
+            raise execution_error(cmd, proc.returncode, stdout, stderr)
+        return proc, stdout, stderr
+
+    async def image_labels(self, tag: str) -> Optional[dict[str, str]]:
+        try:
+            _, stdout, _ = await self._exec(
+                "docker", "image", "inspect", "--format", "{{json .Config.Labels}}", tag
+            )
+        except DockerError as e:
+            if "No such image" in str(e):
+                return None
+            raise
+        return json.loads(stdout) or {}
+
+    async def pull(self, tag: str) -> None:
+        await self._exec("docker", "pull", tag)
+
+    async def build(self, tag, context, labels=None):
+        label_args = [f"--label={k}={v}" for k, v in (labels or {}).items()]
+        await self._exec(
+            "docker", "build", "-t", tag, *label_args, str(context.absolute())
+        )
+
+    async def tag(self, source, target):
+        await self._exec("docker", "tag", source, target)
+
+    async def run(self, name, image, args, cmd, *, detach=False, entrypoint=None):
+        options = ["--detach"] if detach else []
+        if entrypoint is not None:
+            options += ["--entrypoint", entrypoint]
+        _, stdout, _ = await self._exec(
+            "docker",
+            "run",
+            *options,
+            "--rm",
+            "--name",
+            name,
+            *args,
+            image,
+            *cmd,
+        )
+        return stdout
+
+    async def exec(self, name, cmd):
+        _, stdout, _ = await self._exec("docker", "exec", name, *cmd)
+        return stdout
+
+    async def kill(self, name):
+        await self._exec("docker", "kill", name)
+
+    async def remove(self, name):
+        await self._exec("docker", "rm", "--force", name)
+
+
+class APIBackend(DockerBackend):
+    """
+    Talk to the Docker Engine API over its unix socket.
+    This avoids starting a `docker` client process for every operation.
+    """
+
+    def __init__(self, socket: str):
+        self.socket = socket
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(self.socket),
+                timeout=aiohttp.ClientTimeout(total=None),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method: str, path: str, **kwargs) -> bytes:
+        """Send a request to the Engine API and return the response body."""
+        url = f"http://docker/{API_VERSION}{path}"
+        try:
+            async with self.session.request(method, url, **kwargs) as resp:
+                body = await resp.read()
+        except aiohttp.ClientError as e:
+            raise DockerError(f"Cannot connect to docker: {e}", (method, path)) from e
+        if self.debug:
+            r8.echo("docker", f"{method} {path} returned {resp.status}", err=True)
+        if resp.status >= 400:
+            try:
+                message = json.loads(body)["message"]
+            except (ValueError, KeyError, TypeError):
+                message = body.decode(errors="backslashreplace")
+            raise DockerError(message, (method, path))
+        return body
+
+    async def _json(self, method: str, path: str, **kwargs) -> Any:
+        return json.loads(await self.request(method, path, **kwargs) or "null")
+
+    async def _progress(self, method: str, path: str, **kwargs) -> None:
+        """Consume a stream of JSON progress messages, as returned by /build and /images/create."""
+        body = await self.request(method, path, **kwargs)
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            if "error" in message:
+                raise DockerError(message["error"], (method, path))
+
+    async def ping(self) -> None:
+        await self.request("GET", "/_ping")
+
+    async def image_labels(self, tag: str) -> Optional[dict[str, str]]:
+        try:
+            image = await self._json("GET", f"/images/{tag}/json")
+        except DockerError as e:
+            if "No such image" in str(e):
+                return None
+            raise
+        return (image.get("Config") or {}).get("Labels") or {}
+
+    async def pull(self, tag: str) -> None:
+        await self._progress("POST", "/images/create", params={"fromImage": tag})
+
+    async def build(self, tag, context, labels=None):
+        data = await asyncio.get_running_loop().run_in_executor(
+            None, _tar, context.absolute()
+        )
+        await self._progress(
+            "POST",
+            "/build",
+            params={"t": tag, "rm": "1", "labels": json.dumps(labels or {})},
+            data=data,
+            headers={"Content-Type": "application/x-tar"},
+        )
+
+    async def tag(self, source, target):
+        repo, tag = target, "latest"
+        if ":" in target.rsplit("/", 1)[-1]:
+            repo, tag = target.rsplit(":", 1)
+        await self.request(
+            "POST", f"/images/{source}/tag", params={"repo": repo, "tag": tag}
+        )
+
+    async def create(
+        self,
+        name: str,
+        image: str,
+        args: Sequence[str],
+        cmd: Sequence[str],
+        *,
+        auto_remove: bool = False,
+        entrypoint: Optional[str] = None,
+    ) -> None:
+        config = container_config(args)
+        config["Image"] = image
+        config["Cmd"] = list(cmd)
+        if entrypoint is not None:
+            config["Entrypoint"] = [entrypoint]
+        config["HostConfig"]["AutoRemove"] = auto_remove
+        await self.request(
+            "POST", "/containers/create", params={"name": name}, json=config
+        )
+
+    async def start(self, name: str) -> None:
+        await self.request("POST", f"/containers/{name}/start")
+
+    async def wait(self, name: str) -> int:
+        """Wait for a container to exit and return its exit code."""
+        status = await self._json("POST", f"/containers/{name}/wait")
+        if status.get("Error"):
+            raise DockerError(status["Error"].get("Message", "wait failed"))
+        return status["StatusCode"]
+
+    async def logs(self, name: str) -> tuple[bytes, bytes]:
+        body = await self.request(
+            "GET", f"/containers/{name}/logs", params={"stdout": "1", "stderr": "1"}
+        )
+        return _demux(body)
+
+    async def kill(self, name: str) -> None:
+        await self.request("POST", f"/containers/{name}/kill")
+
+    async def remove(self, name: str) -> None:
+        await self.request("DELETE", f"/containers/{name}", params={"force": "1"})
+
+    async def run(self, name, image, args, cmd, *, detach=False, entrypoint=None):
+        try:
+            await self.create(
+                name, image, args, cmd, auto_remove=detach, entrypoint=entrypoint
+            )
+            await self.start(name)
+            if detach:
+                return b""
+            returncode = await self.wait(name)
+            stdout, stderr = await self.logs(name)
+        except BaseException:
+            # the container may have been created even if we have been interrupted.
+            await asyncio.shield(self._remove_quietly(name))
+            raise
+        # container logs are not available anymore with AutoRemove,
+        # so we remove the container ourselves.
+        await asyncio.shield(self._remove_quietly(name))
+        if returncode != 0:
+            raise execution_error(cmd, returncode, stdout, stderr)
+        return stdout
+
+    async def exec(self, name, cmd):
+        exec_id = (
+            await self._json(
+                "POST",
+                f"/containers/{name}/exec",
+                json={"Cmd": list(cmd), "AttachStdout": True, "AttachStderr": True},
+            )
+        )["Id"]
+        body = await self.request(
+            "POST", f"/exec/{exec_id}/start", json={"Detach": False, "Tty": False}
+        )
+        stdout, stderr = _demux(body)
+        returncode = (await self._json("GET", f"/exec/{exec_id}/json"))["ExitCode"]
+        if returncode != 0:
+            raise execution_error(cmd, returncode, stdout, stderr)
+        return stdout
+
+    async def _remove_quietly(self, name: str) -> None:
+        try:
+            await self.remove(name)
+        except DockerError as e:
+            if "No such container" not in str(e):
+                r8.echo("docker", str(e), err=True)
+
+
+def _tar(directory: Path) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        tar.add(directory, arcname=".")
+    return buf.getvalue()
+
+
+def _demux(data: bytes) -> tuple[bytes, bytes]:
+    """Split a multiplexed container output stream into stdout and stderr."""
+    streams = {1: bytearray(), 2: bytearray()}
+    i = 0
+    while i + 8 <= len(data):
+        stream, size = struct.unpack(">BxxxL", data[i : i + 8])
+        streams.get(stream, streams[1]).extend(data[i + 8 : i + 8 + size])
+        i += 8 + size
+    return bytes(streams[1]), bytes(streams[2])
+
+
+def _size(value: str) -> int:
+    match = re.fullmatch(r"(\d+)([bkmg]?)b?", value.lower())
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    number, unit = match.groups()
+    return int(number) * 1024 ** "bkmg".index(unit or "b")
+
+
+_host_options = {
+    "--network": ("NetworkMode", str),
+    "--memory": ("Memory", _size),
+    "--memory-swap": ("MemorySwap", _size),
+    "--kernel-memory": ("KernelMemory", _size),
+    "--cpu-shares": ("CpuShares", int),
+    "--cpus": ("NanoCpus", lambda x: int(float(x) * 1e9)),
+    "--blkio-weight": ("BlkioWeight", int),
+    "--pids-limit": ("PidsLimit", int),
+}
+_host_list_options = {
+    "--cap-drop": "CapDrop",
+    "--cap-add": "CapAdd",
+    "--security-opt": "SecurityOpt",
+}
+_host_flags = {
+    "--read-only": "ReadonlyRootfs",
+    "--init": "Init",
+}
+_container_options = {
+    "--user": "User",
+    "-u": "User",
+    "--workdir": "WorkingDir",
+    "-w": "WorkingDir",
+}
+
+
+def container_config(args: Sequence[str]) -> dict:
+    """
+    Translate `docker run` arguments into an Engine API container configuration.
+    Raises a `ValueError` for arguments that are not supported.
+    """
+    config: dict = {"HostConfig": {}}
+    host = config["HostConfig"]
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg.startswith("--") and "=" in arg:
+            arg, value = arg.split("=", 1)
+            args.insert(0, value)
+        if arg in _host_flags:
+            host[_host_flags[arg]] = True
+            continue
+        if not args:
+            raise ValueError(f"Unsupported docker argument: {arg}")
+        if arg in _host_options:
+            key, parse = _host_options[arg]
+            host[key] = parse(args.pop(0))
+        elif arg in _host_list_options:
+            host.setdefault(_host_list_options[arg], []).append(args.pop(0))
+        elif arg in _container_options:
+            config[_container_options[arg]] = args.pop(0)
+        elif arg in ("--env", "-e"):
+            config.setdefault("Env", []).append(args.pop(0))
+        elif arg == "--tmpfs":
+            path, _, options = args.pop(0).partition(":")
+            host.setdefault("Tmpfs", {})[path] = options
+        else:
+            raise ValueError(f"Unsupported docker argument: {arg}")
+    return config
+
+
+def _socket_path() -> str:
+    if path := r8.settings.get("docker_socket"):
+        return path
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return host.removeprefix("unix://")
+    return "/var/run/docker.sock"
+
+
+_shared: Optional[asyncio.Future[DockerBackend]] = None
+"""the connection to docker that is shared by all challenges, which may still be pending"""
+_users = 0
+
+
+async def acquire() -> DockerBackend:
+    """
+    Get the backend that is shared by all challenges, connecting to docker if necessary.
+    Every successful call must be paired with a call to :func:`release`.
+    """
+    global _shared, _users
+    if _shared is None:
+        _shared = asyncio.ensure_future(_connect())
+    shared = _shared
+    # count the caller right away, so that a concurrent release() does not close the backend.
+    _users += 1
+    try:
+        return await asyncio.shield(shared)
+    except BaseException:
+        _users -= 1
+        if _users == 0 and _shared is shared:
+            _shared = None
+            shared.add_done_callback(_close_unused)
+        raise
+
+
+async def release() -> None:
+    global _shared, _users
+    _users = max(0, _users - 1)
+    if _users == 0 and _shared is not None:
+        shared, _shared = _shared, None
+        await (await shared).close()
+
+
+def _close_unused(connect: asyncio.Future[DockerBackend]) -> None:
+    """Close the backend of a connection attempt that no caller is waiting for anymore."""
+    if not connect.cancelled() and connect.exception() is None:
+        asyncio.ensure_future(connect.result().close())
+
+
+async def _connect() -> DockerBackend:
+    mode = r8.settings.get("docker_backend", "auto")
+    if mode == "cli":
+        return CLIBackend()
+    socket = _socket_path()
+    if mode == "auto" and not os.path.exists(socket):
+        return CLIBackend()
+    backend = APIBackend(socket)
+    try:
+        await backend.ping()
+    except DockerError as e:
+        await backend.close()
+        if mode == "api":
+            raise
+        r8.echo("docker", f"{e}, falling back to the docker CLI.", err=True)
+        return CLIBackend()
+    return backend
@@ -0,0 +1,269 @@
+"""
+Fair scheduling of docker runs.
+
+Runs are queued per user and dispatched with start-time fair queueing, so that a burst of
+requests from a few users cannot starve everyone else. The cost of a run is the observed
+duration of the challenge's runs divided by its :attr:`DockerChallenge.docker_weight`.
+Challenges can additionally limit their number of concurrent runs with
+:attr:`DockerChallenge.docker_quota`.
+
+The number of concurrent runs adapts to the observed run latency, see :class:`AdaptiveLimit`.
+
+Settings:
+    docker_max_concurrent: Initial number of concurrent runs, defaults to 5.
+    docker_concurrency_min: Lower bound for the number of concurrent runs, defaults to 1.
+    docker_concurrency_max: Upper bound for the number of concurrent runs,
+        defaults to `docker_max_concurrent`, i.e. the limit is only ever decreased.
+        Set this higher to let the limit grow while runs stay fast.
+    docker_max_queue: Requests are rejected if this many runs are queued, defaults to 50.
+    docker_max_wait: Requests are rejected if the expected wait (in seconds)
+        exceeds this, defaults to 30.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
+import itertools
+import math
+import time
+from typing import TYPE_CHECKING
+from typing import Optional
+from typing import Union
+
+import r8
+from r8.challenge_mixins.docker_backends import DockerError
+from r8.challenge_mixins.docker_backends import DockerTimeout
+
+if TYPE_CHECKING:
+    from r8.challenge_mixins.docker import DockerChallenge
+
+DEFAULT_DURATION = 1.0
+"""Expected duration of a run (in seconds) for challenges that have not been run yet."""
+
+
+class DockerBusy(DockerError):
+    """Raised if the scheduler is overloaded. Clients should retry after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdaptiveLimit:
+    """
+    A concurrency limit that adapts to the observed run latency (AIMD).
+
+    While runs are as fast as usual and the limit is fully used, it is increased by one
+    per round of runs. If runs time out or a challenge's recent runs are much slower than
+    its long-term average, containers are contending for resources and the limit is
+    decreased multiplicatively. Comparing averages instead of single runs makes sure that
+    runs which are slow because of their input do not count as congestion.
+    """
+
+    tolerance = 2.0
+    """Congestion threshold for the ratio of recent to long-term run duration."""
+    backoff = 0.75
+    """Factor by which the limit is decreased on congestion."""
+
+    def __init__(self, initial: float, min_limit: int, max_limit: int):
+        self.min = min_limit
+        self.max = max(min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min), self.max))
+        self.latencies: dict[str, tuple[float, float]] = {}
+        """recent and long-term average run duration by challenge id"""
+        self._last_decrease = 0.0
+
+    @property
+    def value(self) -> int:
+        return int(self.limit)
+
+    def duration(self, cid: str) -> float:
+        """Expected duration of a challenge's next run, based on its recent runs."""
+        return self.latencies.get(cid, (DEFAULT_DURATION,))[0]
+
+    def update(
+        self, cid: str, started: float, elapsed: float, timed_out: bool, saturated: bool
+    ) -> None:
+        """Adjust the limit after a run that has been started at `started`."""
+        recent, long_term = self.latencies.get(cid, (elapsed, elapsed))
+        if not timed_out:
+            recent = 0.9 * recent + 0.1 * elapsed
+            long_term = 0.99 * long_term + 0.01 * elapsed
+            self.latencies[cid] = (recent, long_term)
+        congested = timed_out or recent > self.tolerance * long_term
+        if congested:
+            # runs that were started before the last decrease do not reflect it yet.
+            if started > self._last_decrease:
+                self.limit *= self.backoff
+                self._last_decrease = time.monotonic()
+        elif saturated:
+            self.limit += 1 / self.limit
+        self.limit = min(max(self.limit, self.min), self.max)
+
+
+class _Request:
+    def __init__(self, seq: int, user: str, challenge: DockerChallenge, tag: float):
+        self.seq = seq
+        self.user = user
+        self.challenge = challenge
+        self.tag = tag
+        """virtual start time, requests are dispatched in order of their tag"""
+        self.ready: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self.started = 0.0
+
+    def __lt__(self, other: _Request) -> bool:
+        return (self.tag, self.seq) < (other.tag, other.seq)
+
+
+class Scheduler:
+    def __init__(
+        self, limit: Union[int, AdaptiveLimit], max_queue: int, max_wait: float
+    ):
+        if isinstance(limit, int):
+            limit = AdaptiveLimit(limit, limit, limit)
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.queue: list[_Request] = []
+        self.running: set[_Request] = set()
+        self.running_by_challenge: collections.Counter[str] = collections.Counter()
+        self.active: set[tuple[str, str]] = set()
+        """(user, challenge id) of all queued and running requests"""
+        self.virtual_time = 0.0
+        self.finish_tags: dict[str, float] = {}
+        self._seq = itertools.count()
+
+    def duration(self, challenge: DockerChallenge) -> float:
+        return self.limit.duration(challenge.id)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user: str, challenge: DockerChallenge):
+        """Wait for this user's turn to run the challenge."""
+        key = (user, challenge.id)
+        if key in self.active:
+            raise DockerError("Please wait for your previous request to complete.")
+        wait = self.expected_wait()
+        if len(self.queue) >= self.max_queue or wait > self.max_wait:
+            raise DockerBusy(
+                "Too many requests, please try again later.",
+                retry_after=max(1, math.ceil(wait)),
+            )
+
+        start = max(self.virtual_time, self.finish_tags.get(user, 0.0))
+        self.finish_tags[user] = (
+            start + self.duration(challenge) / challenge.docker_weight
+        )
+        req = _Request(next(self._seq), user, challenge, start)
+        self.active.add(key)
+        self.queue.append(req)
+        try:
+            self._dispatch()
+            try:
+                await req.ready
+            except asyncio.CancelledError:
+                if req in self.queue:
+                    self.queue.remove(req)
+                else:
+                    # cancelled right after being dispatched.
+                    self._finish(req, record=False)
+                raise
+            timed_out = False
+            try:
+                yield
+            except DockerTimeout:
+                timed_out = True
+                raise
+            finally:
+                self._finish(req, timed_out=timed_out)
+        finally:
+            self.active.discard(key)
+
+    def _dispatch(self) -> None:
+        while len(self.running) < self.limit.value:
+            req = min(
+                (
+                    r
+                    for r in self.queue
+                    if r.challenge.docker_quota is None
+                    or self.running_by_challenge[r.challenge.id]
+                    < r.challenge.docker_quota
+                ),
+                default=None,
+            )
+            if req is None:
+                break
+            self.queue.remove(req)
+            self.virtual_time = max(self.virtual_time, req.tag)
+            self.running.add(req)
+            self.running_by_challenge[req.challenge.id] += 1
+            req.started = time.monotonic()
+            if not req.ready.done():
+                req.ready.set_result(None)
+
+    def _finish(
+        self, req: _Request, record: bool = True, timed_out: bool = False
+    ) -> None:
+        cid = req.challenge.id
+        saturated = len(self.running) >= self.limit.value or bool(self.queue)
+        self.running.remove(req)
+        self.running_by_challenge[cid] -= 1
+        if record:
+            elapsed = time.monotonic() - req.started
+            before = self.limit.value
+            self.limit.update(cid, req.started, elapsed, timed_out, saturated)
+            if self.limit.value != before:
+                r8.echo(
+                    "docker",
+                    f"Concurrency limit: {before} -> {self.limit.value} "
+                    f"({len(self.queue)} queued).",
+                )
+        self._dispatch()
+
+    def _remaining(self) -> list[float]:
+        now = time.monotonic()
+        return [
+            max(0.0, self.duration(r.challenge) - (now - r.started))
+            for r in self.running
+        ]
+
+    def expected_wait(self, ahead: Optional[list[_Request]] = None) -> float:
+        """
+        Estimate how long a request has to wait until it is dispatched,
+        given the requests that will be dispatched before it (default: all queued requests).
+        """
+        if ahead is None:
+            ahead = self.queue
+        if len(self.running) + len(ahead) < self.limit.value:
+            return 0.0
+        work = sum(self._remaining()) + sum(self.duration(r.challenge) for r in ahead)
+        return work / self.limit.value
+
+    def stats(self) -> dict:
+        """Current concurrency limit and load, for monitoring."""
+        return {
+            "limit": self.limit.value,
+            "running": len(self.running),
+            "queued": len(self.queue),
+        }
+
+    def status(self, user: str, challenge: DockerChallenge) -> dict:
+        """
+        Queue position (starting at 1, 0 if running) and expected wait for a user's request,
+        in addition to :meth:`stats`.
+        """
+        queue = sorted(self.queue)
+        for i, req in enumerate(queue):
+            if req.user == user and req.challenge is challenge:
+                return {
+                    "position": i + 1,
+                    "wait": round(self.expected_wait(queue[:i]), 1),
+                    **self.stats(),
+                }
+        running = any(r.user == user and r.challenge is challenge for r in self.running)
+        return {
+            "position": 0 if running else None,
+            "wait": 0 if running else round(self.expected_wait(), 1),
+            **self.stats(),
+        }
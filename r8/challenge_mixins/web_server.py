@@ -21,8 +21,8 @@ def log_nonsafe(request: web.Request) -> bool:
 
 class WebServerChallenge(r8.Challenge):
     runner: web.AppRunner = None
-    log_web_requests: Union[bool, Callable[[web.Request], bool]] = (
-        lambda self, x: log_nonstatic(x)
+    log_web_requests: Union[bool, Callable[[web.Request], bool]] = lambda self, x: (
+        log_nonstatic(x)
     )
 
     @property
@@ -65,7 +65,7 @@ def make_logger(challenge: WebServerChallenge):
 
         req_str = f"{request.method} {request.path_qs}"
         # We want this to appear before any challenge-specific logging...
-        rowid = r8.log(request, "handle-request", req_str, cid=challenge.id)
+        entry = r8.util.log_entry(request, "handle-request", req_str, cid=challenge.id)
 
         resp_str: str = ""
         try:
@@ -91,10 +91,6 @@ def make_logger(challenge: WebServerChallenge):
             except Exception as e:
                 req_text = req_text or f"{e}"
             req_str = f"{req_str} {req_text}".rstrip()
-            with r8.db:
-                r8.db.execute(
-                    """UPDATE events SET data = ? WHERE ROWID = ?""",
-                    (f"{req_str} -> {resp_str}", rowid),
-                )
+            entry.update_data(f"{req_str} -> {resp_str}")
 
     return log_request
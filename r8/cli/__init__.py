@@ -7,6 +7,7 @@ from r8.cli.password import cli as password_cli
 from r8.cli.run import cli as run_cli
 from r8.cli.settings import cli as settings_cli
 from r8.cli.sql import cli as sql_cli
+from r8.cli.static import cli as static_cli
 from r8.cli.teams import cli as teams_cli
 from r8.cli.users import cli as users_cli
 
@@ -23,5 +24,6 @@ main.add_command(password_cli)
 main.add_command(run_cli)
 main.add_command(settings_cli)
 main.add_command(sql_cli)
+main.add_command(static_cli)
 main.add_command(teams_cli)
 main.add_command(users_cli)
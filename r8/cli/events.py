@@ -68,7 +68,9 @@ def cli(rows, watch, query):
         format_event("time", "ip", "type", "data", "cid", "uid", "tid"), fg="cyan"
     )
 
+    directory = r8.state.Directory.read(r8.db)
     while True:
+        directory = r8.state.Directory.read(r8.db, directory.data_version) or directory
         with r8.db:
             new = r8.db.execute(
                 f"""
@@ -80,7 +82,7 @@ def cli(rows, watch, query):
             ).fetchall()
         seen += len(new)
         for t, ip, type, data, cid, uid in new:
-            print(format_event(t, ip, type, data, cid, uid, r8.util.get_team(uid)))
+            print(format_event(t, ip, type, data, cid, uid, directory.get_team(uid)))
         if not watch:
             break
         time.sleep(0.5)
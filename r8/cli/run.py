@@ -6,6 +6,7 @@ import click
 
 import r8
 from r8 import cars
+from r8 import migrations
 from r8 import server
 from r8 import util
 
@@ -17,12 +18,17 @@ _log_sql = print
 @util.with_database(echo=True)
 def cli(debug) -> None:
     """Run the server."""
+    if migrations.current_version(r8.db) < migrations.LATEST_VERSION:
+        raise click.UsageError(
+            "The database schema is outdated. Run `r8 sql migrate` to upgrade it."
+        )
     print(cars.best_car())
 
     loop = asyncio.get_event_loop()
 
     if debug:
         r8.db.set_trace_callback(lambda msg: _log_sql(msg))
+        r8.async_db.trace_callback = lambda msg: _log_sql(msg)
         loop.set_debug(True)
 
     r8.challenges.load()
@@ -45,5 +51,6 @@ def cli(debug) -> None:
             server.stop(),
         )
     )
+    loop.run_until_complete(r8.async_db.flush())
     r8.echo("r8", "Shut down.")
     loop.close()
@@ -7,6 +7,7 @@ from pathlib import Path
 import click
 
 import r8
+from r8 import migrations
 from r8 import util
 
 
@@ -49,61 +50,7 @@ def init(origin, static_dir, host, port, database) -> None:
     if os.path.exists(database):
         raise click.UsageError("Database already exists.")
     conn = util.sqlite3_connect(database)
-    conn.executescript(
-        """
-        /* Do not add `ON DELETE CASCADE` to the key constraints, it does not work well with our config.sql approach.
-           SQL triggers fire immediately (even if constraints are deferred), so a `DELETE FROM challenges; 
-           INSERT INTO challenges [...];` will delete all dependents in between. */
-        CREATE TABLE users (
-            uid TEXT PRIMARY KEY NOT NULL,
-            password TEXT NOT NULL
-        );
-        CREATE TABLE challenges (
-            cid TEXT PRIMARY KEY NOT NULL,
-            team BOOLEAN NOT NULL DEFAULT 0,
-            t_start DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-            t_stop DATETIME NOT NULL
-        );
-        CREATE TABLE flags (
-            fid TEXT PRIMARY KEY NOT NULL,
-            cid TEXT NOT NULL,
-            max_submissions INTEGER NOT NULL,
-            FOREIGN KEY (cid) REFERENCES challenges(cid)
-        );
-        CREATE TABLE submissions (
-            uid TEXT NOT NULL,
-            fid TEXT NOT NULL,
-            timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (uid) REFERENCES users(uid),
-            FOREIGN KEY (fid) REFERENCES flags(fid),
-            PRIMARY KEY (uid, fid)
-        );
-        CREATE TABLE events (
-            time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-            ip TEXT NOT NULL,
-            type TEXT NOT NULL,
-            data TEXT,
-            cid TEXT,
-            uid TEXT
-        );
-        CREATE TABLE teams (
-            uid TEXT PRIMARY KEY NOT NULL,
-            tid TEXT NOT NULL,
-            FOREIGN KEY (uid) REFERENCES users(uid)
-        );
-        CREATE TABLE data (
-          cid TEXT NOT NULL,
-          key TEXT NOT NULL,
-          value TEXT NOT NULL,
-          FOREIGN KEY (cid) REFERENCES challenges(cid),
-          PRIMARY KEY (cid, key)
-        );
-        CREATE TABLE settings (
-            key TEXT PRIMARY KEY NOT NULL,
-            value TEXT NOT NULL
-        );
-    """
-    )
+    migrations.migrate(conn)
     conn.executemany(
         "INSERT INTO settings (key, value) VALUES (?,?)",
         [
@@ -121,6 +68,18 @@ def init(origin, static_dir, host, port, database) -> None:
     r8.echo("r8", f"{database} initialized!")
 
 
+@cli.command()
+@util.with_database()
+@util.backup_db
+def migrate():
+    """Upgrade the database schema to the latest version."""
+    applied = migrations.migrate(r8.db)
+    if applied:
+        r8.echo("r8", f"Applied migration(s): {', '.join(map(str, applied))}.")
+    else:
+        r8.echo("r8", "Database is up to date.")
+
+
 @cli.command()
 @util.with_database()
 @util.backup_db
@@ -0,0 +1,43 @@
+import time
+from pathlib import Path
+
+import click
+
+import r8
+from r8 import bundles
+from r8 import util
+
+
+@click.group("static")
+def cli():
+    """Frontend-related commands."""
+
+
+@cli.command()
+@util.with_database()
+@click.option(
+    "--output",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Output directory. Defaults to the first entry of the static_dir setting.",
+)
+def build(output):
+    """
+    Precompile the frontend's JSX into minified bundles.
+
+    By default, browsers compile the React code of r8's pages themselves, which requires
+    downloading babel.js and is slow on mobile devices. This command compiles all
+    pages in advance and writes the resulting bundles to js/bundles/ in OUTPUT,
+    which needs to be part of static_dir. Pages automatically use the bundles if the
+    templates have not changed since, so this needs to be re-run after template changes.
+    Restart r8 (or enable the static_watch setting) to pick up a new build.
+    """
+    static_dir = r8.settings["static_dir"]
+    if isinstance(static_dir, str):
+        static_dir = [static_dir]
+    if output is None:
+        output = Path(static_dir[0])
+    built = bundles.build(static_dir, output, {"r8": r8, "time": time})
+    for path, page in built.items():
+        click.echo(f"{page} -> {output / path}")
+    if not built:
+        click.echo("No pages with JSX found.")
@@ -0,0 +1,144 @@
+"""
+Response compression for r8's web server.
+
+Compressible responses above a size threshold are compressed with the best encoding the
+client accepts: zstd or brotli if the respective package is installed, otherwise gzip.
+Responses that carry an ETag are typically served from a cache (see :mod:`r8.pages` and
+:mod:`r8.staticfiles`), so their compressed bodies are cached as well.
+
+Settings:
+    compression_level: 1 (fast) to 9 (small), defaults to 6.
+    compression_min_size: Responses smaller than this (in bytes) are sent uncompressed.
+"""
+
+import asyncio
+import collections
+import gzip
+import hashlib
+from typing import Callable
+from typing import Optional
+
+from aiohttp import hdrs
+from aiohttp import web
+
+import r8
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+EXECUTOR_SIZE = 256 * 1024
+"""Bodies larger than this are compressed in a thread to not block the event loop."""
+
+CACHE_SIZE = 16 * 1024 * 1024
+"""Maximum total size of cached compressed bodies."""
+
+
+def _compressors(level: int) -> dict[str, Callable[[bytes], bytes]]:
+    """Content-Encoding -> compression function, in order of preference."""
+    ret = {}
+    if zstandard:
+        ret["zstd"] = zstandard.ZstdCompressor(level=level).compress
+    if brotli:
+        ret["br"] = lambda data: brotli.compress(data, quality=level)
+    ret["gzip"] = lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+    return ret
+
+
+class _Cache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: collections.OrderedDict[tuple[bytes, str], bytes] = (
+            collections.OrderedDict()
+        )
+        self.size = 0
+
+    def get(self, key: tuple[bytes, str]) -> Optional[bytes]:
+        if (ret := self.entries.get(key)) is not None:
+            self.entries.move_to_end(key)
+        return ret
+
+    def put(self, key: tuple[bytes, str], value: bytes) -> None:
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_size:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+
+def _accepted(request: web.Request, encodings) -> Optional[str]:
+    """Pick the first of `encodings` that is accepted by the client."""
+    accepted = set()
+    for item in request.headers.get(hdrs.ACCEPT_ENCODING, "").lower().split(","):
+        name, _, params = item.partition(";")
+        try:
+            q = float(params.strip().removeprefix("q=") or 1)
+        except ValueError:
+            q = 1
+        if q > 0:
+            accepted.add(name.strip())
+    return next((e for e in encodings if e in accepted), None)
+
+
+def middleware():
+    """Create a compression middleware that is configured from r8's settings."""
+    compressors = _compressors(r8.settings.get("compression_level", 6))
+    min_size = r8.settings.get("compression_min_size", 1024)
+    cache = _Cache(CACHE_SIZE)
+
+    @web.middleware
+    async def compress(request: web.Request, handler):
+        resp = await handler(request)
+        if (
+            not isinstance(resp, web.Response)
+            or resp.status != 200
+            or resp.content_type not in COMPRESSIBLE_TYPES
+            or hdrs.CONTENT_ENCODING in resp.headers
+            or not isinstance(resp.body, bytes)
+            or len(resp.body) < min_size
+        ):
+            return resp
+        if hdrs.ACCEPT_ENCODING not in resp.headers.getall(hdrs.VARY, ()):
+            resp.headers.add(hdrs.VARY, hdrs.ACCEPT_ENCODING)
+        if not (encoding := _accepted(request, compressors)):
+            return resp
+
+        body = resp.body
+        etag = resp.headers.get(hdrs.ETAG)
+        if etag:
+            key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+            compressed = cache.get(key)
+        if not etag or compressed is None:
+            if len(body) > EXECUTOR_SIZE:
+                compressed = await asyncio.get_running_loop().run_in_executor(
+                    None, compressors[encoding], body
+                )
+            else:
+                compressed = compressors[encoding](body)
+            if etag:
+                cache.put(key, compressed)
+
+        resp.body = compressed
+        resp.headers[hdrs.CONTENT_ENCODING] = encoding
+        if etag and not etag.startswith("W/"):
+            # the compressed representation is different, but semantically equivalent.
+            resp.headers[hdrs.ETAG] = f"W/{etag}"
+        return resp
+
+    return compress
@@ -0,0 +1,242 @@
+"""
+Non-blocking access to r8's SQLite database.
+
+SQLite calls block, so running them on the event loop means that a single slow query
+(or a lock wait) stalls every HTTP, WebSocket and TCP connection at once.
+:class:`Database` moves them onto threads instead:
+all writes are serialized through one writer connection,
+and reads are spread across a small pool of read-only connections.
+"""
+
+import asyncio
+import concurrent.futures
+import sqlite3
+import queue
+import threading
+import time
+import traceback
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import TypeVar
+
+import r8
+
+T = TypeVar("T")
+
+PRAGMAS = {
+    # WAL allows readers to proceed while a write is in progress.
+    "journal_mode": "WAL",
+    # In WAL mode, NORMAL is still safe against corruption and avoids an fsync per commit.
+    "synchronous": "NORMAL",
+    # 16 MiB page cache per connection.
+    "cache_size": -16 * 1024,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+
+def configure(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Apply r8's connection pragmas to an existing connection."""
+    for key, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {key} = {value}")
+    return conn
+
+
+class Database:
+    """
+    Async facade for the SQLite database.
+
+    Writes run on a single dedicated thread with its own connection, which makes them
+    strictly ordered. Reads run on a pool of `readers` threads, each with its own
+    read-only connection. Connections are opened lazily on first use.
+
+    Writes are group-committed: the writer thread collects queued writes for up to
+    `batch_delay` seconds or `batch_size` jobs and commits them in one transaction.
+    Each job runs in its own savepoint, so a failing job does not affect the others.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        readers: int = 4,
+        *,
+        batch_size: int = 256,
+        batch_delay: float = 0.002,
+    ):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.trace_callback: Optional[Callable[[str], None]] = None
+        self._local = threading.local()
+        self._queue: queue.SimpleQueue[Optional[_Job]] = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        self._readers = concurrent.futures.ThreadPoolExecutor(
+            readers, "r8-db-reader", initializer=self._connect, initargs=(True,)
+        )
+
+    def _connect(self, readonly: bool) -> None:
+        conn = configure(sqlite3.connect(self.filename, 10))
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        if self.trace_callback:
+            conn.set_trace_callback(self.trace_callback)
+        self._local.conn = conn
+
+    def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        conn: sqlite3.Connection = self._local.conn
+        with conn:
+            return fn(conn, *args)
+
+    def _submit(
+        self, fn: Callable[..., T], *args: Any
+    ) -> "concurrent.futures.Future[T]":
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="r8-db-writer", daemon=True
+                )
+                self._writer.start()
+        fut: concurrent.futures.Future[T] = concurrent.futures.Future()
+        self._queue.put((fn, args, fut))
+        return fut
+
+    def _write_loop(self) -> None:
+        self._connect(False)
+        conn: sqlite3.Connection = self._local.conn
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    job = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)
+                    break
+                batch.append(job)
+            self._commit(conn, batch)
+
+    def _commit(self, conn: sqlite3.Connection, batch: list["_Job"]) -> None:
+        results: list[tuple[concurrent.futures.Future, bool, Any]] = []
+        try:
+            conn.execute("BEGIN")
+            for fn, args, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = fn(conn, *args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    results.append((fut, False, e))
+                else:
+                    results.append((fut, True, result))
+                conn.execute("RELEASE job")
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, fut in batch:
+                if not fut.done():
+                    if fut.running():
+                        fut.set_exception(e)
+                    else:
+                        fut.cancel()
+            return
+        # Only notify after the commit, so that a completed write is durable.
+        for fut, ok, value in results:
+            if ok:
+                fut.set_result(value)
+            else:
+                fut.set_exception(value)
+
+    async def read(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run `fn(connection, *args)` on one of the reader connections."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run, fn, *args)
+
+    async def write(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Run `fn(connection, *args)` on the writer connection.
+        `fn` must not commit or roll back, it is part of the next group commit.
+        """
+        return await asyncio.wrap_future(self._submit(fn, *args))
+
+    def write_nowait(
+        self, fn: Callable[..., T], *args: Any
+    ) -> "concurrent.futures.Future[T]":
+        """
+        Like :meth:`write`, but usable from synchronous code.
+
+        If called from within the event loop, this returns immediately and errors are printed
+        instead of raised. Otherwise (e.g. in CLI commands), this blocks until `fn` has completed.
+        Writes are executed in order, so subsequent reads or writes through this class
+        will observe the change.
+        """
+        fut = self._submit(fn, *args)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            fut.result()
+        else:
+            fut.add_done_callback(_print_exception)
+        return fut
+
+    def write_blocking(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Like :meth:`write`, but blocks the calling thread until `fn` has been committed.
+        Meant for synchronous APIs, coroutines should use :meth:`write` instead.
+        """
+        return self._submit(fn, *args).result()
+
+    async def fetchall(self, query: str, parameters=()) -> list[tuple]:
+        """Run a read-only query and return all rows."""
+        return await self.read(_fetchall, query, parameters)
+
+    async def fetchone(self, query: str, parameters=()) -> Optional[tuple]:
+        """Run a read-only query and return the first row."""
+        return await self.read(_fetchone, query, parameters)
+
+    async def execute(self, query: str, parameters=()) -> int:
+        """Run a single write statement and return the last inserted rowid."""
+        return await self.write(_execute, query, parameters)
+
+    async def flush(self) -> None:
+        """Wait until all writes that have been queued so far are committed."""
+        await self.write(lambda conn: None)
+
+    def close(self) -> None:
+        """Commit pending writes and shut down all threads."""
+        if self._writer:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        self._readers.shutdown(wait=True)
+
+
+_Job = tuple[Callable[..., Any], tuple, concurrent.futures.Future]
+
+
+def _fetchall(conn: sqlite3.Connection, query: str, parameters) -> list[tuple]:
+    return conn.execute(query, parameters).fetchall()
+
+
+def _fetchone(conn: sqlite3.Connection, query: str, parameters) -> Optional[tuple]:
+    return conn.execute(query, parameters).fetchone()
+
+
+def _execute(conn: sqlite3.Connection, query: str, parameters) -> int:
+    return conn.execute(query, parameters).lastrowid
+
+
+def _print_exception(fut: concurrent.futures.Future) -> None:
+    if not fut.cancelled() and (e := fut.exception()):
+        r8.echo("db", "Error in background write:", err=True)
+        traceback.print_exception(type(e), e, e.__traceback__)
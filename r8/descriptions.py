@@ -0,0 +1,53 @@
+"""
+Content-addressed storage for rendered challenge descriptions.
+
+The challenge list can refer to descriptions by hash instead of including them, so that
+clients only need to download descriptions that have changed since they last saw them.
+Hashes are keyed with the server secret: knowing a hash means that r8 has sent it to you,
+so descriptions can be looked up by hash without further access checks.
+"""
+
+import collections
+import hashlib
+import hmac
+import secrets
+from collections.abc import Iterable
+from typing import Optional
+
+import r8
+
+_fallback_key = secrets.token_bytes(32)
+
+
+class DescriptionStore:
+    """An LRU cache of descriptions by hash, bounded by the `description_store_size` setting."""
+
+    def __init__(self):
+        self.entries: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self.size = 0
+
+    def put(self, description: str) -> str:
+        """Store a description and return its hash."""
+        key = r8.settings.get("secret", "").encode() or _fallback_key
+        h = hmac.new(key, description.encode(), hashlib.sha256).hexdigest()[:24]
+        if h in self.entries:
+            self.entries.move_to_end(h)
+            return h
+        self.entries[h] = description
+        self.size += len(description)
+        max_size = r8.settings.get("description_store_size", 32 * 1024 * 1024)
+        while self.size > max_size and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+        return h
+
+    def get(self, h: str) -> Optional[str]:
+        return self.entries.get(h)
+
+    def get_many(self, hashes: Iterable[str]) -> dict[str, str]:
+        """Look up multiple descriptions. Unknown (or evicted) hashes are omitted."""
+        return {h: desc for h in hashes if (desc := self.entries.get(h)) is not None}
+
+
+store = DescriptionStore()
+"""singleton store that is used while r8 is running."""
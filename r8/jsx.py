@@ -0,0 +1,355 @@
+"""
+A small JSX compiler, so that r8's frontend does not need to be transpiled in the browser.
+
+Only JSX is rewritten into `React.createElement` calls. All other syntax is passed through
+as-is, which is fine as all current browsers understand the ES2015+ features used by r8.
+The compiler knows just enough JavaScript to tell JSX apart from comparisons,
+and to skip over strings, template literals, regular expressions and comments.
+"""
+
+import html
+import json
+import re
+
+WORD = re.compile(r"[\w$]+")
+IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
+TAG_NAME = re.compile(r"[A-Za-z_$][\w$.:-]*")
+ATTRIBUTE_NAME = re.compile(r"[A-Za-z_$][\w$:-]*")
+COMMENTS = re.compile(r"/\*.*?\*/|//[^\n]*", re.DOTALL)
+
+EXPRESSION_KEYWORDS = {
+    "await",
+    "case",
+    "default",
+    "delete",
+    "do",
+    "else",
+    "in",
+    "instanceof",
+    "new",
+    "of",
+    "return",
+    "throw",
+    "typeof",
+    "void",
+    "yield",
+}
+"""keywords after which an expression (and hence JSX or a regular expression) may start"""
+EXPRESSION_PUNCTUATION = set("([{,;=:?!&|+-*%<>~^")
+
+NEWLINE_AFTER = set("{([,;:?=&|>")
+NEWLINE_BEFORE = set("})].,?:")
+"""When minifying, newlines adjacent to these characters are removed."""
+
+
+class JSXSyntaxError(ValueError):
+    pass
+
+
+def compile(source: str, minify: bool = False) -> str:
+    """
+    Compile JSX to plain JavaScript.
+    If `minify` is set, comments and redundant whitespace are removed as well.
+    """
+    compiler = _Compiler(source, minify)
+    return compiler.js().strip()
+
+
+class _Compiler:
+    def __init__(self, source: str, minify: bool):
+        self.s = source
+        self.i = 0
+        self.minify = minify
+
+    def error(self, message: str) -> JSXSyntaxError:
+        line = self.s.count("\n", 0, self.i) + 1
+        return JSXSyntaxError(f"{message} (line {line})")
+
+    def peek(self, n: int = 1) -> str:
+        return self.s[self.i : self.i + n]
+
+    def expect(self, token: str) -> None:
+        if self.peek(len(token)) != token:
+            raise self.error(f"Expected {token!r}")
+        self.i += len(token)
+
+    def skip_whitespace(self) -> None:
+        while self.i < len(self.s) and self.s[self.i].isspace():
+            self.i += 1
+
+    def js(self, until_brace: bool = False) -> str:
+        """
+        Compile JavaScript until the end of the input or,
+        if `until_brace` is set, until an unmatched closing brace.
+        """
+        out: list[str] = []
+        last = ""  # the last significant token
+        pending = ""  # whitespace that has been skipped while minifying
+        depth = 0
+
+        def emit(token: str) -> None:
+            nonlocal pending
+            if pending and out:
+                prev, nxt = out[-1][-1], token[0]
+                if pending == "\n":
+                    if prev not in NEWLINE_AFTER and nxt not in NEWLINE_BEFORE:
+                        out.append("\n")
+                elif (
+                    (WORD.match(prev) and WORD.match(nxt))
+                    or prev + nxt in ("++", "--")
+                    or (prev == "/" and nxt in "/*")
+                ):
+                    out.append(" ")
+            pending = ""
+            out.append(token)
+
+        def skip(text: str) -> None:
+            nonlocal pending
+            if not self.minify:
+                out.append(text)
+            elif "\n" in text or pending == "\n" or text.startswith("//"):
+                pending = "\n"
+            else:
+                pending = " "
+
+        def expression_allowed() -> bool:
+            return (
+                not last
+                or (len(last) == 1 and last in EXPRESSION_PUNCTUATION)
+                or last in EXPRESSION_KEYWORDS
+            )
+
+        s = self.s
+        while self.i < len(s):
+            start = self.i
+            c = s[start]
+            if c.isspace():
+                self.skip_whitespace()
+                skip(s[start : self.i])
+            elif s.startswith("//", start):
+                end = s.find("\n", start)
+                self.i = len(s) if end == -1 else end
+                skip(s[start : self.i])
+            elif s.startswith("/*", start):
+                end = s.find("*/", start + 2)
+                if end == -1:
+                    raise self.error("Unterminated comment")
+                self.i = end + 2
+                skip(s[start : self.i])
+            elif c in "'\"":
+                emit(self.string())
+                last = '"'
+            elif c == "`":
+                emit(self.template())
+                last = '"'
+            elif c == "/" and expression_allowed():
+                emit(self.regex())
+                last = '"'
+            elif (
+                c == "<"
+                and expression_allowed()
+                and (self.peek(2)[1:] == ">" or IDENTIFIER.match(s, start + 1))
+            ):
+                emit(self.element())
+                last = ")"
+            elif c == "}" and depth == 0 and until_brace:
+                return "".join(out)
+            elif m := WORD.match(s, start):
+                self.i = m.end()
+                emit(m.group())
+                last = m.group()
+            else:
+                if c == "{":
+                    depth += 1
+                elif c == "}":
+                    depth -= 1
+                self.i += 1
+                emit(c)
+                last = c
+        if until_brace:
+            raise self.error("Expected '}'")
+        return "".join(out)
+
+    def string(self) -> str:
+        quote = self.s[self.i]
+        start = self.i
+        self.i += 1
+        while self.i < len(self.s):
+            c = self.s[self.i]
+            if c == "\\":
+                self.i += 2
+            elif c == quote:
+                self.i += 1
+                return self.s[start : self.i]
+            elif c == "\n":
+                break
+            else:
+                self.i += 1
+        raise self.error("Unterminated string")
+
+    def template(self) -> str:
+        out = ["`"]
+        self.i += 1
+        while self.i < len(self.s):
+            c = self.s[self.i]
+            if c == "\\":
+                out.append(self.s[self.i : self.i + 2])
+                self.i += 2
+            elif c == "`":
+                self.i += 1
+                out.append("`")
+                return "".join(out)
+            elif self.peek(2) == "${":
+                self.i += 2
+                out.append("${" + self.js(until_brace=True) + "}")
+                self.i += 1
+            else:
+                out.append(c)
+                self.i += 1
+        raise self.error("Unterminated template literal")
+
+    def regex(self) -> str:
+        start = self.i
+        self.i += 1
+        in_class = False
+        while self.i < len(self.s):
+            c = self.s[self.i]
+            self.i += 1
+            if c == "\\":
+                self.i += 1
+            elif c == "[":
+                in_class = True
+            elif c == "]":
+                in_class = False
+            elif c == "/" and not in_class:
+                while self.i < len(self.s) and self.s[self.i].isalpha():
+                    self.i += 1
+                return self.s[start : self.i]
+            elif c == "\n":
+                break
+        raise self.error("Unterminated regular expression")
+
+    def element(self) -> str:
+        """Compile a JSX element or fragment, starting at its `<`."""
+        self.expect("<")
+        props: list[str] = []
+        if self.peek() == ">":
+            self.i += 1
+            name = ""
+            tag = "React.Fragment"
+            self_closing = False
+        else:
+            m = TAG_NAME.match(self.s, self.i)
+            if not m:
+                raise self.error("Expected a tag name after '<', use {'<'} for text")
+            name = m.group()
+            self.i = m.end()
+            if re.match(r"[a-z]", name) or "-" in name:
+                tag = json.dumps(name)
+            else:
+                tag = name
+            self_closing = self.attributes(props)
+
+        children = [] if self_closing else self.children()
+        if not self_closing:
+            self.expect("</")
+            self.skip_whitespace()
+            if not self.s.startswith(name, self.i):
+                raise self.error(f"Expected closing tag for <{name}>")
+            self.i += len(name)
+            self.skip_whitespace()
+            self.expect(">")
+
+        sep = "," if self.minify else ", "
+        args = [tag, "{" + sep.join(props) + "}" if props else "null", *children]
+        return f"React.createElement({sep.join(args)})"
+
+    def attributes(self, props: list[str]) -> bool:
+        """Parse the attributes of an opening tag. Returns `True` for self-closing tags."""
+        colon = ":" if self.minify else ": "
+        while True:
+            self.skip_whitespace()
+            if self.peek(2) == "/>":
+                self.i += 2
+                return True
+            elif self.peek() == ">":
+                self.i += 1
+                return False
+            elif self.peek() == "{":
+                self.i += 1
+                self.skip_whitespace()
+                self.expect("...")
+                props.append("..." + self.js(until_brace=True).strip())
+                self.expect("}")
+                continue
+            m = ATTRIBUTE_NAME.match(self.s, self.i)
+            if not m:
+                raise self.error("Invalid JSX attribute")
+            self.i = m.end()
+            key = m.group()
+            if not IDENTIFIER.fullmatch(key):
+                key = json.dumps(key)
+            self.skip_whitespace()
+            if self.peek() != "=":
+                value = "true"
+            else:
+                self.i += 1
+                self.skip_whitespace()
+                c = self.peek()
+                if c in ("'", '"'):
+                    end = self.s.find(c, self.i + 1)
+                    if end == -1:
+                        raise self.error("Unterminated JSX attribute")
+                    value = json.dumps(html.unescape(self.s[self.i + 1 : end]))
+                    self.i = end + 1
+                elif c == "{":
+                    self.i += 1
+                    value = self.js(until_brace=True).strip()
+                    self.expect("}")
+                elif c == "<":
+                    value = self.element()
+                else:
+                    raise self.error("Invalid JSX attribute value")
+            props.append(f"{key}{colon}{value}")
+
+    def children(self) -> list[str]:
+        """Parse the children of an element, up to (but excluding) its closing tag."""
+        children = []
+        while True:
+            if self.i >= len(self.s):
+                raise self.error("Unterminated JSX element")
+            if self.peek(2) == "</":
+                return children
+            elif self.peek() == "<":
+                children.append(self.element())
+            elif self.peek() == "{":
+                self.i += 1
+                expression = self.js(until_brace=True)
+                self.expect("}")
+                if COMMENTS.sub("", expression).strip():
+                    children.append(expression.strip())
+            else:
+                start = self.i
+                while self.i < len(self.s) and self.s[self.i] not in "<{":
+                    self.i += 1
+                if text := _jsx_text(html.unescape(self.s[start : self.i])):
+                    children.append(json.dumps(text))
+
+
+def _jsx_text(text: str) -> str:
+    """Collapse whitespace in JSX text the same way Babel does."""
+    lines = re.split(r"\r\n|\n|\r", text.replace("\t", " "))
+    last_non_empty = max(
+        (i for i, line in enumerate(lines) if line.strip(" ")), default=0
+    )
+    ret = []
+    for i, line in enumerate(lines):
+        if i > 0:
+            line = line.lstrip(" ")
+        if i < len(lines) - 1:
+            line = line.rstrip(" ")
+        if line:
+            if i != last_non_empty:
+                line += " "
+            ret.append(line)
+    return "".join(ret)
@@ -0,0 +1,190 @@
+"""
+Versioned schema migrations.
+
+The current schema version is stored in the `schema_version` table.
+Migrations are applied in order and each migration runs in its own transaction.
+New migrations must only ever be appended to :data:`MIGRATIONS`.
+"""
+
+import sqlite3
+
+MIGRATIONS: list[str] = [
+    # 1: initial schema.
+    """
+    /* Do not add `ON DELETE CASCADE` to the key constraints, it does not work well with our config.sql approach.
+       SQL triggers fire immediately (even if constraints are deferred), so a `DELETE FROM challenges; 
+       INSERT INTO challenges [...];` will delete all dependents in between. */
+    CREATE TABLE users (
+        uid TEXT PRIMARY KEY NOT NULL,
+        password TEXT NOT NULL
+    );
+    CREATE TABLE challenges (
+        cid TEXT PRIMARY KEY NOT NULL,
+        team BOOLEAN NOT NULL DEFAULT 0,
+        t_start DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        t_stop DATETIME NOT NULL
+    );
+    CREATE TABLE flags (
+        fid TEXT PRIMARY KEY NOT NULL,
+        cid TEXT NOT NULL,
+        max_submissions INTEGER NOT NULL,
+        FOREIGN KEY (cid) REFERENCES challenges(cid)
+    );
+    CREATE TABLE submissions (
+        uid TEXT NOT NULL,
+        fid TEXT NOT NULL,
+        timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (uid) REFERENCES users(uid),
+        FOREIGN KEY (fid) REFERENCES flags(fid),
+        PRIMARY KEY (uid, fid)
+    );
+    CREATE TABLE events (
+        time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        ip TEXT NOT NULL,
+        type TEXT NOT NULL,
+        data TEXT,
+        cid TEXT,
+        uid TEXT
+    );
+    CREATE TABLE teams (
+        uid TEXT PRIMARY KEY NOT NULL,
+        tid TEXT NOT NULL,
+        FOREIGN KEY (uid) REFERENCES users(uid)
+    );
+    CREATE TABLE data (
+      cid TEXT NOT NULL,
+      key TEXT NOT NULL,
+      value TEXT NOT NULL,
+      FOREIGN KEY (cid) REFERENCES challenges(cid),
+      PRIMARY KEY (cid, key)
+    );
+    CREATE TABLE settings (
+        key TEXT PRIMARY KEY NOT NULL,
+        value TEXT NOT NULL
+    );
+    """,
+    # 2: indexes for the hot query paths.
+    """
+    CREATE INDEX flags_cid ON flags(cid);
+    CREATE INDEX submissions_fid ON submissions(fid);
+    CREATE INDEX submissions_timestamp ON submissions(timestamp);
+    CREATE INDEX teams_tid ON teams(tid);
+    CREATE INDEX events_cid ON events(cid);
+    CREATE INDEX events_uid ON events(uid);
+    CREATE INDEX events_type ON events(type);
+    CREATE INDEX events_time ON events(time);
+    """,
+    # 3: scoreboard checkpoints, see r8.rest_api.scoreboard.
+    # Any change that alters already processed submissions discards the checkpoint.
+    """
+    CREATE TABLE scoreboard_checkpoints (
+        submission INTEGER NOT NULL,  -- rowid of the last processed submission
+        timestamp DATETIME NOT NULL,  -- latest processed submission timestamp
+        config TEXT NOT NULL,  -- scoring settings and challenge points
+        data TEXT NOT NULL
+    );
+    CREATE TRIGGER scoreboard_submissions_delete AFTER DELETE ON submissions
+    BEGIN DELETE FROM scoreboard_checkpoints; END;
+    CREATE TRIGGER scoreboard_submissions_update AFTER UPDATE ON submissions
+    BEGIN DELETE FROM scoreboard_checkpoints; END;
+    CREATE TRIGGER scoreboard_submissions_insert AFTER INSERT ON submissions
+    WHEN NEW.timestamp < (SELECT MAX(timestamp) FROM scoreboard_checkpoints)
+    BEGIN DELETE FROM scoreboard_checkpoints; END;
+    CREATE TRIGGER scoreboard_flags_delete AFTER DELETE ON flags
+    BEGIN DELETE FROM scoreboard_checkpoints; END;
+    CREATE TRIGGER scoreboard_flags_update AFTER UPDATE ON flags
+    BEGIN DELETE FROM scoreboard_checkpoints; END;
+    CREATE TRIGGER scoreboard_teams_delete AFTER DELETE ON teams
+    BEGIN DELETE FROM scoreboard_checkpoints; END;
+    CREATE TRIGGER scoreboard_teams_update AFTER UPDATE ON teams
+    BEGIN DELETE FROM scoreboard_checkpoints; END;
+    CREATE TRIGGER scoreboard_teams_insert AFTER INSERT ON teams
+    WHEN EXISTS (SELECT 1 FROM submissions WHERE uid = NEW.uid)
+    BEGIN DELETE FROM scoreboard_checkpoints; END;
+    """,
+    # 4: change counter for the tables mirrored by r8.state.SolveIndex.
+    # Unlike `PRAGMA data_version`, it ignores writes to unrelated tables such as events.
+    """
+    CREATE TABLE solve_index_changes (changes INTEGER NOT NULL);
+    INSERT INTO solve_index_changes VALUES (0);
+    CREATE TRIGGER solve_index_users_insert AFTER INSERT ON users
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_users_delete AFTER DELETE ON users
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_users_update AFTER UPDATE OF uid ON users
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_teams_insert AFTER INSERT ON teams
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_teams_delete AFTER DELETE ON teams
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_teams_update AFTER UPDATE ON teams
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_challenges_insert AFTER INSERT ON challenges
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_challenges_delete AFTER DELETE ON challenges
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_challenges_update AFTER UPDATE ON challenges
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_flags_insert AFTER INSERT ON flags
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_flags_delete AFTER DELETE ON flags
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_flags_update AFTER UPDATE ON flags
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_submissions_insert AFTER INSERT ON submissions
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_submissions_delete AFTER DELETE ON submissions
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    CREATE TRIGGER solve_index_submissions_update AFTER UPDATE ON submissions
+    BEGIN UPDATE solve_index_changes SET changes = changes + 1; END;
+    """,
+]
+"""Schema migrations. Version `n` is reached by applying `MIGRATIONS[n - 1]`."""
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Get the schema version of a database."""
+    tables = {
+        x[0]
+        for x in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
+        ).fetchall()
+    }
+    if "schema_version" in tables:
+        return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    elif "users" in tables:
+        # databases created before r8 had versioned migrations.
+        return 1
+    else:
+        return 0
+
+
+def migrate(conn: sqlite3.Connection) -> list[int]:
+    """
+    Apply all pending migrations.
+
+    Returns:
+        The versions that have been applied.
+    """
+    applied = []
+    for version in range(current_version(conn) + 1, LATEST_VERSION + 1):
+        try:
+            conn.executescript(
+                f"""
+                BEGIN;
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY NOT NULL,
+                    applied DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+                {MIGRATIONS[version - 1]}
+                INSERT INTO schema_version (version) VALUES ({version});
+                COMMIT;
+                """
+            )
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,128 @@
+"""
+Rendering of r8's HTML pages from the Jinja templates in `static_dir`.
+
+Pages only depend on r8's configuration, so each page is rendered once and then served
+from memory with an ETag until one of its template files (or the frontend bundles)
+changes. Templates that use per-request values are rendered on every request instead:
+this is detected for templates that use `time`, other templates can be opted out
+with the `template_cache_exclude` setting.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections.abc import Iterable
+from typing import Optional
+
+import jinja2
+import jinja2.meta
+from aiohttp import web
+
+from r8 import bundles
+from r8 import staticfiles
+
+PER_REQUEST_VARIABLES = {"time"}
+"""Template variables that indicate that a page is different on every request."""
+
+
+class _Page:
+    def __init__(
+        self, templates: dict[str, jinja2.Template], manifest, body: Optional[str]
+    ):
+        self.templates = templates
+        """all templates this page is rendered from, to detect changes"""
+        self.manifest = manifest
+        self.body = None if body is None else body.encode()
+        """the rendered page, or `None` if it must be rendered on every request"""
+        self.etag = self.body and f'"{hashlib.sha256(self.body).hexdigest()[:20]}"'
+
+
+class Pages:
+    def __init__(
+        self,
+        env: jinja2.Environment,
+        static_dir: bundles.TStaticDir,
+        context: dict,
+        exclude: Iterable[str] = (),
+    ):
+        self.env = env
+        self.static_dir = static_dir
+        self.context = context
+        self.exclude = set(exclude)
+        self.cache: dict[str, _Page] = {}
+
+    def render(self, name: str) -> tuple[bytes, Optional[str]]:
+        """
+        Render a page, or get it from the cache.
+        Returns the page and its ETag, which is `None` for pages that are not cached.
+        """
+        page = self.cache.get(name)
+        if page is None or not self._is_current(page):
+            dependencies, cacheable = self._dependencies(name)
+            page = self.cache[name] = _Page(
+                {n: self.env.get_template(n) for n in dependencies},
+                bundles.manifest(self.static_dir),
+                self._render(name) if cacheable else None,
+            )
+        if page.body is None:
+            return self._render(name).encode(), None
+        return page.body, page.etag
+
+    def _render(self, name: str) -> str:
+        page = self.env.get_template(name).render(self.context)
+        return bundles.apply(page, self.static_dir)
+
+    def response(self, name: str, request: web.Request) -> web.Response:
+        try:
+            body, etag = self.render(name)
+        except jinja2.TemplateNotFound:
+            return web.HTTPNotFound()
+        if etag is None:
+            return web.Response(body=body, content_type="text/html")
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if staticfiles.not_modified(request, etag):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="text/html", headers=headers)
+
+    def _is_current(self, page: _Page) -> bool:
+        # with auto_reload, the environment loads a new template object if a file has changed.
+        return page.manifest is bundles.manifest(self.static_dir) and all(
+            self.env.get_template(name) is template
+            for name, template in page.templates.items()
+        )
+
+    def _dependencies(self, name: str) -> tuple[set[str], bool]:
+        """
+        Find all templates that a page is rendered from,
+        and whether the page can be cached.
+        """
+        todo = [name]
+        ret = set()
+        cacheable = True
+        while todo:
+            current = todo.pop()
+            if current in ret:
+                continue
+            ret.add(current)
+            source, _, _ = self.env.loader.get_source(self.env, current)
+            ast = self.env.parse(source)
+            if (
+                current in self.exclude
+                or jinja2.meta.find_undeclared_variables(ast) & PER_REQUEST_VARIABLES
+            ):
+                cacheable = False
+            for ref in jinja2.meta.find_referenced_templates(ast):
+                if ref is None:
+                    # dynamic {% include %} or {% extends %}
+                    cacheable = False
+                else:
+                    todo.append(ref)
+        return ret, cacheable
+
+
+def bytecode_cache(directory: Optional[str] = None) -> jinja2.BytecodeCache:
+    """
+    Cache compiled templates on disk, so that they do not need to be compiled again after
+    a restart. Entries are invalidated automatically if the template source changes.
+    """
+    return jinja2.FileSystemBytecodeCache(directory)
@@ -0,0 +1,117 @@
+"""
+Password hashing off the event loop.
+
+argon2 is deliberately slow and CPU-bound, so hashing on the event loop would stall
+every other connection while a burst of logins is processed. Hashes are computed in
+a small process pool instead. The number of concurrent hash operations is limited,
+and requests that cannot get a slot in time fail with :class:`Overloaded`.
+"""
+
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import secrets
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import TypeVar
+
+import argon2
+
+import r8
+
+T = TypeVar("T")
+
+PLAIN_PREFIX = "$plain$"
+
+ph = argon2.PasswordHasher()
+
+
+class Overloaded(Exception):
+    """Raised if a password operation could not be scheduled within the queue timeout."""
+
+
+def hash_password(password: str) -> str:
+    return ph.hash(password)
+
+
+def verify(hash: str, password: str) -> Optional[str]:
+    """
+    Check a password against a stored hash.
+
+    Raises `argon2.exceptions.VerificationError` if the password does not match.
+    Returns a new hash if the stored one should be upgraded, `None` otherwise.
+    This covers `$plain$` passwords (e.g. from `config.sql`) as well as argon2 hashes
+    with outdated parameters.
+    """
+    if hash.startswith(PLAIN_PREFIX):
+        if not secrets.compare_digest(
+            hash.removeprefix(PLAIN_PREFIX).encode(), password.encode()
+        ):
+            raise argon2.exceptions.VerifyMismatchError()
+        return ph.hash(password)
+    ph.verify(hash, password)
+    if ph.check_needs_rehash(hash):
+        return ph.hash(password)
+    return None
+
+
+class PasswordPool:
+    """
+    A bounded process pool for password operations.
+
+    At most `concurrency` operations run at the same time, further ones wait for up to
+    `queue_timeout` seconds before :class:`Overloaded` is raised.
+    The pool's worker processes are started lazily.
+    """
+
+    def __init__(self, concurrency: int, queue_timeout: float):
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self._semaphore.locked():
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError as e:
+                raise Overloaded() from e
+        else:
+            await self._semaphore.acquire()
+        try:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self.concurrency, multiprocessing.get_context("spawn")
+                )
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._semaphore.release()
+
+    async def hash_password(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, hash: str, password: str) -> Optional[str]:
+        """Async version of :func:`verify`."""
+        return await self.run(verify, hash, password)
+
+    def close(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+pool: Optional[PasswordPool] = None
+"""The pool used while r8 is running, see :func:`r8.server.password_pool`."""
+
+
+def make_pool() -> PasswordPool:
+    """Create a pool as configured via `r8 settings`."""
+    return PasswordPool(
+        concurrency=r8.settings.get(
+            "password_concurrency", max(1, min(4, (os.cpu_count() or 1) // 2))
+        ),
+        queue_timeout=r8.settings.get("password_queue_timeout", 5),
+    )
@@ -1,6 +1,9 @@
+import math
+import sqlite3
 from functools import wraps
 from typing import Any
 from typing import Callable
+from typing import Optional
 
 import argon2
 import itsdangerous
@@ -40,31 +43,52 @@ async def register(request: web.Request):
         password = logindata["password"]
         nickname = logindata["nickname"]
     except KeyError:
-        r8.log(request, "register-invalid", "incomplete request")
+        r8.util.log_entry(request, "register-invalid", "incomplete request")
         return web.HTTPBadRequest(reason="All fields are required.")
-    with r8.db:
-        user_exists = r8.db.execute(
-            "SELECT 1 FROM users WHERE uid = ?", (user,)
-        ).fetchone()
-        team_exists = r8.db.execute(
-            "SELECT 1 FROM teams WHERE tid = ?", (nickname,)
-        ).fetchone()
-    if user_exists:
-        r8.log(request, "register-invalid", "username exists")
+    # checked again when the user is inserted, this avoids hashing passwords needlessly.
+    if error := await r8.async_db.read(_check_registration, user, nickname):
+        return _registration_error(request, error)
+    try:
+        hash = await r8.passwords.pool.hash_password(password)
+    except r8.passwords.Overloaded:
+        return _overloaded()
+    if error := await r8.async_db.write(_register, user, hash, nickname):
+        return _registration_error(request, error)
+    if r8.state.solves.loaded:
+        r8.state.solves.directory.add_user(user, nickname)
+    r8.util.log_entry(request, "register-success", uid=user)
+    return await login(request)
+
+
+def _check_registration(
+    conn: sqlite3.Connection, user: str, nickname: str
+) -> Optional[str]:
+    if conn.execute("SELECT 1 FROM users WHERE uid = ?", (user,)).fetchone():
+        return "username exists"
+    if conn.execute("SELECT 1 FROM teams WHERE tid = ?", (nickname,)).fetchone():
+        return "team exists"
+    return None
+
+
+def _register(
+    conn: sqlite3.Connection, user: str, hash: str, nickname: str
+) -> Optional[str]:
+    """Insert a new user, or return why this is not possible."""
+    if error := _check_registration(conn, user, nickname):
+        return error
+    index = r8.state.solves
+    index.execute(conn, "INSERT INTO users(uid, password) VALUES (?,?)", (user, hash))
+    index.execute(conn, "INSERT INTO teams(uid, tid) VALUES (?,?)", (user, nickname))
+    return None
+
+
+def _registration_error(request: web.Request, error: str) -> web.Response:
+    r8.util.log_entry(request, "register-invalid", error)
+    if error == "username exists":
         return web.HTTPBadRequest(
             reason="There already exists an account with this email."
         )
-    if team_exists:
-        r8.log(request, "register-invalid", "team exists")
-        return web.HTTPBadRequest(reason="There already exists a team with that name.")
-    with r8.db:
-        r8.db.execute(
-            "INSERT INTO users(uid, password) VALUES (?,?)",
-            (user, r8.util.hash_password(password)),
-        )
-        r8.db.execute("INSERT INTO teams(uid, tid) VALUES (?,?)", (user, nickname))
-    r8.log(request, "register-success", uid=user)
-    return await login(request)
+    return web.HTTPBadRequest(reason="There already exists a team with that name.")
 
 
 @routes.post("/login")
@@ -74,22 +98,19 @@ async def login(request: web.Request):
         user = logindata["username"]
         password = logindata["password"]
     except KeyError:
-        r8.log(request, "login-invalid")
+        r8.util.log_entry(request, "login-invalid")
         return web.HTTPBadRequest(reason="username or password missing.")
-    with r8.db:
-        ok = r8.db.execute(
-            "SELECT password FROM users WHERE uid = ?", (user,)
-        ).fetchone()
+    ok = await r8.async_db.fetchone("SELECT password FROM users WHERE uid = ?", (user,))
     try:
         if not ok:
             raise ValueError()
         hash: str = ok[0]
-        if hash.startswith("$plain$"):
-            if hash.removeprefix("$plain$") != password:
-                raise ValueError()
-        else:
-            r8.util.verify_hash(hash, password)
-        r8.log(request, "login-success", uid=user)
+        new_hash = await r8.passwords.pool.verify(hash, password)
+        if new_hash:
+            # Upgrade $plain$ passwords and outdated argon2 parameters,
+            # unless the password has been changed in the meantime.
+            r8.async_db.write_nowait(_update_password, user, hash, new_hash)
+        r8.util.log_entry(request, "login-success", uid=user)
         token = r8.util.auth_sign.sign(user.encode()).decode()
         is_secure = not r8.settings["origin"].startswith("http://")
         resp = web.json_response({})
@@ -104,8 +125,23 @@ async def login(request: web.Request):
         )
         return resp
     except (argon2.exceptions.VerificationError, ValueError):
-        r8.log(request, "login-fail", user, uid=user if ok else None)
+        r8.util.log_entry(request, "login-fail", user, uid=user if ok else None)
         return web.HTTPUnauthorized(reason="Invalid credentials.")
+    except r8.passwords.Overloaded:
+        return _overloaded()
+
+
+def _update_password(conn: sqlite3.Connection, user: str, old: str, new: str) -> None:
+    conn.execute(
+        "UPDATE users SET password = ? WHERE uid = ? AND password = ?", (new, user, old)
+    )
+
+
+def _overloaded() -> web.Response:
+    return web.HTTPServiceUnavailable(
+        reason="Too many login attempts, please try again in a few seconds.",
+        headers={"Retry-After": str(math.ceil(r8.passwords.pool.queue_timeout))},
+    )
 
 
 @routes.post("/logout")
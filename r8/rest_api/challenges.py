@@ -3,6 +3,7 @@ import urllib.parse
 from aiohttp import web
 
 import r8
+from r8 import staticfiles
 from .auth import authenticated
 
 routes = web.RouteTableDef()
@@ -11,15 +12,28 @@ routes = web.RouteTableDef()
 @routes.get("/")
 @authenticated
 async def get_challenges(user: str, request: web.Request):
-    """Get the current challenge state."""
-    r8.log(request, "get-challenges", request.headers.get("User-Agent"), uid=user)
-    challenges = await r8.util.get_challenges(user)
+    """
+    Get the current challenge state.
+    With `?descriptions=hash`, descriptions are replaced by hashes, see `/descriptions`.
+    """
+    r8.util.log_entry(
+        request, "get-challenges", request.headers.get("User-Agent"), uid=user
+    )
+    hashes = request.query.get("descriptions") == "hash"
+    headers = {"Cache-Control": "private, no-cache"}
+    if etag := await r8.util.get_challenges_etag(user):
+        etag = f'{etag[:-1]}-hash"' if hashes else etag
+        headers["ETag"] = etag
+        if staticfiles.not_modified(request, etag):
+            return web.Response(status=304, headers=headers)
+    challenges = await r8.util.get_challenges(user, hashes)
     return web.json_response(
         {
             "user": user,
             "team": r8.util.get_team(user),
             "challenges": challenges,
-        }
+        },
+        headers=headers,
     )
 
 
@@ -29,18 +43,34 @@ async def submit_flag(user: str, request: web.Request):
     """Submit a flag."""
     flag = (await request.json()).get("flag", "")
     try:
-        cid = r8.util.submit_flag(flag, user, request)
+        cid = await r8.util.submit_flag_async(flag, user, request)
     except ValueError as e:
         return web.HTTPBadRequest(reason=str(e))
     else:
         return web.json_response(
             {
-                "challenges": await r8.util.get_challenges(user),
+                "challenges": await r8.util.get_challenges(
+                    user, request.query.get("descriptions") == "hash"
+                ),
                 "solved": r8.challenges[cid].title,
             }
         )
 
 
+@routes.get("/descriptions")
+@authenticated
+async def get_descriptions(user: str, request: web.Request):
+    """
+    Get challenge descriptions by hash, e.g. `?hashes=a,b,c`.
+    Unknown hashes are omitted, clients should then request the full challenge list.
+    """
+    hashes = request.query.get("hashes", "").split(",")
+    return web.json_response(
+        r8.descriptions.store.get_many(hashes[:1000]),
+        headers={"Cache-Control": "private, max-age=86400, immutable"},
+    )
+
+
 @routes.get("/{cid}{path:(/.*)?}")
 @routes.post("/{cid}{path:(/.*)?}")
 @authenticated
@@ -61,22 +91,16 @@ async def handle_challenge_request(user: str, request: web.Request):
             text = urllib.parse.unquote(text)
         data = path + text
         # We want this to appear before any challenge-specific logging...
-        rowid = r8.log(request, "handle-request", data, uid=user, cid=inst.id)
+        entry = r8.util.log_entry(
+            request, "handle-request", data, uid=user, cid=inst.id
+        )
         try:
             resp = await inst.handle_post_request(user, request)
             if isinstance(resp, str):
                 resp = web.json_response({"message": resp})
-            with r8.db:
-                r8.db.execute(
-                    """UPDATE events SET data = ? WHERE ROWID = ?""",
-                    (f"{data} -> {resp.status} {resp.reason}", rowid),
-                )
+            entry.update_data(f"{data} -> {resp.status} {resp.reason}")
         except Exception as e:
-            with r8.db:
-                r8.db.execute(
-                    """UPDATE events SET data = ? WHERE ROWID = ?""",
-                    (f"{data} -> {e}", rowid),
-                )
+            entry.update_data(f"{data} -> {e}")
             raise
 
     return resp
@@ -1,99 +1,457 @@
 import asyncio
+import bisect
+import collections
+import gzip
+import json
+import math
+import secrets
+import sqlite3
 import time
+from typing import Optional
 
 import aiohttp
 from aiohttp import web
 
 import r8
-from ..scoring import Scoreboard
+from .. import scoring
+from ..broadcast import BroadcastHub
+from ..scoring import ScoreHistory
 from .auth import authenticated
 
-scoreboards: list[Scoreboard] = [Scoreboard()]
-ws_connections: set[web.WebSocketResponse] = set()
+history: ScoreHistory
+hub: BroadcastHub
+recent: collections.deque[tuple[int, str]]
+"""(seq, message) of the most recent deltas, so that reconnecting clients can resume."""
+epoch = ""
+"""
+Identifies the history that sequence numbers refer to.
+Changes whenever the history is loaded, i.e. on restart.
+"""
+unsaved = 0
+"""number of submissions processed by :func:`on_solve` that are not in the checkpoint yet"""
+processed = 0
+"""rowid of the latest submission processed by :func:`on_solve`"""
 
 
 async def on_startup(app):
-    scoreboards[0].timestamp = r8.settings.get("start", time.time())
-    with r8.db:
-        submissions = r8.db.execute(
-            """
-            SELECT tid, cid, CAST(strftime('%s',timestamp) AS INTEGER) AS timestamp FROM submissions
-            NATURAL INNER JOIN flags
-            NATURAL INNER JOIN teams
-            ORDER BY TIMESTAMP
-        """
-        )
-        for team, cid, timestamp in submissions:
-            if next := scoreboards[-1].solve(team, r8.challenges[cid], timestamp):
-                if timestamp < scoreboards[0].timestamp:
-                    next.timestamp = scoreboards[0].timestamp
-                    scoreboards.clear()
-                scoreboards.append(next)
+    global history, hub, recent, unsaved, processed, epoch
+    recent = collections.deque(maxlen=r8.settings.get("scoreboard_ws_replay", 1000))
+    hub = BroadcastHub(
+        queue_size=r8.settings.get("scoreboard_ws_queue_size", 4),
+        send_timeout=r8.settings.get("scoreboard_ws_send_timeout", 10),
+        snapshot=snapshot_message,
+    )
+    history, replayed = await r8.async_db.write(
+        _load_history, r8.settings.get("start", time.time())
+    )
+    unsaved, processed = 0, 0
+    epoch = secrets.token_hex(8)
     r8.echo(
         "scoreboard",
-        f"Processed {len(scoreboards) - 1} submission(s): {scoreboards[-1]}",
+        f"Processed {replayed} new submission(s): {history.current}",
     )
     r8.util.on_submit.connect(on_solve)
+    app["checkpoint"] = asyncio.create_task(checkpoint_task())
+    app["stats"] = asyncio.create_task(stats_task())
+
+
+async def checkpoint_task():
+    global unsaved
+    interval = r8.settings.get("scoreboard_checkpoint_interval", 600)
+    while True:
+        await asyncio.sleep(interval)
+        solves = unsaved
+        if not solves:
+            continue
+        try:
+            if await r8.async_db.write(
+                _save_checkpoint, json.dumps(history.dump()), processed, solves
+            ):
+                unsaved -= solves
+        except Exception as e:
+            r8.echo("scoreboard", f"Error saving checkpoint: {e}", err=True)
+
+
+async def stats_task():
+    """Periodically print the fan-out statistics of live scoreboard connections."""
+    interval = r8.settings.get("scoreboard_stats_interval", 300)
+    if not interval:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        stats = hub.stats()
+        if not stats["connections"]:
+            continue
+        r8.echo(
+            "scoreboard",
+            f"{stats['connections']} live connection(s), "
+            f"fan-out latency {stats['latency_median'] or 0:.3f}s median, "
+            f"{stats['latency_max'] or 0:.3f}s max, "
+            f"{stats['coalesced']} queue overflow(s), "
+            f"{stats['dropped']} stuck connection(s) closed.",
+        )
+
+
+def _save_checkpoint(
+    conn: sqlite3.Connection, data: str, submission: int, solves: int
+) -> bool:
+    """
+    Update the checkpoint with the in-memory history, which includes all submissions up to
+    rowid `submission`, `solves` of which are newer than the checkpoint.
+    Newer submissions (e.g. ones that are being processed right now) do not matter.
+
+    Nothing is saved if the checkpoint has been discarded or if the history does not cover
+    exactly the submissions between the checkpoint and `submission`, e.g. because some have
+    been made by another process. In this case, the next start replays them from the database.
+    """
+    row = conn.execute("SELECT submission FROM scoreboard_checkpoints").fetchone()
+    if row is None:
+        return False
+    count, timestamp = conn.execute(
+        "SELECT COUNT(*), MAX(timestamp) FROM submissions WHERE rowid > ? AND rowid <= ?",
+        (row[0], submission),
+    ).fetchone()
+    if count != solves:
+        return False
+    conn.execute(
+        """
+        UPDATE scoreboard_checkpoints
+        SET submission = ?, timestamp = MAX(timestamp, ?), data = ?
+        """,
+        (submission, timestamp, data),
+    )
+    return True
+
+
+def _load_history(conn: sqlite3.Connection, start: float) -> tuple[ScoreHistory, int]:
+    """
+    Build the scoreboard history from the latest checkpoint and all newer submissions,
+    and save a new checkpoint if there were any. This is only done on startup,
+    afterwards :func:`checkpoint_task` saves the in-memory history.
 
+    Checkpoints are discarded by database triggers whenever processed submissions, flags or
+    teams change (e.g. `r8 flags revoke` or a `config.sql` import), and ignored if the scoring
+    configuration has changed.
+    """
+    config = json.dumps(
+        {
+            "settings": {
+                k: v for k, v in r8.settings.items() if k.startswith("scoring")
+            },
+            "points": {
+                cid: r8.challenges[cid].points
+                for (cid,) in conn.execute("SELECT DISTINCT cid FROM flags")
+                if cid in r8.challenges
+            },
+        },
+        sort_keys=True,
+    )
+    ret = None
+    last_submission, last_timestamp = 0, ""
+    row = conn.execute(
+        "SELECT submission, timestamp, config, data FROM scoreboard_checkpoints"
+    ).fetchone()
+    if row and row[2] == config:
+        ret = ScoreHistory.load(json.loads(row[3]))
+        if ret.rebase(start):
+            last_submission, last_timestamp = row[0], row[1]
+        else:
+            ret = None
+    rebuild = ret is None
+    if rebuild:
+        ret = ScoreHistory(start)
+
+    submissions = conn.execute(
+        """
+        SELECT submissions.rowid, timestamp, tid, cid, CAST(strftime('%s',timestamp) AS INTEGER)
+        FROM submissions
+        NATURAL INNER JOIN flags
+        NATURAL INNER JOIN teams
+        WHERE submissions.rowid > ?
+        ORDER BY timestamp
+        """,
+        (last_submission,),
+    ).fetchall()
+    for _, _, team, cid, timestamp in submissions:
+        ret.solve(team, r8.challenges[cid], timestamp)
+
+    if submissions or rebuild:
+        conn.execute("DELETE FROM scoreboard_checkpoints")
+        conn.execute(
+            """
+            INSERT INTO scoreboard_checkpoints (submission, timestamp, config, data)
+            VALUES (?, ?, ?, ?)
+            """,
+            (
+                max([last_submission, *(x[0] for x in submissions)]),
+                max([last_timestamp, *(x[1] for x in submissions)]),
+                config,
+                json.dumps(ret.dump()),
+            ),
+        )
+    return ret, len(submissions)
 
-def on_solve(sender, user, cid):
+
+# WebSocket messages on /api/scoreboard/updates. Clients receive a snapshot on connect
+# (and when they fall behind), followed by deltas with consecutive sequence numbers.
+# Sequence numbers match the index into the `scoreboards` list of /api/scoreboard/state
+# and are only meaningful within an epoch, which changes if the server is restarted.
+PROTOCOL_VERSION = 1
+
+
+def snapshot_message() -> str:
+    return json.dumps(
+        {
+            "v": PROTOCOL_VERSION,
+            "type": "snapshot",
+            "epoch": epoch,
+            "seq": len(history) - 1,
+            "timestamp": history.current.timestamp,
+            "scores": history.current.scores,
+            "solves": history.current.solves,
+        }
+    )
+
+
+def on_solve(sender, user, cid, submission):
+    global unsaved, processed
+    unsaved += 1
+    processed = max(processed, submission)
     team = r8.util.get_team(user)
-    if next := scoreboards[-1].solve(team, r8.challenges[cid], time.time()):
-        scoreboards.append(next)
-    else:
+    challenge = r8.challenges[cid]
+    changes = history.solve(team, challenge, time.time())
+    if not changes:
         return
 
-    data = scoreboards[-1].to_json()
-    for ws in ws_connections:
-        asyncio.create_task(send_task(ws, data))
+    seq = len(history) - 1
+    message = json.dumps(
+        {
+            "v": PROTOCOL_VERSION,
+            "type": "delta",
+            "epoch": epoch,
+            "seq": seq,
+            "timestamp": history.current.timestamp,
+            # new scores of the solving team and all teams that solved the challenge before.
+            "scores": changes,
+            "solve": {
+                "team": team,
+                "cid": cid,
+                "points": scoring.challenge_points(
+                    challenge, len(r8.state.solves.solve_times[cid])
+                ),
+            },
+        }
+    )
+    recent.append((seq, message))
+    hub.publish_str(message)
 
 
-async def send_task(ws: web.WebSocketResponse, data) -> None:
-    try:
-        await ws.send_json(data)
-    except ConnectionError:
-        pass
+def missed_messages(seq: int, since_epoch: str) -> Optional[list[str]]:
+    """
+    All deltas after sequence number `seq` of `since_epoch`,
+    or `None` if they are not available anymore (e.g. after a restart).
+    """
+    if since_epoch != epoch:
+        return None
+    current = len(history) - 1
+    if seq == current:
+        return []
+    if seq > current or not recent or recent[0][0] > seq + 1:
+        return None
+    return [message for s, message in recent if s > seq]
 
 
 async def on_shutdown(app):
-    await asyncio.gather(*[shutdown_task(ws) for ws in ws_connections])
+    app["checkpoint"].cancel()
+    app["stats"].cancel()
+    await hub.close()
+
+
+routes = web.RouteTableDef()
+
+
+class _Payload:
+    def __init__(self, header: bytes, body: bytes):
+        self.header = header
+        self.body = body
+        self.gzipped: Optional[bytes] = None
+
+
+class StateCache:
+    """
+    Pre-encoded `/api/scoreboard/state` payload.
+
+    Scoreboard snapshots are encoded once and appended as new solves come in.
+    The rest of the payload (teams, challenges, solves) depends on which challenges a user
+    can see, so it is encoded once per set of visible challenges. These payloads are
+    discarded if the scoreboard, the list of teams, or the list of active challenges changes,
+    and when the next challenge starts.
+    """
+
+    max_payloads = 64
+
+    def __init__(self):
+        self.history = None
+        self.snapshots: list[bytes] = []
+        self.key = None
+        self.expires = math.inf
+        self.challenges: list[dict] = []
+        self.teams: list[str] = []
+        self.payloads: collections.OrderedDict[frozenset[str], _Payload] = (
+            collections.OrderedDict()
+        )
+
+    def _update_snapshots(self) -> None:
+        if self.history is not history or len(self.snapshots) > len(history):
+            self.history = history
+            self.snapshots = []
+        if len(self.snapshots) == len(history) - 1:
+            self.snapshots.append(_dumps(history.current.to_json()))
+        elif len(self.snapshots) < len(history):
+            self.snapshots = [_dumps(x) for x in history.to_json()]
+
+    def update(self) -> None:
+        self._update_snapshots()
+        challenges = r8.state.solves.challenge_list()
+        teams = r8.util.get_teams()
+        # challenge_list() and get_teams() return the same objects until something changes.
+        key = (len(self.snapshots), challenges, teams)
+        if (
+            self.key
+            and self.key[0] == key[0]
+            and self.key[1] is challenges
+            and self.key[2] is teams
+            and time.time() < self.expires
+        ):
+            return
+        self.key = key
+        self.challenges = challenges
+        self.teams = [t for t in teams if not t.startswith("_")]
+        now = time.time()
+        self.expires = min(
+            (
+                t_start
+                for t_start, _, _ in r8.state.solves.windows.values()
+                if t_start >= now
+            ),
+            default=math.inf,
+        )
+        self.payloads.clear()
 
+    async def payload(self, user: str) -> _Payload:
+        """Get the payload for a user, showing only the challenges they can see."""
+        if not r8.state.solves.loaded:
+            await r8.state.solves.reload()
+        self.update()
+        challenges = self.challenges
+        visible = await asyncio.gather(*[_visible(user, c) for c in challenges])
+        challenges = [c for c, v in zip(challenges, visible) if v]
+        cids = frozenset(c["cid"] for c in challenges)
+        if (ret := self.payloads.get(cids)) is not None:
+            self.payloads.move_to_end(cids)
+            return ret
+        header = _dumps(
+            {
+                "epoch": epoch,
+                "seq": len(history) - 1,
+                "teams": self.teams,
+                # only show active teams: list(history.current.scores.keys()),
+                "challenges": [c for c in challenges if c.get("points", 0) > 0],
+                "solves": {
+                    c["cid"]: history.current.solves[c["cid"]] for c in challenges
+                },
+            }
+        )[:-1]
+        ret = self.payloads[cids] = _Payload(header, self.encode(header, 0))
+        if len(self.payloads) > self.max_payloads:
+            self.payloads.popitem(last=False)
+        return ret
 
-async def shutdown_task(ws: web.WebSocketResponse) -> None:
+    def encode(self, header: bytes, start: int) -> bytes:
+        """Encode the payload with all snapshots from sequence number `start` onwards."""
+        return (
+            header + b', "scoreboards": [' + b", ".join(self.snapshots[start:]) + b"]}"
+        )
+
+    def start_seq(self, since: float) -> int:
+        """
+        Get the first sequence number a client that specified `?since=...` is missing.
+        Values below 10^9 are sequence numbers, larger ones are unix timestamps.
+        """
+        if since < 1e9:
+            return max(0, math.floor(since) + 1)
+        if history.start > since:
+            return 0
+        return bisect.bisect_right(history.timestamps, since) + 1
+
+
+def _dumps(data) -> bytes:
+    return json.dumps(data).encode()
+
+
+async def _visible(user: str, challenge: dict) -> bool:
+    """Whether a challenge is visible to a user, see :func:`r8.util.get_challenges`."""
+    if "description" in challenge:
+        # error while computing the global challenge info.
+        return True
+    if r8.state.solves.solve_time(user, challenge["cid"]):
+        return True
     try:
-        await ws.close(code=aiohttp.WSCloseCode.GOING_AWAY, message=b"server shutdown")
-    except ConnectionError:
-        pass
+        return bool(
+            await asyncio.wait_for(
+                r8.challenges[challenge["cid"]].visible(user),
+                r8.settings.get("description_timeout", 5),
+            )
+        )
+    except Exception:
+        # get_challenges shows broken challenges with an error message.
+        return True
 
 
-routes = web.RouteTableDef()
+state_cache = StateCache()
 
 
 @routes.get("/state")
 @authenticated
 async def get_state(user: str, request: web.Request):
-    challenges = await r8.util.get_challenges(user)
-
-    return web.json_response(
-        {
-            "teams": [t for t in r8.util.get_teams() if not t.startswith("_")],
-            # only show active teams: list(scoreboards[-1].scores.keys()),
-            "challenges": [c for c in challenges if c["points"] > 0],
-            "solves": {
-                challenge["cid"]: scoreboards[-1].solves[challenge["cid"]]
-                for challenge in challenges
-            },
-            "scoreboards": [x.to_json() for x in scoreboards],
-        }
-    )
+    payload = await state_cache.payload(user)
+    headers = {"Content-Type": "application/json", "Vary": "Accept-Encoding"}
+    if "since" in request.query:
+        try:
+            since = float(request.query["since"])
+        except ValueError:
+            return web.HTTPBadRequest(reason="Invalid since parameter.")
+        return web.Response(
+            body=state_cache.encode(payload.header, state_cache.start_seq(since)),
+            headers=headers,
+        )
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        if payload.gzipped is None:
+            payload.gzipped = gzip.compress(payload.body, 6)
+        headers["Content-Encoding"] = "gzip"
+        return web.Response(body=payload.gzipped, headers=headers)
+    return web.Response(body=payload.body, headers=headers)
 
 
 @routes.get("/updates")
 @authenticated
 async def get_updates(user: str, request: web.Request):
+    """
+    Scoreboard updates. Clients that reconnect can pass the last epoch and sequence number
+    they have seen as `?epoch=...&seq=...` to only receive the deltas they have missed.
+    """
+    seq: Optional[int] = None
+    if "seq" in request.query:
+        try:
+            seq = int(request.query["seq"])
+        except ValueError:
+            return web.HTTPBadRequest(reason="Invalid seq parameter.")
     ws = web.WebSocketResponse(heartbeat=25)
     await ws.prepare(request)
-    ws_connections.add(ws)
+    hub.subscribe(
+        ws,
+        None if seq is None else missed_messages(seq, request.query.get("epoch", "")),
+    )
     # r8.echo('scoreboard', 'websocket connection opened')
     try:
         async for msg in ws:
@@ -110,7 +468,7 @@ async def get_updates(user: str, request: web.Request):
                     f"ws connection closed with exception {ws.exception()}",
                 )
     finally:
-        ws_connections.remove(ws)
+        hub.unsubscribe(ws)
     return ws
 
 
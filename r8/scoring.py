@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import collections
 import copy
-import functools
 import math
 from math import ceil
 
@@ -36,23 +35,30 @@ def challenge_points(challenge: r8.Challenge, solves: int) -> int:
 
 
 class Scoreboard:
-    """Immutable snapshot of scores at a given point in time."""
+    """Snapshot of scores at a given point in time."""
 
     timestamp: TUnixtime
     scores: collections.Counter[TTeamId]
     solves: collections.defaultdict[TChallengeId, list[TTeamId]]
+    """cid -> teams in the order they solved the challenge"""
+    solved: set[tuple[TChallengeId, TTeamId]]
 
     def __init__(self, timestamp: TUnixtime | None = None):
         self.timestamp = timestamp
         self.scores = collections.Counter()
         self.solves = collections.defaultdict(list)
+        self.solved = set()
 
-    def solve(
+    def changes(
         self, team: TTeamId, challenge: r8.Challenge, timestamp: TUnixtime
-    ) -> Scoreboard | None:
+    ) -> dict[TTeamId, float] | None:
+        """
+        Compute the new scores of all teams that are affected by a solve,
+        or `None` if no score changes.
+        """
         if team.startswith("_"):
             return None
-        if team in self.solves[challenge.id]:
+        if (challenge.id, team) in self.solved:
             raise ValueError(f"{challenge.id} already solved by {team}.")
 
         existing_solves = len(self.solves[challenge.id])
@@ -63,16 +69,44 @@ class Scoreboard:
         if old_score == new_score == 0:
             return None
 
-        ret = copy.deepcopy(self)
-        ret.timestamp = timestamp
-        ret.scores[team] += new_score
+        changes = {}
+        for t in self.solves[challenge.id]:
+            changes[t] = self.scores[t] - score_delta
+        score = self.scores[team] + new_score
         # on equal scores, the oldest team to reach that score wins.
-        ret.scores[team] = ceil(ret.scores[team]) - (int(timestamp) / 100_000_000_000)
+        score = ceil(score) - (int(timestamp) / 100_000_000_000)
         if new_score:
-            ret.scores[team] += first_solve_bonus(challenge, existing_solves)
-        for t in ret.solves[challenge.id]:
-            ret.scores[t] -= score_delta
-        ret.solves[challenge.id].append(team)
+            score += first_solve_bonus(challenge, existing_solves)
+        changes[team] = score
+        return changes
+
+    def apply(
+        self,
+        team: TTeamId,
+        cid: TChallengeId,
+        timestamp: TUnixtime,
+        changes: dict[TTeamId, float],
+    ) -> None:
+        """Apply the result of :meth:`changes` in place."""
+        self.timestamp = timestamp
+        # Counter.update() would add instead of replace.
+        for t, score in changes.items():
+            self.scores[t] = score
+        self.solves[cid].append(team)
+        self.solved.add((cid, team))
+
+    def solve(
+        self, team: TTeamId, challenge: r8.Challenge, timestamp: TUnixtime
+    ) -> Scoreboard | None:
+        """Return a new snapshot with the solve applied, or `None` if no score changes."""
+        changes = self.changes(team, challenge, timestamp)
+        if changes is None:
+            return None
+        ret = Scoreboard(self.timestamp)
+        ret.scores = self.scores.copy()
+        ret.solves = copy.deepcopy(self.solves)
+        ret.solved = self.solved.copy()
+        ret.apply(team, challenge.id, timestamp, changes)
         return ret
 
     def __repr__(self):
@@ -82,11 +116,114 @@ class Scoreboard:
         )
         return f"Scoreboard[{leaders}]"
 
-    @functools.cache
     def to_json(self) -> dict:
         return {"timestamp": self.timestamp, "scores": dict(self.scores)}
 
 
+class ScoreHistory:
+    """
+    All scoreboard states since the start of the event.
+
+    Instead of a full snapshot per solve, only the scores that changed are stored.
+    The full snapshots are materialized on demand in :meth:`to_json`.
+    """
+
+    start: TUnixtime
+    initial: dict[TTeamId, float]
+    """scores at `start`, i.e. from solves that happened before the event started"""
+    changes: list[tuple[TUnixtime, dict[TTeamId, float]]]
+    """(timestamp, new scores of all affected teams) for every solve that changed scores"""
+    timestamps: list[TUnixtime]
+    """the timestamps of `changes`, for bisection"""
+    current: Scoreboard
+    """the latest scoreboard, which is updated in place"""
+
+    def __init__(self, start: TUnixtime):
+        self.start = start
+        self.initial = {}
+        self.changes = []
+        self.timestamps = []
+        self.current = Scoreboard(start)
+
+    def __len__(self) -> int:
+        """Number of scoreboard states, including the initial one."""
+        return len(self.changes) + 1
+
+    def solve(
+        self, team: TTeamId, challenge: r8.Challenge, timestamp: TUnixtime
+    ) -> dict[TTeamId, float] | None:
+        """Record a solve and return the new scores of all affected teams, if any."""
+        changes = self.current.changes(team, challenge, timestamp)
+        if changes is None:
+            return None
+        if timestamp < self.start:
+            self.current.apply(team, challenge.id, self.start, changes)
+            self.initial = dict(self.current.scores)
+            self.changes.clear()
+            self.timestamps.clear()
+        else:
+            self.current.apply(team, challenge.id, timestamp, changes)
+            self.changes.append((timestamp, changes))
+            self.timestamps.append(timestamp)
+        return changes
+
+    def to_json(self) -> list[dict]:
+        """All scoreboard states, in the format of :meth:`Scoreboard.to_json`."""
+        scores = dict(self.initial)
+        ret = [{"timestamp": self.start, "scores": dict(scores)}]
+        for timestamp, changes in self.changes:
+            scores.update(changes)
+            ret.append({"timestamp": timestamp, "scores": dict(scores)})
+        return ret
+
+    def rebase(self, start: TUnixtime) -> bool:
+        """
+        Move the start of the history to a later point in time,
+        merging all changes before `start` into the initial scores.
+        Returns `False` if `start` is earlier than the current start.
+        """
+        if start < self.start:
+            return False
+        n = 0
+        for timestamp, changes in self.changes:
+            if timestamp >= start:
+                break
+            self.initial.update(changes)
+            n += 1
+        del self.changes[:n]
+        del self.timestamps[:n]
+        self.start = start
+        if not self.changes:
+            self.current.timestamp = start
+        return True
+
+    def dump(self) -> dict:
+        """Serialize the history into a JSON-compatible dict."""
+        return {
+            "start": self.start,
+            "initial": self.initial,
+            "changes": self.changes,
+            "solves": self.current.solves,
+        }
+
+    @classmethod
+    def load(cls, data: dict) -> ScoreHistory:
+        """Inverse of :meth:`dump`."""
+        ret = cls(data["start"])
+        ret.initial = data["initial"]
+        ret.changes = [(timestamp, changes) for timestamp, changes in data["changes"]]
+        ret.timestamps = [timestamp for timestamp, _ in ret.changes]
+        ret.current.scores = collections.Counter(ret.initial)
+        for timestamp, changes in ret.changes:
+            ret.current.timestamp = timestamp
+            for team, score in changes.items():
+                ret.current.scores[team] = score
+        for cid, teams in data["solves"].items():
+            ret.current.solves[cid] = teams
+            ret.current.solved.update((cid, team) for team in teams)
+        return ret
+
+
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
 
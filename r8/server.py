@@ -1,3 +1,4 @@
+import asyncio
 import time
 
 import aiohttp_jinja2
@@ -5,24 +6,64 @@ import jinja2
 from aiohttp import web
 
 import r8
+from . import compression
+from . import pages
 from . import rest_api
+from . import staticfiles
 
 
 async def render_template(request):
-    return aiohttp_jinja2.render_template(
-        request.match_info["filename"] or "index.html",
-        request,
-        {"r8": r8, "time": time},
+    return request.app["pages"].response(
+        request.match_info["filename"] or "index.html", request
     )
 
 
 async def serve_static(request: web.Request):
-    return r8.util.serve_static(r8.settings["static_dir"], request.match_info["path"])
+    return r8.util.serve_static(
+        r8.settings["static_dir"], request.match_info["path"], request
+    )
+
+
+async def solve_index(app: web.Application):
+    await r8.state.solves.reload()
+    watch = asyncio.create_task(r8.state.solves.watch())
+    yield
+    watch.cancel()
+
+
+async def static_files(app: web.Application):
+    directories = [r8.settings["static_dir"]]
+    directories += [
+        r8.challenges[cid].static_dir
+        for cid in r8.challenges
+        if r8.challenges[cid].static_dir
+    ]
+    await staticfiles.preload(directories)
+    yield
+
+
+async def password_pool(app: web.Application):
+    r8.passwords.pool = r8.passwords.make_pool()
+    yield
+    r8.passwords.pool.close()
 
 
 def make_app() -> web.Application:
-    app = web.Application()
-    aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(r8.settings["static_dir"]))
+    app = web.Application(middlewares=[compression.middleware()])
+    app.cleanup_ctx.append(solve_index)
+    app.cleanup_ctx.append(password_pool)
+    app.cleanup_ctx.append(static_files)
+    env = aiohttp_jinja2.setup(
+        app,
+        loader=jinja2.FileSystemLoader(r8.settings["static_dir"]),
+        bytecode_cache=pages.bytecode_cache(r8.settings.get("template_cache_dir")),
+    )
+    app["pages"] = pages.Pages(
+        env,
+        r8.settings["static_dir"],
+        {"r8": r8, "time": time},
+        exclude=r8.settings.get("template_cache_exclude", []),
+    )
     app.add_subapp("/api/", rest_api.make_app())
     app.router.add_get("/{filename:(\\w+\\.html)?}", render_template)
     app.router.add_get("/{path:.+}", serve_static)
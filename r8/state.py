@@ -0,0 +1,362 @@
+"""
+In-memory mirror of the database state that is needed on hot request paths.
+
+The index is loaded once on startup and updated by r8 itself on every write.
+Changes made by other processes (e.g. `r8 flags revoke` or a `config.sql` import)
+are detected via a change counter that database triggers maintain for the indexed tables,
+and trigger a full reload.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import collections
+import hashlib
+import html
+import math
+import secrets
+import sqlite3
+import time
+import traceback
+from typing import Optional
+
+import r8
+from r8 import scoring
+
+
+def _changes(conn: sqlite3.Connection) -> int:
+    """The number of changes to the users, teams, challenges, flags, and submissions tables."""
+    return conn.execute("SELECT changes FROM solve_index_changes").fetchone()[0]
+
+
+class Directory:
+    """All users and their teams."""
+
+    data_version: Optional[int]
+    """The change counter (see :func:`_changes`) this directory corresponds to."""
+    users: set[str]
+    teams: dict[str, str]
+    """uid -> tid"""
+
+    def __init__(self):
+        self.data_version = None
+        self.users = set()
+        self.teams = {}
+        self._team_list = None
+
+    @classmethod
+    def read(
+        cls, conn: sqlite3.Connection, known_version: Optional[int] = None
+    ) -> Optional[Directory]:
+        """
+        Load the directory from the database.
+        Returns `None` if `known_version` is still current, i.e. nothing has changed.
+        """
+        ret = cls()
+        ret.data_version = _changes(conn)
+        if ret.data_version == known_version:
+            return None
+        ret.users = {uid for (uid,) in conn.execute("SELECT uid FROM users")}
+        ret.teams = dict(conn.execute("SELECT uid, tid FROM teams"))
+        return ret
+
+    def add_user(self, uid: str, tid: Optional[str]) -> None:
+        """Record a new user."""
+        self.users.add(uid)
+        if tid:
+            self.teams[uid] = tid
+            self._team_list = None
+
+    def get_team(self, uid: str) -> Optional[str]:
+        return self.teams.get(uid)
+
+    def get_teams(self) -> list[str]:
+        if self._team_list is None:
+            self._team_list = list(dict.fromkeys(self.teams.values()))
+        return self._team_list
+
+    def get_users(self) -> list[str]:
+        return list(self.users)
+
+
+class SolveIndex:
+    """Flags, challenge windows, users, teams, and who solved what."""
+
+    data_version: Optional[int]
+    """
+    The number of changes to the indexed tables by other connections or processes
+    this index reflects, or `None` if the index has not been loaded yet.
+    """
+    own_changes: int
+    """Changes made through :meth:`execute`, which are excluded from `data_version`."""
+    version: int
+    """Incremented on every change to the solve state, including reloads."""
+    directory: Directory
+    flags: dict[str, tuple[str, int]]
+    """fid -> (cid, max_submissions)"""
+    flag_submissions: collections.Counter[str]
+    """fid -> number of submissions"""
+    windows: dict[str, tuple[int, int, bool]]
+    """cid -> (t_start, t_stop, team)"""
+    user_solves: collections.defaultdict[str, dict[str, int]]
+    """uid -> {cid: solve time}"""
+    team_solves: collections.defaultdict[str, dict[str, int]]
+    """tid -> {cid: latest solve time of any team member}"""
+    solve_times: collections.defaultdict[str, list[int]]
+    """cid -> sorted timestamps of all submissions"""
+
+    def __init__(self):
+        self.data_version = None
+        self.own_changes = 0
+        self.version = 0
+        self.directory = Directory()
+        self.flags = {}
+        self.flag_submissions = collections.Counter()
+        self.windows = {}
+        self.user_solves = collections.defaultdict(dict)
+        self.team_solves = collections.defaultdict(dict)
+        self.solve_times = collections.defaultdict(list)
+        self._challenge_list = None
+        self._challenge_list_expiry = 0.0
+        self._boundaries = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.data_version is not None
+
+    @classmethod
+    def _read(cls, conn: sqlite3.Connection) -> SolveIndex:
+        ret = cls()
+        ret.data_version = _changes(conn)
+        ret.directory = Directory.read(conn)
+        for fid, cid, max_submissions in conn.execute(
+            "SELECT fid, cid, max_submissions FROM flags NATURAL INNER JOIN challenges"
+        ):
+            ret.flags[fid] = (cid, max_submissions)
+        for cid, t_start, t_stop, team in conn.execute(
+            """
+            SELECT cid, CAST(strftime('%s', t_start) AS INTEGER), CAST(strftime('%s', t_stop) AS INTEGER), team
+            FROM challenges
+            """
+        ):
+            ret.windows[cid] = (t_start, t_stop, bool(team))
+        for uid, fid, cid, timestamp in conn.execute(
+            """
+            SELECT uid, fid, cid, CAST(strftime('%s', timestamp) AS INTEGER)
+            FROM submissions NATURAL INNER JOIN flags
+            ORDER BY timestamp
+            """
+        ):
+            ret._add_submission(uid, fid, cid, timestamp)
+        return ret
+
+    def is_current(self, conn: sqlite3.Connection) -> bool:
+        """
+        Check if the indexed tables have not been modified by another connection.
+        Must be called on the writer connection.
+        """
+        return self.loaded and _changes(conn) - self.own_changes == self.data_version
+
+    def execute(
+        self, conn: sqlite3.Connection, query: str, parameters=()
+    ) -> sqlite3.Cursor:
+        """
+        Execute a statement that modifies the indexed tables on the writer connection.
+        The caller updates the index itself, so the change does not trigger a reload.
+        """
+        before = _changes(conn)
+        ret = conn.execute(query, parameters)
+        self.own_changes += _changes(conn) - before
+        return ret
+
+    def _reload(self, conn: sqlite3.Connection) -> Optional[SolveIndex]:
+        if self.is_current(conn):
+            return None
+        return SolveIndex._read(conn)
+
+    async def reload(self) -> None:
+        """
+        Reload the index if the database has been modified by another connection.
+
+        This runs on the writer connection, so all writes queued before are reflected.
+        """
+        self._apply(await r8.async_db.write(self._reload))
+
+    def reload_blocking(self) -> None:
+        """Like :meth:`reload`, but blocks. Meant for synchronous code, e.g. CLI commands."""
+        self._apply(r8.async_db.write_blocking(self._reload))
+
+    def _apply(self, fresh: Optional[SolveIndex]) -> None:
+        if fresh:
+            fresh.version = self.version + 1
+            self.__dict__.update(fresh.__dict__)
+
+    async def watch(self, interval: float = 1) -> None:
+        """Periodically check for modifications by other processes."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                r8.echo("r8", f"Error reloading solve index: {e}", err=True)
+
+    def _add_submission(self, uid: str, fid: str, cid: str, timestamp: int) -> None:
+        self.flag_submissions[fid] += 1
+        bisect.insort(self.solve_times[cid], timestamp)
+        self.user_solves[uid][cid] = max(timestamp, self.user_solves[uid].get(cid, 0))
+        if tid := self.directory.teams.get(uid):
+            self.team_solves[tid][cid] = max(
+                timestamp, self.team_solves[tid].get(cid, 0)
+            )
+        self._challenge_list = None
+        self.version += 1
+
+    def add_submission(self, uid: str, fid: str) -> int:
+        """Record a new submission and return its timestamp."""
+        timestamp = int(time.time())
+        self._add_submission(uid, fid, self.flags[fid][0], timestamp)
+        return timestamp
+
+    def remove_submission(self, uid: str, fid: str, timestamp: int) -> None:
+        """Undo :meth:`add_submission`."""
+        cid = self.flags[fid][0]
+        self.flag_submissions[fid] -= 1
+        self.solve_times[cid].remove(timestamp)
+        self.user_solves[uid].pop(cid, None)
+        if tid := self.directory.teams.get(uid):
+            times = [
+                self.user_solves[u][cid]
+                for u, t in self.directory.teams.items()
+                if t == tid and cid in self.user_solves.get(u, ())
+            ]
+            if times:
+                self.team_solves[tid][cid] = max(times)
+            else:
+                self.team_solves[tid].pop(cid, None)
+        self._challenge_list = None
+        self.version += 1
+
+    def add_flag(self, fid: str, cid: str, max_submissions: int) -> None:
+        """Record a new flag."""
+        if cid in self.windows:
+            self.flags[fid] = (cid, max_submissions)
+
+    def is_active(self, cid: str) -> bool:
+        """Check if a challenge is currently active."""
+        t_start, t_stop, _ = self.windows[cid]
+        return t_start <= time.time() <= t_stop
+
+    def solve_time(self, uid: str, cid: str) -> Optional[int]:
+        """
+        Get the time a user (or, for team challenges, their team) has solved a challenge.
+        Returns `None` if the challenge has not been solved yet.
+        """
+        window = self.windows.get(cid)
+        tid = self.directory.teams.get(uid)
+        if window and window[2] and tid:
+            return self.team_solves.get(tid, {}).get(cid)
+        return self.user_solves.get(uid, {}).get(cid)
+
+    def has_solved(self, uid: str, cid: str) -> bool:
+        """Check if a user (or, for team challenges, their team) has solved a challenge."""
+        return self.solve_time(uid, cid) is not None
+
+    def solve_rank(self, cid: str, solve_time: int) -> int:
+        """Get the number of submissions for a challenge up to (and including) `solve_time`."""
+        return bisect.bisect_right(self.solve_times.get(cid, ()), solve_time)
+
+    def challenge_list(self) -> list[dict]:
+        """
+        The part of :func:`r8.util.get_challenges` that is identical for all users.
+
+        The list is cached until the next submission or until the next challenge becomes visible.
+        """
+        now = time.time()
+        if self._challenge_list is None or now >= self._challenge_list_expiry:
+            self._challenge_list = [
+                _challenge_info(cid, t_start, t_stop, team, len(self.solve_times[cid]))
+                for cid, (t_start, t_stop, team) in self.windows.items()
+                if t_start < now  # hide not yet active challenges
+            ]
+            self._challenge_list_expiry = min(
+                (t_start for t_start, _, _ in self.windows.values() if t_start >= now),
+                default=math.inf,
+            )
+        return self._challenge_list
+
+    def challenge_list_version(self, uid: str, max_age: float) -> str:
+        """
+        A token that changes whenever :func:`r8.util.get_challenges` may return something
+        different for a user: on every submission, when a challenge starts or ends, or when
+        the user's team changes. Descriptions may depend on arbitrary state, so the token
+        also changes every `max_age` seconds.
+        """
+        now = time.time()
+        if self._boundaries is None:
+            self._boundaries = sorted(
+                {
+                    t
+                    for t_start, t_stop, _ in self.windows.values()
+                    for t in (t_start, t_stop)
+                }
+            )
+        key = (
+            _instance,
+            self.version,
+            bisect.bisect_left(self._boundaries, now),
+            int(now // max_age),
+            uid,
+            self.directory.get_team(uid),
+        )
+        return hashlib.sha256(repr(key).encode()).hexdigest()[:20]
+
+
+_instance = secrets.token_hex(8)
+"""changes on restart, as challenges may have been updated"""
+
+
+def _challenge_info(cid: str, start: int, stop: int, team: bool, solves: int) -> dict:
+    challenge = {
+        "cid": cid,
+        "start": start,
+        "stop": stop,
+        "solves": solves,
+        "team": team,
+    }
+    try:
+        inst: r8.Challenge = r8.challenges[cid]
+        challenge["title"] = str(inst.title)
+        challenge["tags"] = [str(x) for x in inst.tags]
+    except Exception:
+        challenge.setdefault("title", cid)
+        challenge["tags"] = []
+        challenge["description"] = f"<pre>{html.escape(traceback.format_exc())}</pre>"
+        return challenge
+
+    challenge["points"] = scoring.challenge_points(inst, solves)
+    challenge["first_solve_bonus"] = scoring.first_solve_bonus(inst, solves)
+    return challenge
+
+
+solves: SolveIndex = SolveIndex()
+"""singleton index that is used while r8 is running."""
+
+
+def get_solves() -> SolveIndex:
+    """
+    Get the solve index, loading it if necessary. For synchronous code.
+
+    The server loads the index on startup and watches the database for changes,
+    so within the server this never touches the database.
+    Outside of it (e.g. in CLI commands) nothing watches the database,
+    so this checks for modifications by other processes on every call.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        solves.reload_blocking()
+    else:
+        if not solves.loaded:
+            solves.reload_blocking()
+    return solves
@@ -0,0 +1,50 @@
+function fetchApi(url,options={}){options["credentials"]="same-origin";return fetch(url,options).catch(err=>{throw"Network error."}).then(r=>r.text()).then(text=>{try{return JSON.parse(text);}catch(e){throw text;}})}
+function login(username,password){let req={username:username.trim(),password:password.trim()};return fetchApi("/api/auth/login",{method:"POST",body:JSON.stringify(req)});}
+function logout(){return fetchApi("/api/auth/logout",{method:"POST"});}
+const descriptionCache=(()=>{try{return JSON.parse(sessionStorage.getItem("r8-descriptions"))||{};}catch(e){return{};}})();function withDescriptions(challenges){const missing=[...new Set(challenges.map(c=>c.description_hash))].filter(h=>!(h in descriptionCache));const fetched=missing.length===0?Promise.resolve({}):fetchApi(`/api/challenges/descriptions?hashes=${missing.join(",")}`);return fetched.then(descriptions=>{Object.assign(descriptionCache,descriptions);if(challenges.some(c=>!(c.description_hash in descriptionCache))){return fetchApi("/api/challenges/").then(status=>status.challenges);}
+const used=new Set(challenges.map(c=>c.description_hash));for(const h of Object.keys(descriptionCache)){if(!used.has(h)){delete descriptionCache[h];}}
+try{sessionStorage.setItem("r8-descriptions",JSON.stringify(descriptionCache));}catch(e){}
+return challenges.map(c=>Object.assign({},c,{description:descriptionCache[c.description_hash]}));});}
+const setDangerousHtml=(html,el)=>{if(el===null)return;const range=document.createRange();range.selectNodeContents(el);range.deleteContents();el.appendChild(range.createContextualFragment(html));};function Logo(){let color=()=>`hsl(${Math.floor(Math.random()*255)}, 100%, 60%)`;return React.createElement("svg",{className:"mr-1",width:"40",height:"40",fill:color(),onClick:(e)=>{e.currentTarget.setAttribute("fill",color())},viewBox:"0 0 100 110"},React.createElement("path",{d:"M28.1,30.2v13.5h3.1V30.2c0-0.2,0.1-0.3,0.3-0.3h5v-3.1h-5C29.6,26.8,28.1,28.3,28.1,30.2z"}),React.createElement("path",{d:"M5,5v90h90V5H5z M71.3,82.3h-4.5V55.6H31.2c-3,0-5.4-2.4-5.4-5.4V29.9c0-3,2.4-5.4,5.4-5.4h35.6v0h4.5V82.3z"}));}
+class Countdown extends React.Component{constructor(props){super(props);this.state=this.getRemaining();}
+componentDidMount(){this.interval=setInterval(()=>{this.setState(this.getRemaining);},1000);}
+componentWillUnmount(){clearInterval(this.interval);}
+getRemaining(){let t=Date.parse(this.props.target)-Date.parse(new Date()),seconds=Math.floor((t/1000)%60),minutes=Math.floor((t/1000/60)%60),hours=Math.floor((t/(1000*60*60))%24),days=Math.floor(t/(1000*60*60*24));return{'total':t,'days':days,'hours':hours,'minutes':minutes,'seconds':seconds};}
+render(){if(this.state.total<0){return React.createElement("span",null,"\ud83c\udfc1 time is up!");}
+const style={color:this.state.total<60000?"red":"inherit"};return React.createElement("span",{style:style}," \u23f1",' ',(this.state.days*24+this.state.hours).toString().padStart(2,"0"),":",this.state.minutes.toString().padStart(2,"0"),":",this.state.seconds.toString().padStart(2,"0"))}}
+function Nav({user,team,onLogout}){function doLogout(){logout().then(onLogout);}
+return React.createElement("nav",{className:"navbar sticky-top navbar-dark bg-dark"},React.createElement("div",{className:"container"},React.createElement("a",{className:"navbar-brand overflow-auto",href:"#"},React.createElement(Logo,null)," Capture The Flag"),r8Config.start&&r8Config.end&&React.createElement("span",{className:"navbar-text"},React.createElement(Countdown,{target:new Date(1000*(Date.now()<r8Config.start*1000?r8Config.start:r8Config.end))})),React.createElement("span",{className:"navbar-text"},user&&React.createElement("button",{className:"btn btn-sm btn-outline-secondary",onClick:doLogout},"Logout ",user,team&&` (${team})`))))}
+class Register extends React.Component{constructor(props){super(props);this.state={username:"",password:"",nickname:"",error:false};this.onChange=this.onChange.bind(this);this.onSubmit=this.onSubmit.bind(this);}
+render(){return React.createElement("form",{className:"col-md-5 col-lg-4 text-center",onSubmit:this.onSubmit},React.createElement("div",{className:"form-group"},React.createElement("input",{name:"username",type:"email",placeholder:"foo@uibk.ac.at",className:"form-control",value:this.state.username,required:true,autoComplete:"username",onChange:this.onChange})),React.createElement("div",{className:"form-group"},React.createElement("input",{name:"nickname",type:"text",placeholder:"Team Name (public, SFW)",className:"form-control",value:this.state.nickname,required:true,autoComplete:"nickname",onChange:this.onChange})),React.createElement("div",{className:"form-group"},React.createElement("input",{name:"password",type:"password",placeholder:"Password",className:"form-control",value:this.state.password,required:true,autoComplete:"new-password",onChange:this.onChange})),React.createElement("div",{className:"form-group"},React.createElement("button",{className:"btn btn-success btn-lg px-5"},"Register")),this.state.error&&React.createElement("div",{className:"alert alert-danger",role:"alert"},this.state.error));}
+onChange(e){this.setState({[e.target.name]:e.target.value});}
+onSubmit(e){e.preventDefault();this.setState({error:false},()=>{let req={username:this.state.username.trim(),password:this.state.password.trim(),nickname:this.state.nickname.trim(),};fetchApi("/api/auth/register",{method:"POST",body:JSON.stringify(req)}).then(this.props.onLogin,err=>this.setState({error:err}));});}}
+class Login extends React.Component{constructor(props){super(props);this.state={username:"",password:"",error:false,};this.onChange=this.onChange.bind(this);this.onSubmit=this.onSubmit.bind(this);}
+render(){return React.createElement("form",{className:"col-md-5 col-lg-4 text-center align-self-center",onSubmit:this.onSubmit},React.createElement("div",{className:"form-group"},React.createElement("input",{name:"username",type:"text",placeholder:"Username",className:"form-control",value:this.state.username,autoComplete:"username",required:true,onChange:this.onChange})),React.createElement("div",{className:"form-group"},React.createElement("input",{name:"password",type:"password",placeholder:"Password",className:"form-control",value:this.state.password,autoComplete:"current-password",required:true,onChange:this.onChange})),React.createElement("div",{className:"form-group"},React.createElement("button",{className:"btn btn-primary btn-lg px-5"},"Login")),this.state.error&&React.createElement("div",{className:"alert alert-danger",role:"alert"},this.state.error));}
+onChange(e){this.setState({[e.target.name]:e.target.value});}
+onSubmit(e){e.preventDefault();this.setState({error:false},()=>{login(this.state.username,this.state.password).then(this.props.onLogin,err=>this.setState({error:err}));});}}
+class Submit extends React.Component{constructor(props){super(props);this.state={flag:"",error:false,success:false,};this.onSubmit=this.onSubmit.bind(this);this.onChange=this.onChange.bind(this);}
+onSubmit(e){e.preventDefault();if(this.state.flag.trim()===""){return;}
+fetchApi("/api/challenges/submit?descriptions=hash",{method:"POST",body:JSON.stringify({flag:this.state.flag.trim()})}).then(json=>{this.props.onSolve(json.challenges);this.setState({success:json.solved,error:false,flag:""},()=>{setTimeout(()=>this.setState({success:false}),10000)})}).catch(error=>{this.setState({error,success:false,flag:""},()=>{setTimeout(()=>this.setState({error:false}),1000)})})}
+onChange(e){this.setState({[e.target.name]:e.target.value});}
+render(){return React.createElement("section",{className:"text-center bg-info"},React.createElement("form",{className:"container p-5",onSubmit:this.onSubmit},React.createElement("div",{className:"form-group"},React.createElement("input",{name:"flag",type:"text",className:"form-control text-center",placeholder:"__flag__{...}",value:this.state.flag,onChange:this.onChange,autoComplete:"off"})),React.createElement("div",{className:"form-group"},this.state.error&&React.createElement("button",{className:"btn btn-danger btn-lg"},this.state.error),!this.state.error&&this.state.success&&React.createElement("button",{className:"btn btn-success btn-lg"},React.createElement("strong",null,"Congratulations!")," You solved ",React.createElement("i",null,this.state.success),"."),!this.state.error&&!this.state.success&&React.createElement("button",{className:"btn btn-warning btn-lg"},"Submit Flag"))));}}
+function fmtDate(unixtime){let date=new Date(unixtime*1000);if(date.getFullYear()>3000){return"–";}else{return date.toLocaleString().replace(/(\d*:\d*):\d*/,"$1");}}
+function Tag({name}){let className="badge mr-1 badge-";className+={easy:"success",medium:"warning",hard:"danger",}[name]||"secondary";return React.createElement("span",{className:className},name);}
+function Challenge({challenge}){const expired=Date.now()/1000>challenge.stop;let className="card mb-2";let time;if(challenge.solve_time){className+=" card-solved";time=`Solved: ${fmtDate(challenge.solve_time)}`;}else if(expired){className+=" card-expired";time=`Expired: ${fmtDate(challenge.stop)}`;}else{className+=" card-active";time=`Deadline: ${fmtDate(challenge.stop)}`;}
+let first_solve_bonus=null;if(challenge.first_solve_bonus){if(challenge.solve_time){first_solve_bonus=React.createElement("span",{title:`Awarded first solve bonus as #${challenge.solve_rank}.`},"+",challenge.first_solve_bonus)}else{first_solve_bonus=React.createElement("span",{title:`First Solve Bonus ${challenge.solves} solves so far)`,className:"ml-1"},"\ud83d\udd25 ",challenge.first_solve_bonus);}}else{first_solve_bonus=React.createElement("span",{className:"ml-1"},"(",challenge.solves," solve",challenge.solves!==1?'s':'',")");}
+return React.createElement("div",{className:className},React.createElement("div",{className:"card-body"},React.createElement("h5",{className:"card-title"},challenge.title),React.createElement("h6",{className:"card-subtitle text-muted mb-2"},time),React.createElement("div",{className:"card-text",ref:setDangerousHtml.bind(null,challenge.description)})),React.createElement("div",{className:"card-footer"},challenge.tags.map(t=>React.createElement(Tag,{key:t,name:t})),r8Config.scoring&&!!challenge.points&&React.createElement("span",{className:"float-right"},React.createElement("span",{title:"Base Points"},"\ud83d\udca0 ",challenge.points),first_solve_bonus)));}
+function Scoreboard(){return React.createElement("div",{className:"container position-relative"},React.createElement("a",{id:"scoretable-link",className:"btn btn-secondary btn-sm m-2",href:"scoretable.html"},"show details"),React.createElement("iframe",{id:"scoreboard",src:"scoreboard.html",scrolling:"no"}));}
+function Dashboard({challenges,onSolve}){return React.createElement(React.Fragment,null,r8Config.scoring&&React.createElement(Scoreboard,null),React.createElement(Submit,{onSolve:onSolve}),React.createElement("section",{className:"container pb-3"},React.createElement("h2",{className:"text-center m-5"},"Challenges"),challenges.map(x=>React.createElement(Challenge,{key:x.cid,challenge:x}))))}
+class Main extends React.Component{constructor(props){super(props);this.state={uiState:"fetching",error:false,user:false,team:false,challenges:[]};this.onLogin=this.onLogin.bind(this);this.onLogout=this.onLogout.bind(this);this.onSolve=this.onSolve.bind(this);this.fetchStatus=this.fetchStatus.bind(this);}
+componentDidMount(){if(this.state.uiState==="fetching"){this.fetchStatus()}}
+render(){let body;switch(this.state.uiState){case"fetching":body=React.createElement("div",{className:"d-flex justify-content-center m-5"},React.createElement("div",{className:"spinner-border"}));break;case"login":body=React.createElement("div",{className:"container p-5"},React.createElement("div",{className:"row p-5 justify-content-md-center"},React.createElement(Login,{onLogin:this.onLogin}),r8Config.register&&React.createElement(Register,{onLogin:this.onLogin})));break;case"dashboard":body=React.createElement(Dashboard,{challenges:this.state.challenges,onSolve:this.onSolve});break;case"error":body=React.createElement("pre",{className:"alert alert-danger m-5",role:"alert"},this.state.error);break;}
+return React.createElement(React.Fragment,null,React.createElement(Nav,{user:this.state.user,team:this.state.team,onLogout:this.onLogout}),body);}
+onLogin(){this.setState({uiState:"fetching"},this.fetchStatus);}
+onLogout(){sessionStorage.removeItem("r8-challenges");sessionStorage.removeItem("r8-descriptions");for(const h of Object.keys(descriptionCache)){delete descriptionCache[h];}
+this.setState({uiState:"login",challenges:[],user:false,team:false});}
+onSolve(challenges){withDescriptions(challenges).then(challenges=>this.setState({challenges})).catch(err=>console.error(err));}
+fetchStatus(){let cached=null;try{cached=JSON.parse(sessionStorage.getItem("r8-challenges"));}catch(e){}
+const headers=cached?{"If-None-Match":cached.etag}:{};return fetch("/api/challenges/?descriptions=hash",{credentials:"same-origin",headers}).catch(err=>{throw"Network error."}).then(resp=>{if(resp.status===401){this.setState({uiState:"login"});}else if(resp.status===304&&cached){return this.showStatus(cached.status);}else{return resp.text().then(text=>{let status;try{status=JSON.parse(text);}catch(e){throw text;}
+const etag=resp.headers.get("ETag");try{if(etag){sessionStorage.setItem("r8-challenges",JSON.stringify({etag,status}));}else{sessionStorage.removeItem("r8-challenges");}}catch(e){}
+return this.showStatus(status);});}}).catch(err=>{console.error(err);this.setState({uiState:"error",error:String(err)});});}
+showStatus(status){console.debug("status",status);return withDescriptions(status.challenges).then(challenges=>{this.setState({uiState:"dashboard",challenges,user:status.user,team:status.team,});});}}
+ReactDOM.render(React.createElement(Main,null),document.getElementById('root'));
\ No newline at end of file
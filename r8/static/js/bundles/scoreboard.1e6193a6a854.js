@@ -0,0 +1,17 @@
+function fetchApi(url,options={}){options["credentials"]="same-origin";return fetch(url,options).catch(err=>{throw"Network error."}).then(r=>r.text()).then(text=>{try{return JSON.parse(text);}catch(e){throw text;}})}
+function legendFormatter(data){if(data.x===undefined){data.xHTML="<h1>Current Ranking</h1>";data.series.forEach((s,i)=>{s.yHTML=this.getValue(this.numRows()-1,i+1)||0;});}else{data.xHTML=`<h1>${data.xHTML}</h1>`;}
+data.series.sort((a,b)=>b.yHTML-a.yHTML);let html=data.xHTML;data.series.forEach(function(series){var labeledData=`${series.labelHTML} (${Math.ceil(series.yHTML)})`;if(series.isHighlighted){labeledData=`<strong>${labeledData}</strong>`;}
+html+=`<br>${series.dashHTML} ${labeledData}`;});return html;}
+fetchApi("/api/scoreboard/state"+location.search).then(data=>{let x,i,j;let{scoreboards,teams}=data;let knownTeams=new Set(teams);for(x of scoreboards){x.timestamp=new Date(x.timestamp*1000);}
+console.log(data);function transformData(scoreboards){return scoreboards.map((x)=>{let ret=new Array(teams.length+1);ret[0]=x.timestamp;for(let i=0;i<teams.length;i++){ret[i+1]=x.scores[teams[i]]||0;}
+return ret;})}
+smoothPlotter.smoothing=0.35;window.dy=new Dygraph(document.getElementById("scoreboard"),transformData(scoreboards),{title:"Scoreboard",xlabel:"Time",ylabel:"Score",legend:"always",legendFormatter:legendFormatter,labelsDiv:document.getElementById("leaderboard"),axes:{x:{drawGrid:false,},},labels:['Time',...teams],highlightCircleSize:2,strokeBorderWidth:1,plotter:smoothPlotter,xLabelHeight:25,titleHeight:70,highlightSeriesOpts:{strokeWidth:3,highlightCircleSize:5}});let seq=data.seq;let latestSeq=seq;let catchingUp=null;function addScoreboard(timestamp,scores){scoreboards.push({timestamp:new Date(timestamp*1000),scores:scores});for(let team of Object.keys(scores)){if(knownTeams.has(team))
+continue;knownTeams.add(team);teams.push(team);}}
+function redraw(){window.dy.updateOptions({labels:['Time',...teams],'file':transformData(scoreboards)});}
+function catchUp(){if(catchingUp)
+return catchingUp;let params=new URLSearchParams(location.search);params.set("since",seq);catchingUp=fetchApi("/api/scoreboard/state?"+params).then(missed=>{for(let x of missed.scoreboards){addScoreboard(x.timestamp,x.scores);}
+seq=missed.seq;redraw();}).finally(()=>{catchingUp=null;if(latestSeq>seq)
+catchUp();});return catchingUp;}
+function missed(upTo){latestSeq=Math.max(latestSeq,upTo);catchUp();}
+window.updates=connectUpdates(()=>seq,{epoch:data.epoch,onDelta(msg){console.log("websocket update",msg);if(catchingUp)
+return missed(msg.seq);let lastScores=scoreboards[scoreboards.length-1].scores;addScoreboard(msg.timestamp,Object.assign({},lastScores,msg.scores));seq=msg.seq;redraw();},onMissed:missed,onReset:()=>location.reload(),});})
\ No newline at end of file
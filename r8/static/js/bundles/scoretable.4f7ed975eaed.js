@@ -0,0 +1,13 @@
+function fetchApi(url,options={}){options["credentials"]="same-origin";return fetch(url,options).catch(err=>{throw"Network error."}).then(r=>r.text()).then(text=>{try{return JSON.parse(text);}catch(e){throw text;}})}
+function ScoretableHeader({state}){let challenges=state.challenges.map(challenge=>{let title=`${challenge.title} (${Object.values(state.solves[challenge.cid]).length} solves, ${challenge.points} points)`;return React.createElement("th",{key:challenge.cid},React.createElement("div",{title:title},React.createElement("span",null,challenge.title)))});return React.createElement("thead",null,React.createElement("tr",null,React.createElement("th",{colSpan:"2"}),challenges,React.createElement("th",null)));}
+function ScoretableBody({state}){let lastScores=state.scoreboards[state.scoreboards.length-1].scores;console.log(state);let teams=state.teams.sort((a,b)=>(lastScores[b]||0)-(lastScores[a]||0)).map((tid,i)=>{let challenges=state.challenges.map(challenge=>React.createElement("td",{key:challenge.cid,className:state.solves[challenge.cid][tid]?"scoretable-solved":"scoretable-unsolved"},"\ud83c\udff4"));return React.createElement("tr",{key:tid},React.createElement("td",{className:"scoretable-rank"},i+1),React.createElement("td",{className:"scoretable-name"},tid),challenges,React.createElement("td",{className:"scoretable-score"},Math.ceil(lastScores[tid])||""))});return React.createElement("tbody",null,teams);}
+function Scoretable({state}){return React.createElement("table",{id:"scoretable",className:"table table-striped table-bordered table-sm table-hover"},React.createElement(ScoretableHeader,{state:state}),React.createElement(ScoretableBody,{state:state}));}
+class Main extends React.Component{constructor(props){super(props);this.state={};}
+refresh(){return fetchApi("/api/scoreboard/state"+location.search).then(state=>{let solves={};for(const challenge of state.challenges){solves[challenge.cid]={};}
+Object.entries(state.solves).forEach(([cid,tids])=>{tids.forEach((tid)=>{solves[cid][tid]=true;})});state.solves=solves;console.debug("state",state);return this.setState(state);}).catch(error=>{console.error(error);alert(error);})}
+applyDelta(msg){let{team,cid,points}=msg.solve;let lastScores=this.state.scoreboards[this.state.scoreboards.length-1].scores;let solves=Object.assign({},this.state.solves);solves[cid]=Object.assign({},solves[cid],{[team]:true});this.setState({seq:msg.seq,teams:this.state.teams.includes(team)?this.state.teams:[...this.state.teams,team],challenges:this.state.challenges.map(challenge=>challenge.cid===cid?Object.assign({},challenge,{points}):challenge),solves:solves,scoreboards:[{timestamp:msg.timestamp,scores:Object.assign({},lastScores,msg.scores)}],});}
+componentDidMount(){this.refresh().then(()=>{this.updates=connectUpdates(()=>this.state.seq,{epoch:this.state.epoch,onDelta:msg=>this.applyDelta(msg),onMissed:()=>this.refresh(),onReset:()=>this.refresh(),});});}
+componentWillUnmount(){this.updates.close();}
+render(){if(!this.state.teams){return React.createElement("div",{className:"text-center rotating"},"\u231b");}
+return React.createElement(React.Fragment,null,React.createElement("h1",null,"Team Scores"),React.createElement(Scoretable,{state:this.state}));}}
+ReactDOM.render(React.createElement(Main,null),document.getElementById('root'));
\ No newline at end of file
@@ -0,0 +1,63 @@
+// Client for the scoreboard updates on /api/scoreboard/updates, shared by scoreboard.html and
+// scoretable.html. See r8/rest_api/scoreboard.py for the protocol.
+const SCOREBOARD_PROTOCOL_VERSION = 1;
+
+// Subscribe to scoreboard updates. `getSeq` returns the sequence number of the state the page
+// currently displays, `epoch` is the epoch of the initially loaded state. Sequence numbers
+// start over if the server is restarted, which changes the epoch.
+//  - `onDelta(msg)` is called for the delta that directly follows the current state.
+//  - `onMissed(seq)` is called if updates up to `seq` have been missed, e.g. after falling behind.
+//  - `onReset()` is called if the state needs to be loaded again from scratch, e.g. because the
+//    server has been restarted or the protocol has changed.
+// If the connection is lost, reconnect with jittered exponential backoff and resume from the
+// last seen sequence number.
+function connectUpdates(getSeq, {epoch, onDelta, onMissed, onReset}) {
+    let attempt = 0;
+    let ws = null;
+    let stopped = false;
+
+    function onMessage(msg) {
+        let seq = getSeq();
+        if (msg.v !== SCOREBOARD_PROTOCOL_VERSION || msg.epoch !== epoch) {
+            epoch = msg.epoch;
+            onReset();
+        } else if (msg.type === "snapshot" && msg.seq < seq) {
+            onReset();
+        } else if (msg.type === "delta" && msg.seq === seq + 1) {
+            onDelta(msg);
+        } else if (msg.seq > seq) {
+            onMissed(msg.seq);
+        }
+    }
+
+    function connect() {
+        let params = new URLSearchParams(location.search);
+        let seq = getSeq();
+        if (seq !== undefined && epoch !== undefined) {
+            params.set("epoch", epoch);
+            params.set("seq", seq);
+        }
+        ws = new WebSocket(location.origin.replace(/^http/, "ws") + "/api/scoreboard/updates?" + params);
+        ws.onopen = () => {
+            console.log("WebSocket connection opened.");
+            attempt = 0;
+        };
+        ws.onmessage = (e) => onMessage(JSON.parse(e.data));
+        ws.onclose = (e) => {
+            console.error(e);
+            if (stopped)
+                return;
+            let delay = Math.min(30000, 1000 * 2 ** attempt) * (0.5 + Math.random());
+            attempt++;
+            window.setTimeout(connect, delay);
+        };
+    }
+
+    connect();
+    return {
+        close() {
+            stopped = true;
+            ws.close();
+        }
+    };
+}
@@ -0,0 +1,314 @@
+"""
+Static file serving for r8's `static_dir` and the static directories of challenges.
+
+All files are indexed once on startup (see :func:`preload`), so that requests do not need to
+touch the filesystem to find a file. Files that have been added later are looked up on demand.
+Files are read in a thread, their contents are cached in memory up to a total size
+and served with strong ETags and Last-Modified headers, conditional requests are answered
+with 304. Precompressed `.br` and `.gz` siblings are served to clients that accept them,
+and the fingerprinted bundles built by :mod:`r8.bundles` may be cached by browsers
+indefinitely. Range requests and large files are delegated to :class:`aiohttp.web.FileResponse`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import email.utils
+import hashlib
+import mimetypes
+import os
+import re
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Optional
+from typing import Union
+
+from aiohttp import hdrs
+from aiohttp import web
+
+import r8
+
+MAX_CACHED_SIZE = 8 * 1024 * 1024
+"""Larger files are streamed from disk instead of being cached in memory."""
+
+CACHE_SIZE = 64 * 1024 * 1024
+"""Total size of all cached file contents. The least recently used ones are evicted first."""
+
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+"""Content-Encoding -> file extension of precompressed siblings, in order of preference."""
+
+FINGERPRINTED = re.compile(r"js/bundles/[\w-]+\.[0-9a-f]{12}\.js")
+"""Bundles built by `r8 static build`, which are named after a hash of their contents."""
+
+TPath = Union[str, Path]
+
+
+class _File:
+    def __init__(self, path: Path, stat: os.stat_result):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        content_type, encoding = mimetypes.guess_type(path.name)
+        if encoding:
+            # e.g. foo.js.gz, which should be downloaded as-is.
+            content_type = None
+        self.content_type = content_type or "application/octet-stream"
+        self.variants: dict[str, Path] = {}
+        """Content-Encoding -> precompressed sibling"""
+        self.etag: Optional[str] = None
+        """hash of the file's contents, or `None` if the file has not been read yet"""
+
+    def etag_header(self, encoding: Optional[str]) -> str:
+        return f'"{self.etag}{"-" + encoding if encoding else ""}"'
+
+    def read(self, encoding: Optional[str]) -> tuple[str, bytes]:
+        """Read the file or one of its precompressed variants, and compute the file's ETag."""
+        data = (self.variants[encoding] if encoding else self.path).read_bytes()
+        etag = self.etag
+        if etag is None:
+            original = self.path.read_bytes() if encoding else data
+            etag = hashlib.sha256(original).hexdigest()[:20]
+        return etag, data
+
+    def body(self, encoding: Optional[str]) -> bytes:
+        """The file's contents. This blocks if they are not cached, see :meth:`load`."""
+        data = cache.get(self, encoding)
+        if data is None:
+            self.etag, data = self.read(encoding)
+            cache.put(self, encoding, data)
+        return data
+
+    async def load(self, encoding: Optional[str]) -> bytes:
+        """Like :meth:`body`, but files are read in a thread."""
+        data = cache.get(self, encoding)
+        if data is None:
+            loop = asyncio.get_running_loop()
+            self.etag, data = await loop.run_in_executor(None, self.read, encoding)
+            cache.put(self, encoding, data)
+        return data
+
+
+class _Cache:
+    """File contents up to a total size, evicting the least recently used ones first."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries: collections.OrderedDict[tuple[_File, Optional[str]], bytes] = (
+            collections.OrderedDict()
+        )
+
+    def get(self, file: _File, encoding: Optional[str]) -> Optional[bytes]:
+        data = self.entries.get((file, encoding))
+        if data is not None:
+            self.entries.move_to_end((file, encoding))
+        return data
+
+    def put(self, file: _File, encoding: Optional[str], data: bytes) -> None:
+        if (old := self.entries.pop((file, encoding), None)) is not None:
+            self.size -= len(old)
+        if len(data) > self.max_size:
+            return
+        self.entries[(file, encoding)] = data
+        self.size += len(data)
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+cache = _Cache(CACHE_SIZE)
+
+
+class _FileResponse(web.Response):
+    """
+    A response for a file that is not cached. The file is read in a thread
+    when the response is sent, so that the event loop is not blocked.
+    """
+
+    def __init__(self, file: _File, encoding: Optional[str], headers: dict[str, str]):
+        super().__init__(content_type=file.content_type, headers=headers)
+        self.file = file
+        self.encoding = encoding
+
+    async def prepare(self, request: web.BaseRequest):
+        body = await self.file.load(self.encoding)
+        etag = self.file.etag_header(self.encoding)
+        self.headers["ETag"] = etag
+        if not_modified(request, etag, self.file.mtime):
+            self.set_status(304)
+        else:
+            if self.encoding:
+                self.headers["Content-Encoding"] = self.encoding
+            self.body = body
+        return await super().prepare(request)
+
+
+class StaticFiles:
+    """
+    An index of all files in one or more directories.
+    If a file exists in multiple directories, the first one takes precedence.
+
+    If `rescan_interval` is set, the index is refreshed on access if it is older than that,
+    which picks up file changes during development.
+    """
+
+    def __init__(
+        self, directories: Iterable[TPath], rescan_interval: Optional[float] = None
+    ):
+        self.directories = [Path(x).resolve() for x in directories]
+        self.rescan_interval = rescan_interval
+        self.files: dict[str, _File] = {}
+        self._scanned = 0.0
+        self.scan()
+
+    def scan(self) -> None:
+        """(Re-)build the index. Cached contents of unchanged files are kept."""
+        files: dict[str, _File] = {}
+        for directory in self.directories:
+            for root, _, filenames in os.walk(directory):
+                for name in filenames:
+                    path = Path(root, name)
+                    key = path.relative_to(directory).as_posix()
+                    if key not in files and (file := self._stat(directory, path)):
+                        files[key] = file
+        for key, file in files.items():
+            file.variants = {}
+            for encoding, ext in ENCODINGS.items():
+                sibling = files.get(key + ext)
+                # ignore stale precompressed files.
+                if sibling and sibling.mtime >= file.mtime:
+                    file.variants[encoding] = sibling.path
+        self.files = files
+        self._scanned = time.monotonic()
+
+    def _stat(self, directory: Path, path: Path) -> Optional[_File]:
+        """Get the index entry for a file, reusing the existing one if it has not changed."""
+        try:
+            resolved = path.resolve()
+            # guard against symlinks that point outside of the directory.
+            resolved.relative_to(directory)
+            stat = resolved.stat()
+        except (OSError, ValueError):
+            return None
+        if not resolved.is_file():
+            return None
+        old = self.files.get(path.relative_to(directory).as_posix())
+        if (
+            old
+            and old.path == resolved
+            and (old.size, old.mtime) == (stat.st_size, stat.st_mtime)
+        ):
+            return old
+        return _File(resolved, stat)
+
+    def lookup(self, insecure_path: str) -> Optional[_File]:
+        """
+        Find a file in the index. `insecure_path` must not contain `..` components.
+        Files that are missing from the index are looked up on disk and added to it.
+        """
+        if (
+            self.rescan_interval is not None
+            and time.monotonic() - self._scanned > self.rescan_interval
+        ):
+            self.scan()
+        file = self.files.get(insecure_path)
+        if file is None:
+            file = self._add(insecure_path)
+        return file
+
+    def _add(self, key: str) -> Optional[_File]:
+        for directory in self.directories:
+            if file := self._stat(directory, directory / key):
+                for encoding, ext in ENCODINGS.items():
+                    sibling = self._stat(directory, directory / (key + ext))
+                    if sibling and sibling.mtime >= file.mtime:
+                        file.variants[encoding] = sibling.path
+                self.files[key] = file
+                return file
+        return None
+
+    def serve(
+        self, insecure_path: str, request: Optional[web.Request] = None
+    ) -> web.StreamResponse:
+        path = insecure_path.lstrip("/") or "index.html"
+        filename = re.sub(r"[^a-zA-Z0-9_./-]", "", path)
+
+        if ".." in filename or "//" in filename or filename.startswith("/"):
+            return web.HTTPBadRequest()
+        file = self.lookup(filename)
+        if file is None:
+            return web.HTTPNotFound()
+        cache_control = (
+            "public, max-age=31536000, immutable"
+            if FINGERPRINTED.fullmatch(filename)
+            else "no-cache"
+        )
+        if file.size > MAX_CACHED_SIZE or (
+            request is not None and hdrs.RANGE in request.headers
+        ):
+            # FileResponse streams from disk and implements range requests.
+            return web.FileResponse(file.path, headers={"Cache-Control": cache_control})
+
+        encoding = None
+        if request is not None and file.variants:
+            accepted = request.headers.get("Accept-Encoding", "").lower()
+            encoding = next((e for e in file.variants if e in accepted), None)
+        headers = {
+            "Last-Modified": file.last_modified,
+            "Cache-Control": cache_control,
+        }
+        if file.variants:
+            headers["Vary"] = "Accept-Encoding"
+        if file.etag is None:
+            return _FileResponse(file, encoding, headers)
+        headers["ETag"] = etag = file.etag_header(encoding)
+        if request is not None and not_modified(request, etag, file.mtime):
+            return web.Response(status=304, headers=headers)
+        body = cache.get(file, encoding)
+        if body is None:
+            return _FileResponse(file, encoding, headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return web.Response(body=body, content_type=file.content_type, headers=headers)
+
+
+def not_modified(
+    request: web.BaseRequest, etag: str, mtime: Optional[float] = None
+) -> bool:
+    """Check if a conditional request can be answered with 304 Not Modified."""
+    if if_none_match := request.headers.get("If-None-Match"):
+        candidates = {x.strip().removeprefix("W/") for x in if_none_match.split(",")}
+        return "*" in candidates or etag in candidates
+    if mtime is not None and (since := request.if_modified_since):
+        return int(mtime) <= since.timestamp()
+    return False
+
+
+_indexes: dict[tuple[Path, ...], StaticFiles] = {}
+
+
+def get(directories: Iterable[TPath]) -> StaticFiles:
+    """
+    Get the (shared) index for a list of directories.
+    Building the index blocks, so indexes should be created with :func:`preload` on startup.
+    """
+    key = tuple(Path(x) for x in directories)
+    if key not in _indexes:
+        _indexes[key] = StaticFiles(
+            key, rescan_interval=1 if r8.settings.get("static_watch", False) else None
+        )
+    return _indexes[key]
+
+
+async def preload(directories: Iterable[Union[TPath, Iterable[TPath]]]) -> None:
+    """Build the indexes for multiple directories or lists of directories in threads."""
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(
+        *[
+            loop.run_in_executor(None, get, [d] if isinstance(d, (str, Path)) else d)
+            for d in directories
+        ]
+    )
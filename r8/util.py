@@ -10,6 +10,7 @@ import shutil
 import sqlite3
 import sys
 import textwrap
+import threading
 import traceback
 import warnings
 from collections.abc import Iterable
@@ -19,7 +20,6 @@ from typing import Optional
 from typing import TypeVar
 from typing import Union
 
-import argon2
 import blinker
 import click
 import itsdangerous
@@ -27,53 +27,31 @@ import texttable
 from aiohttp import web
 
 import r8
+from r8 import descriptions
+from r8 import passwords
 from r8 import scoring
+from r8 import state
+from r8 import staticfiles
 
 
 def get_team(user: str) -> Optional[str]:
     """Get a given user's team."""
-    with r8.db:
-        row = r8.db.execute(
-            """SELECT tid FROM teams WHERE uid = ?""", (user,)
-        ).fetchone()
-        if row:
-            return row[0]
-        return None
+    return state.get_solves().directory.get_team(user)
 
 
 def get_teams() -> list[str]:
     """Get a list of all teams"""
-    with r8.db:
-        return [
-            x[0] for x in r8.db.execute("SELECT DISTINCT tid FROM teams").fetchall()
-        ]
+    return state.get_solves().directory.get_teams()
 
 
 def get_users() -> list[str]:
-    """Get a list of all teams"""
-    with r8.db:
-        return [x[0] for x in r8.db.execute("SELECT uid FROM users").fetchall()]
+    """Get a list of all users"""
+    return state.get_solves().directory.get_users()
 
 
 def has_solved(user: str, challenge: str) -> bool:
     """Check if a user has solved a challenge."""
-    with r8.db:
-        return r8.db.execute(
-            """
-            SELECT COUNT(*)
-            FROM challenges
-            NATURAL JOIN flags
-            INNER JOIN submissions ON (
-                flags.fid = submissions.fid
-                AND (
-                    submissions.uid = ? OR
-                    team = 1 AND submissions.uid IN (SELECT uid FROM teams WHERE tid = (SELECT tid FROM teams WHERE uid = ?))
-                )
-            )
-            WHERE challenges.cid = ?
-        """,
-            (user, user, challenge),
-        ).fetchone()[0]
+    return state.get_solves().has_solved(user, challenge)
 
 
 def media(src: Optional[str], desc: str, visible: bool = True):
@@ -290,6 +268,54 @@ def get_ip(ip: THasIP) -> str:
     return ip
 
 
+class LogEntry:
+    """
+    Handle for a log entry created with :func:`log_entry`.
+
+    Log entries are written in the background. If the entry's data is updated
+    before it has been written, the update is merged into the original insert.
+    """
+
+    rowid: Optional[int]
+    """The entry's rowid, or `None` if it has not been written yet."""
+
+    def __init__(
+        self,
+        ip: str,
+        type: str,
+        data: Optional[str],
+        cid: Optional[str],
+        uid: Optional[str],
+    ):
+        self.ip = ip
+        self.type = type
+        self.data = data
+        self.cid = cid
+        self.uid = uid
+        self.rowid = None
+        self._lock = threading.Lock()
+
+    def _insert(self, conn: sqlite3.Connection) -> int:
+        with self._lock:
+            self.rowid = _insert_event(
+                conn, self.ip, self.type, self.data, self.cid, self.uid
+            )
+            return self.rowid
+
+    def _update(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "UPDATE events SET data = ? WHERE ROWID = ?", (self.data, self.rowid)
+        )
+
+    def update_data(self, data: str) -> None:
+        """Replace the entry's data, e.g. to append the outcome of a request."""
+        with self._lock:
+            self.data = data
+            if self.rowid is None:
+                return
+        r8.async_db.write_nowait(self._update)
+
+
 def log(
     ip: THasIP,
     type: str,
@@ -299,7 +325,7 @@ def log(
     uid: Optional[str] = None,
 ) -> int:
     """
-    Create a log entry.
+    Create a log entry and return its rowid.
 
     Args:
         ip: IP address which caused this log entry to be created.
@@ -307,15 +333,56 @@ def log(
         data: Additional event data, for example the actually submitted value.
         cid: Challenge this log entry relates to.
         uid: User this log entry relates to.
+
+    This blocks until the entry has been written,
+    see :func:`log_entry` for a non-blocking alternative.
     """
-    ip = get_ip(ip)
+    entry = _make_entry(ip, type, data, cid, uid)
+    return r8.async_db.write_nowait(entry._insert).result()
+
+
+def log_entry(
+    ip: THasIP,
+    type: str,
+    data: Optional[str] = None,
+    *,
+    cid: Optional[str] = None,
+    uid: Optional[str] = None,
+) -> LogEntry:
+    """
+    Like :func:`r8.log`, but returns a :class:`LogEntry` handle instead of the rowid.
+
+    When called from the event loop, the entry is queued and written in the background.
+    """
+    entry = _make_entry(ip, type, data, cid, uid)
+    r8.async_db.write_nowait(entry._insert)
+    return entry
+
+
+def _make_entry(
+    ip: THasIP,
+    type: str,
+    data: Optional[str],
+    cid: Optional[str],
+    uid: Optional[str],
+) -> LogEntry:
     if data:
         data = data[:1024]
-    with r8.db:
-        return r8.db.execute(
-            "INSERT INTO events (ip, type, data, cid, uid) VALUES (?, ?, ?, ?, ?)",
-            (ip, type, data, cid, uid),
-        ).lastrowid
+    return LogEntry(get_ip(ip), type, data, cid, uid)
+
+
+def _insert_event(
+    conn: sqlite3.Connection,
+    ip: str,
+    type: str,
+    data: Optional[str],
+    cid: Optional[str],
+    uid: Optional[str],
+) -> int:
+    return conn.execute(
+        "INSERT INTO events (ip, type, data, cid, uid) VALUES (?, ?, ?, ?, ?)",
+        (ip, type, data, cid, uid),
+    ).lastrowid
 
 
 def create_flag(challenge: str, max_submissions: int = 1, flag: str = None) -> str:
@@ -330,11 +397,15 @@ def create_flag(challenge: str, max_submissions: int = 1, flag: str = None) -> s
     """
     if flag is None:
         flag = "__flag__{" + secrets.token_hex(16) + "}"
-    with r8.db:
-        r8.db.execute(
+    r8.async_db.write_nowait(
+        lambda conn: state.solves.execute(
+            conn,
             "INSERT OR REPLACE INTO flags (fid, cid, max_submissions) VALUES (?,?,?)",
             (flag, challenge, max_submissions),
         )
+    )
+    if state.solves.loaded:
+        state.solves.add_flag(flag, challenge, max_submissions)
     return flag
 
 
@@ -379,6 +450,7 @@ def with_database(echo=False):
             if echo:
                 r8.echo("r8", f"Loading database ({database})...")
             r8.db = sqlite3_connect(database)
+            r8.async_db = r8.database.Database(database)
             with r8.db:
                 r8.settings = {}
                 for k, v in r8.db.execute("SELECT key, value FROM settings").fetchall():
@@ -390,7 +462,10 @@ def with_database(echo=False):
                         )
                         continue
                     r8.settings[k] = val
-            return f(**kwds)
+            try:
+                return f(**kwds)
+            finally:
+                r8.async_db.close()
 
         return wrapper
 
@@ -435,9 +510,7 @@ def sqlite3_connect(filename):
     """
     Wrapper around sqlite3.connect that enables convenience features.
     """
-    db = sqlite3.connect(filename, 10)
-    db.execute("PRAGMA foreign_keys = ON")
-    return db
+    return r8.database.configure(sqlite3.connect(filename, 10))
 
 
 def run_sql(query: str, parameters=None, *, rows: int = 10) -> None:
@@ -465,11 +538,11 @@ def run_sql(query: str, parameters=None, *, rows: int = 10) -> None:
         print("Statement did not return data.")
 
 
-ph = argon2.PasswordHasher()
+ph = passwords.ph
 
 
 def hash_password(s: str) -> str:
-    return ph.hash(s)
+    return passwords.hash_password(s)
 
 
 def verify_hash(hash: str, password: str) -> bool:
@@ -497,221 +570,251 @@ def correct_flag(flag: str) -> str:
 
 
 on_submit = blinker.Signal()
+"""
+Sent after a flag has been accepted, with `user`, `cid`,
+and `submission` (the rowid of the new row in the submissions table).
+"""
 
 
 def submit_flag(flag: str, user: str, ip: THasIP, force: bool = False) -> str:
     """
+    Synchronous variant of :func:`submit_flag_async`,
+    which blocks until the submission has been committed.
+    Coroutines should use :func:`submit_flag_async` instead.
+
     Returns:
         the challenge id
     Raises:
         ValueError, if there is an input error.
     """
-    with r8.db:
-        user_exists = r8.db.execute(
-            """
-          SELECT 1 FROM users
-          WHERE uid = ?
-        """,
-            (user,),
-        ).fetchone()
-        if not user_exists:
-            r8.log(ip, "flag-err-unknown", flag)
-            raise ValueError("Unknown user.")
-
-        flag, cid = r8.db.execute(
-            """
-          SELECT fid, cid FROM flags
-          NATURAL INNER JOIN challenges
-          WHERE fid = ? OR fid = ?
-        """,
-            (flag, correct_flag(flag)),
-        ).fetchone() or [flag, None]
-        if not cid:
-            r8.log(ip, "flag-err-unknown", flag, uid=user)
-            raise ValueError("Unknown Flag ¯\\_(ツ)_/¯")
-
-        is_active = r8.db.execute(
-            """
-          SELECT 1 FROM challenges
-          WHERE cid = ? 
-          AND datetime('now') BETWEEN t_start AND t_stop
-        """,
-            (cid,),
-        ).fetchone()
-        if not is_active and not force:
-            r8.log(ip, "flag-err-inactive", flag, uid=user, cid=cid)
-            raise ValueError("Challenge is not active.")
-
-        is_already_submitted = r8.db.execute(
-            """
-          SELECT COUNT(*) FROM submissions 
-          NATURAL INNER JOIN flags
-          NATURAL INNER JOIN challenges
-          WHERE cid = ? AND (
-          uid = ? OR
-          challenges.team = 1 AND submissions.uid IN (SELECT uid FROM teams WHERE tid = (SELECT tid FROM teams WHERE uid = ?))
-          )
-        """,
-            (cid, user, user),
-        ).fetchone()[0]
-        if is_already_submitted:
-            r8.log(ip, "flag-err-solved", flag, uid=user, cid=cid)
-            raise ValueError("Challenge already solved.")
-
-        is_oversubscribed = r8.db.execute(
-            """
-          SELECT 1 FROM flags
-          WHERE fid = ?
-          AND (SELECT COUNT(*) FROM submissions WHERE flags.fid = submissions.fid) >= max_submissions
-        """,
-            (flag,),
-        ).fetchone()
-        if is_oversubscribed and not force:
-            r8.log(ip, "flag-err-used", flag, uid=user, cid=cid)
-            raise ValueError("Flag already used too often.")
-
-        r8.log(ip, "flag-submit", flag, uid=user, cid=cid)
-        r8.db.execute(
-            """
-          INSERT INTO submissions (uid, fid) VALUES (?, ?)
-        """,
-            (user, flag),
+    ip = get_ip(ip)
+    index = state.get_solves()
+    while True:
+        submission = _Submission(index, flag, user, ip, force)
+        recorded = False
+        try:
+            recorded = r8.async_db.write_blocking(submission.record)
+        finally:
+            if not recorded:
+                submission.discard()
+        if recorded:
+            return submission.result()
+        # The database has been modified by someone else, refresh and try again.
+        index.reload_blocking()
+
+
+async def submit_flag_async(
+    flag: str, user: str, ip: THasIP, force: bool = False
+) -> str:
+    """
+    Returns:
+        the challenge id
+    Raises:
+        ValueError, if there is an input error.
+    """
+    ip = get_ip(ip)
+    index = state.solves
+    if not index.loaded:
+        await index.reload()
+    while True:
+        submission = _Submission(index, flag, user, ip, force)
+        recorded = False
+        try:
+            recorded = await r8.async_db.write(submission.record)
+        finally:
+            if not recorded:
+                submission.discard()
+        if recorded:
+            return submission.result()
+        # The database has been modified by someone else, refresh and try again.
+        await index.reload()
+
+
+class _Submission:
+    """A submission attempt that has been checked against the solve index."""
+
+    def __init__(
+        self, index: state.SolveIndex, flag: str, user: str, ip: str, force: bool
+    ):
+        self.index = index
+        self.user = user
+        self.data_version = index.data_version
+        type, self.fid, self.cid, self.err = _check_submission(index, flag, user, force)
+        if not self.err:
+            # Record the submission right away so that concurrent submissions observe it.
+            self.timestamp = index.add_submission(user, self.fid)
+        self.event = (
+            ip,
+            type,
+            self.fid,
+            self.cid,
+            user if user in index.directory.users else None,
         )
-        on_submit.send(user=user, cid=cid)
-    return cid
 
-
-async def get_challenges(user: str):
-    """Get challenges to display for a specific user"""
-    with r8.db:
-        cursor = r8.db.execute(
-            """
-            WITH solves AS (
-                SELECT cid, COUNT(*) AS solves
-                FROM submissions
-                NATURAL JOIN flags
-                GROUP BY cid
-            ),
-            solve_time AS (
-                SELECT cid, MAX(timestamp) AS solve_time
-                FROM submissions
-                NATURAL JOIN flags
-                NATURAL JOIN challenges
-                WHERE (
-                    uid = ? OR
-                    team = 1 AND submissions.uid IN (SELECT uid FROM teams WHERE tid = (SELECT tid FROM teams WHERE uid = ?))
-                )
-                GROUP BY cid
-            ),
-            -- this should really be done with a window function (row_number() OVER (PARTITION BY cid ORDER BY timestamp)),
-            -- but that only works in SQLite 3.25, which will only be available in Ubuntu 20.04+.
-            solve_rank AS (
-                SELECT cid, COUNT(*) AS solve_rank
-                FROM submissions
-                NATURAL JOIN flags
-                NATURAL JOIN solve_time
-                WHERE timestamp <= solve_time
-                GROUP BY cid
-            )
-            SELECT
-                cid,
-                CAST(strftime('%s',t_start) AS INTEGER) AS start,
-                CAST(strftime('%s',t_stop) AS INTEGER) AS stop,
-                CAST(strftime('%s',solve_time) AS INTEGER) AS solve_time,
-                solve_rank,
-                IFNULL(solves, 0) as solves,
-                team
-            FROM challenges
-            NATURAL LEFT JOIN solve_time
-            NATURAL LEFT JOIN solve_rank
-            NATURAL LEFT JOIN solves
-            WHERE t_start < datetime('now')  -- hide not yet active challenges
-        """,
-            (user, user),
+    def record(self, conn: sqlite3.Connection) -> bool:
+        self.rowid = _record_submission(
+            conn, self.data_version, *self.event, accept=not self.err
         )
-        column_names = tuple(x[0] for x in cursor.description)
-        results = [
-            {key: value for key, value in zip(column_names, row)}
-            for row in cursor.fetchall()
-        ]
-    for challenge in results:
-        challenge["team"] = bool(challenge["team"])
+        return self.rowid is not None
 
-        try:
-            inst: r8.Challenge = r8.challenges[challenge["cid"]]
-            challenge["title"] = str(inst.title)
-        except Exception:
-            challenge["title"] = challenge["cid"]
-            challenge["visible"] = True
-            challenge["tags"] = []
-            challenge["description"] = (
-                f"<pre>{html.escape(traceback.format_exc())}</pre>"
-            )
-            continue
+    def discard(self) -> None:
+        """Undo adding the submission to the index if it could not be recorded."""
+        if not self.err and self.index.data_version == self.data_version:
+            self.index.remove_submission(self.user, self.fid, self.timestamp)
 
-        try:
-            challenge["visible"] = challenge["solve_time"] or await inst.visible(user)
-            if not challenge["visible"]:
-                continue
-        except Exception:
-            challenge["visible"] = True
-            challenge["tags"] = []
-            challenge["description"] = (
-                f"<pre>{html.escape(traceback.format_exc())}</pre>"
-            )
-            continue
+    def result(self) -> str:
+        if self.err:
+            raise ValueError(self.err)
+        on_submit.send(user=self.user, cid=self.cid, submission=self.rowid)
+        return self.cid
 
-        try:
-            challenge["tags"] = [str(x) for x in inst.tags]
-        except Exception:
-            challenge["tags"] = []
-            challenge["description"] = (
-                f"<pre>{html.escape(traceback.format_exc())}</pre>"
-            )
-            continue
 
-        try:
-            challenge["description"] = await inst.description(
-                user, bool(challenge["solve_time"])
-            )
-        except Exception:
-            challenge["description"] = (
-                f"<pre>{html.escape(traceback.format_exc())}</pre>"
-            )
+def _check_submission(
+    index: state.SolveIndex, flag: str, user: str, force: bool
+) -> tuple[str, str, Optional[str], Optional[str]]:
+    """
+    Returns:
+        A `(event type, flag, cid, error)` tuple.
+    """
+    if user not in index.directory.users:
+        return "flag-err-unknown", flag, None, "Unknown user."
+
+    for fid in (flag, correct_flag(flag)):
+        if fid in index.flags:
+            break
+    else:
+        return "flag-err-unknown", flag, None, "Unknown Flag ¯\\_(ツ)_/¯"
+    cid, max_submissions = index.flags[fid]
+
+    if not index.is_active(cid) and not force:
+        return "flag-err-inactive", fid, cid, "Challenge is not active."
+
+    if index.has_solved(user, cid):
+        return "flag-err-solved", fid, cid, "Challenge already solved."
 
-        challenge["points"] = scoring.challenge_points(inst, challenge["solves"])
+    if index.flag_submissions[fid] >= max_submissions and not force:
+        return "flag-err-used", fid, cid, "Flag already used too often."
 
-        if challenge["solve_rank"]:
-            challenge["first_solve_bonus"] = scoring.first_solve_bonus(
-                inst, challenge["solve_rank"] - 1
+    return "flag-submit", fid, cid, None
+
+
+def _record_submission(
+    conn: sqlite3.Connection,
+    data_version: int,
+    ip: str,
+    type: str,
+    fid: str,
+    cid: Optional[str],
+    uid: Optional[str],
+    accept: bool,
+) -> Optional[int]:
+    """
+    Log a submission attempt and insert the submission if it was accepted.
+
+    Returns:
+        The rowid of the submission (0 if it has not been accepted),
+        or `None` if the database has been modified by another connection since
+        the submission has been checked against the solve index.
+    """
+    index = state.solves
+    if index.data_version != data_version or not index.is_current(conn):
+        return None
+    _insert_event(conn, ip, type, fid[:1024], cid, uid)
+    if accept:
+        return index.execute(
+            conn, "INSERT INTO submissions (uid, fid) VALUES (?, ?)", (uid, fid)
+        ).lastrowid
+    return 0
+
+
+async def get_challenges(user: str, description_hashes: bool = False):
+    """
+    Get challenges to display for a specific user.
+
+    If `description_hashes` is set, descriptions are replaced with a `description_hash`
+    that can be resolved with :data:`r8.descriptions.store`.
+    """
+    index = state.solves
+    if not index.loaded:
+        await index.reload()
+    results = []
+    for info in index.challenge_list():
+        challenge = dict(info)
+        challenge["solve_time"] = index.solve_time(user, challenge["cid"])
+        if challenge["solve_time"]:
+            challenge["solve_rank"] = index.solve_rank(
+                challenge["cid"], challenge["solve_time"]
             )
         else:
-            challenge["first_solve_bonus"] = scoring.first_solve_bonus(
-                inst, challenge["solves"]
+            challenge["solve_rank"] = None
+        results.append(challenge)
+    await asyncio.gather(*[_render_challenge(user, c) for c in results])
+    results = [x for x in results if x["visible"]]
+    if description_hashes:
+        for challenge in results:
+            challenge["description_hash"] = descriptions.store.put(
+                challenge.pop("description", "")
             )
+    return results
 
-    return [x for x in results if x["visible"]]
+
+async def get_challenges_etag(user: str) -> Optional[str]:
+    """
+    Get an ETag for the result of :func:`get_challenges` without computing it,
+    or `None` if the `challenge_list_max_age` setting is 0.
+    """
+    max_age = r8.settings.get("challenge_list_max_age", 60)
+    if not max_age:
+        return None
+    index = state.solves
+    if not index.loaded:
+        await index.reload()
+    return f'"{index.challenge_list_version(user, max_age)}"'
+
+
+async def _render_challenge(user: str, challenge: dict) -> None:
+    """Determine visibility and render the description for a challenge in :func:`get_challenges`."""
+    if "description" in challenge:
+        # error while computing the global challenge info.
+        challenge["visible"] = True
+        return
+
+    inst: r8.Challenge = r8.challenges[challenge["cid"]]
+    timeout = r8.settings.get("description_timeout", 5)
+    try:
+        challenge["visible"] = challenge["solve_time"] or await asyncio.wait_for(
+            inst.visible(user), timeout
+        )
+        if not challenge["visible"]:
+            return
+    except Exception:
+        challenge["visible"] = True
+        challenge["tags"] = []
+        challenge["description"] = f"<pre>{html.escape(traceback.format_exc())}</pre>"
+        return
+
+    try:
+        challenge["description"] = await asyncio.wait_for(
+            inst.cached_description(user, bool(challenge["solve_time"])), timeout
+        )
+    except Exception:
+        challenge["description"] = f"<pre>{html.escape(traceback.format_exc())}</pre>"
+
+    if challenge["solve_rank"]:
+        challenge["first_solve_bonus"] = scoring.first_solve_bonus(
+            inst, challenge["solve_rank"] - 1
+        )
 
 
 def serve_static(
-    static_dir: Union[str, Path, Iterable[Union[Path, str]]], insecure_path: str
+    static_dir: Union[str, Path, Iterable[Union[Path, str]]],
+    insecure_path: str,
+    request: Optional[web.Request] = None,
 ) -> web.StreamResponse:
+    """
+    Serve a file from one or more static directories, see :mod:`r8.staticfiles`.
+    If `request` is passed, conditional and precompressed responses are supported.
+    """
     if isinstance(static_dir, (Path, str)):
         static_dir = [static_dir]
-    search_paths: list[Path] = [Path(x).resolve() for x in static_dir]
-
-    path = insecure_path.lstrip("/") or "index.html"
-    filename = re.sub(r"[^a-zA-Z0-9_./-]", "", path)
-
-    if ".." in filename or "//" in filename or filename.startswith("/"):
-        return web.HTTPBadRequest()
-    for sp in search_paths:
-        filepath = (sp / filename).resolve()
-        try:
-            # guard against directory traversal: this raises if filepath is not a subpath of sp.
-            filepath.relative_to(sp)
-        except ValueError:
-            return web.HTTPBadRequest()
-        if filepath.is_file():
-            return web.FileResponse(filepath)
-    return web.HTTPNotFound()
+    return staticfiles.get(static_dir).serve(insecure_path, request)
@@ -0,0 +1,17 @@
+import sqlite3
+
+import r8
+from r8 import migrations
+from r8.rest_api import auth
+from r8.state import SolveIndex
+
+
+def test_register_conflict(monkeypatch):
+    monkeypatch.setattr(r8.state, "solves", SolveIndex())
+    conn = sqlite3.connect(":memory:")
+    migrations.migrate(conn)
+    assert auth._register(conn, "alice", "", "A") is None
+    # e.g. a concurrent registration that has passed the initial check as well.
+    assert auth._register(conn, "alice", "", "B") == "username exists"
+    assert auth._register(conn, "bob", "", "A") == "team exists"
+    assert conn.execute("SELECT uid, tid FROM teams").fetchall() == [("alice", "A")]
@@ -0,0 +1,64 @@
+import asyncio
+
+from r8.broadcast import BroadcastHub
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent = []
+        self.closed = None
+
+    async def send_str(self, data: str) -> None:
+        await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def close(self, code: int, message: bytes) -> None:
+        self.closed = code
+
+
+def test_broadcast():
+    async def main():
+        hub = BroadcastHub(queue_size=2, send_timeout=0.1)
+        fast = FakeWebSocket()
+        slow = FakeWebSocket(delay=0.05)
+        stuck = FakeWebSocket(delay=10)
+        for ws in (fast, slow, stuck):
+            hub.subscribe(ws)
+
+        for i in range(5):
+            hub.publish({"i": i})
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.3)
+
+        assert fast.sent == [f'{{"i": {i}}}' for i in range(5)]
+        # the slow client skips intermediate updates, but receives the latest one.
+        assert len(slow.sent) < 5
+        assert slow.sent[-1] == '{"i": 4}'
+        assert hub.coalesced > 0
+        assert stuck.closed and hub.dropped == 1
+        assert hub.stats()["latency_max"] >= 0.05
+
+        for ws in (fast, slow, stuck):
+            hub.unsubscribe(ws)
+        assert hub.stats()["connections"] == 0
+
+    asyncio.run(main())
+
+
+def test_broadcast_snapshot():
+    async def main():
+        state = {"seq": 0}
+        hub = BroadcastHub(queue_size=1, snapshot=lambda: f"snapshot {state['seq']}")
+        ws = FakeWebSocket(delay=0.05)
+        hub.subscribe(ws)
+        await asyncio.sleep(0.01)
+        for i in range(1, 4):
+            state["seq"] = i
+            hub.publish_str(f"delta {i}")
+        await asyncio.sleep(0.3)
+        # instead of dropping deltas, a lagging client gets the current state.
+        assert ws.sent == ["snapshot 0", "snapshot 3"]
+        hub.unsubscribe(ws)
+
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+import asyncio
+
+import r8
+
+
+class Counter(r8.Challenge):
+    title = "Counter"
+    description_cache_ttl = 60
+
+    def __init__(self, cid):
+        super().__init__(cid)
+        self.calls = 0
+
+    async def description(self, user: str, solved: bool) -> str:
+        self.calls += 1
+        return f"{user} {solved} {self.calls}"
+
+    def description_cache_key(self, user: str, solved: bool):
+        return solved
+
+
+def test_cached_description():
+    inst = Counter("Counter")
+
+    async def main():
+        assert await inst.cached_description("alice", False) == "alice False 1"
+        assert await inst.cached_description("bob", False) == "alice False 1"
+        assert await inst.cached_description("bob", True) == "bob True 2"
+        inst.description_cache_ttl = None
+        assert await inst.cached_description("bob", True) == "bob True 3"
+
+    asyncio.run(main())
@@ -61,6 +61,7 @@ def test_settings(r8cli):
 def test_sql(r8cli):
     r8cli("sql stmt --no-backup SELECT 1")
     r8cli("sql tables")
+    assert "up to date" in r8cli("sql migrate --no-backup").output
 
 
 def test_users(r8cli):
@@ -0,0 +1,45 @@
+import asyncio
+import gzip
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from r8 import compression
+
+
+def test_compression():
+    body = b"x" * 2000
+    compress = compression.middleware()
+
+    async def handler(request):
+        return web.Response(
+            body=body, content_type="text/html", headers={"ETag": '"a"'}
+        )
+
+    async def small(request):
+        return web.Response(text="x", content_type="text/html")
+
+    async def precompressed(request):
+        return web.Response(
+            body=gzip.compress(body),
+            content_type="text/html",
+            headers={"Content-Encoding": "gzip"},
+        )
+
+    def get(handler, **headers):
+        req = make_mocked_request("GET", "/", headers=headers)
+        return asyncio.run(compress(req, handler))
+
+    resp = get(handler, **{"Accept-Encoding": "gzip, deflate"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(resp.body) == body
+    assert resp.headers["ETag"] == 'W/"a"'
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert get(handler, **{"Accept-Encoding": "gzip"}).body == resp.body
+
+    resp = get(handler, **{"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in resp.headers
+    assert resp.headers["ETag"] == '"a"'
+    assert "Content-Encoding" not in get(small, **{"Accept-Encoding": "gzip"}).headers
+    resp = get(precompressed, **{"Accept-Encoding": "gzip"})
+    assert gzip.decompress(resp.body) == body
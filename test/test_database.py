@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import r8
+from r8.database import Database
+
+
+def test_database(tmp_path):
+    db = Database(str(tmp_path / "test.db"), readers=2)
+
+    async def main():
+        await db.write(lambda conn: conn.execute("CREATE TABLE t (x INTEGER)"))
+        assert await db.execute("INSERT INTO t (x) VALUES (?)", (1,)) == 1
+        # background writes are ordered before subsequent reads.
+        db.write_nowait(lambda conn: conn.execute("INSERT INTO t (x) VALUES (2)"))
+        await db.write(lambda conn: None)
+        assert await db.fetchall("SELECT x FROM t ORDER BY x") == [(1,), (2,)]
+        assert await db.fetchone("SELECT COUNT(*) FROM t") == (2,)
+        assert await db.fetchone("PRAGMA journal_mode") == ("wal",)
+
+    try:
+        asyncio.run(main())
+    finally:
+        db.close()
+
+
+def test_database_readonly(tmp_path):
+    db = Database(str(tmp_path / "test.db"), readers=1)
+
+    async def main():
+        await db.execute("CREATE TABLE t (x INTEGER)")
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            await db.read(lambda conn: conn.execute("INSERT INTO t VALUES (1)"))
+
+    try:
+        asyncio.run(main())
+    finally:
+        db.close()
+
+
+def test_group_commit(tmp_path):
+    db = Database(str(tmp_path / "test.db"), batch_delay=0.05)
+
+    def fail(conn):
+        conn.execute("INSERT INTO t (x) VALUES (2)")
+        raise ValueError("job failed")
+
+    async def main():
+        await db.execute("CREATE TABLE t (x INTEGER)")
+        ok1 = db.write(lambda conn: conn.execute("INSERT INTO t (x) VALUES (1)"))
+        err = db.write(fail)
+        ok2 = db.write(lambda conn: conn.execute("INSERT INTO t (x) VALUES (3)"))
+        results = await asyncio.gather(ok1, err, ok2, return_exceptions=True)
+        assert isinstance(results[1], ValueError)
+        assert await db.fetchall("SELECT x FROM t ORDER BY x") == [(1,), (3,)]
+
+    try:
+        asyncio.run(main())
+    finally:
+        db.close()
+
+
+def test_log_entry(tmp_path, monkeypatch):
+    db = Database(str(tmp_path / "test.db"), batch_delay=0.05)
+    monkeypatch.setattr(r8, "async_db", db, raising=False)
+
+    async def main():
+        await db.execute(
+            "CREATE TABLE events (time, ip TEXT, type TEXT, data TEXT, cid TEXT, uid TEXT)"
+        )
+        merged = r8.util.log_entry("127.0.0.1", "test", "request")
+        merged.update_data("request -> 200 OK")
+        await db.flush()
+        assert merged.rowid is not None
+        late = r8.util.log_entry("127.0.0.1", "test", "request")
+        await db.flush()
+        late.update_data("request -> 500")
+        await db.flush()
+        # r8.log() waits for the entry to be written.
+        assert r8.log("127.0.0.1", "test", "done") == 3
+        assert await db.fetchall("SELECT data FROM events ORDER BY rowid") == [
+            ("request -> 200 OK",),
+            ("request -> 500",),
+            ("done",),
+        ]
+
+    try:
+        asyncio.run(main())
+    finally:
+        db.close()
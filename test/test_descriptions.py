@@ -0,0 +1,15 @@
+from r8.descriptions import DescriptionStore
+
+
+def test_description_store(monkeypatch):
+    monkeypatch.setattr("r8.settings", {"description_store_size": 10})
+    store = DescriptionStore()
+    a = store.put("aaaa")
+    assert a == store.put("aaaa")
+    b = store.put("bbbb")
+    assert a != b
+    assert store.get_many([a, b, "nope"]) == {a: "aaaa", b: "bbbb"}
+
+    store.put("aaaa")  # mark a as recently used
+    c = store.put("cccc")
+    assert store.get_many([a, b, c]) == {a: "aaaa", c: "cccc"}
@@ -0,0 +1,485 @@
+import asyncio
+import struct
+import types
+
+import pytest
+from aiohttp import web
+
+from r8.challenge_mixins import docker_backends
+from r8.challenge_mixins.docker import DockerChallenge
+from r8.challenge_mixins.docker import DockerError
+from r8.challenge_mixins.docker_scheduler import AdaptiveLimit
+from r8.challenge_mixins.docker_scheduler import DockerBusy
+from r8.challenge_mixins.docker_scheduler import Scheduler
+
+
+class FakeBackend(docker_backends.DockerBackend):
+    def __init__(self):
+        self.commands = []
+
+    async def image_labels(self, tag):
+        return {}
+
+    async def pull(self, tag):
+        pass
+
+    async def build(self, tag, context, labels=None):
+        pass
+
+    async def tag(self, source, target):
+        pass
+
+    async def run(self, name, image, args, cmd, *, detach=False, entrypoint=None):
+        self.commands.append(("run", name, detach, entrypoint, *cmd))
+        return b"output\n"
+
+    async def exec(self, name, cmd):
+        self.commands.append(("exec", name, *cmd))
+        if cmd[0] == "hang":
+            await asyncio.sleep(10)
+        return b"output\n"
+
+    async def kill(self, name):
+        self.commands.append(("kill", name))
+
+    async def remove(self, name):
+        self.commands.append(("remove", name))
+
+
+class Pooled(DockerChallenge):
+    docker_tag = "r8:test"
+    docker_pool_size = 2
+    timeout = 0.5
+
+    def __init__(self, cid):
+        super().__init__(cid)
+        self.docker = FakeBackend()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_pool():
+    async def main():
+        inst = Pooled("Pooled")
+        commands = inst.docker.commands
+        inst.docker_started = True
+        inst.docker_pool.refill()
+        await _settle()
+        assert len(inst.docker_pool.idle) == 2
+        started = [c for c in commands if c[0] == "run"]
+        assert len(started) == 2
+        assert started[0][2:] == (True, "sleep", "infinity")
+
+        name, _ = inst.docker_pool.idle[0]
+        commands.clear()
+        assert await inst.docker_run_unlimited("echo", "hi") == "output"
+        await _settle()
+        assert ("exec", name, "echo", "hi") in commands
+        assert ("remove", name) in commands
+        assert len(inst.docker_pool.idle) == 2
+
+        # timeouts kill the container and refill the pool.
+        name, _ = inst.docker_pool.idle[0]
+        with pytest.raises(DockerError, match="timed out"):
+            await inst.docker_run_unlimited("hang")
+        await _settle()
+        assert ("kill", name) in commands
+        assert name not in [n for n, _ in inst.docker_pool.idle]
+        assert len(inst.docker_pool.idle) == 2
+
+        # old containers are not used anymore.
+        inst.docker_pool.max_age = 0
+        commands.clear()
+        await inst.docker_run_unlimited("echo")
+        assert not any(c[0] == "exec" for c in commands)
+        assert any(c[0] == "run" and c[-1] == "echo" for c in commands)
+
+        await inst.docker_pool.close()
+        assert not inst.docker_pool.idle
+
+    asyncio.run(main())
+
+
+def test_pool_close_and_expiry():
+    class Slow(FakeBackend):
+        async def run(self, name, *args, **kwargs):
+            await asyncio.sleep(0.05)
+            return await super().run(name, *args, **kwargs)
+
+    async def main():
+        inst = Pooled("Pooled")
+        inst.docker = Slow()
+        inst.docker_pool.refill()
+        await _settle()
+        # containers that are still starting are removed as well.
+        await inst.docker_pool.close()
+        started = {c[1] for c in inst.docker.commands if c[0] == "run"}
+        removed = {c[1] for c in inst.docker.commands if c[0] == "remove"}
+        assert len(started) == 2
+        assert started == removed
+        assert not inst.docker_pool.containers
+
+        # idle containers are replaced once they are too old, even without traffic.
+        inst = Pooled("Pooled")
+        inst.docker_pool.max_age = 0.01
+        inst.docker_pool.refill()
+        await _settle()
+        first = {name for name, _ in inst.docker_pool.idle}
+        await asyncio.sleep(1.1)
+        await _settle()
+        assert ("remove", next(iter(first))) in inst.docker.commands
+        assert not first & {name for name, _ in inst.docker_pool.idle}
+        await inst.docker_pool.close()
+
+    asyncio.run(main())
+
+
+def test_pool_start_failure():
+    class Broken(FakeBackend):
+        async def run(self, *args, **kwargs):
+            self.commands.append(("run",))
+            raise DockerError("no such image")
+
+    async def main():
+        inst = Pooled("Pooled")
+        inst.docker = Broken()
+        inst.docker_pool.refill()
+        await _settle()
+        assert not inst.docker_pool.idle
+        assert inst.docker_pool.starting == 0
+        # back off instead of retrying immediately.
+        inst.docker.commands.clear()
+        inst.docker_pool.refill()
+        assert not inst.docker.commands
+
+    asyncio.run(main())
+
+
+class FakeBuilder(FakeBackend):
+    def __init__(self):
+        super().__init__()
+        self.images = {}
+
+    async def image_labels(self, tag):
+        return self.images.get(tag)
+
+    async def build(self, tag, context, labels=None):
+        self.commands.append(("build", tag))
+        await asyncio.sleep(0.01)
+        self.images[tag] = labels
+
+    async def tag(self, source, target):
+        self.commands.append(("tag", source, target))
+        self.images[target] = self.images[source]
+
+
+def test_build_cache(tmp_path, monkeypatch):
+    (tmp_path / "Dockerfile").write_text("FROM scratch")
+    backend = FakeBuilder()
+
+    async def acquire():
+        return backend
+
+    monkeypatch.setattr(docker_backends, "acquire", acquire)
+
+    class Built(DockerChallenge):
+        dockerfile = tmp_path
+
+    async def start(*cids):
+        backend.commands.clear()
+        await asyncio.gather(*[Built(cid).start() for cid in cids])
+        return sorted(backend.commands)
+
+    async def main():
+        # instances with the same build context share a build.
+        assert await start("Built(1)", "Built(2)") in (
+            [("build", "r8:Built_1_"), ("tag", "r8:Built_1_", "r8:Built_2_")],
+            [("build", "r8:Built_2_"), ("tag", "r8:Built_2_", "r8:Built_1_")],
+        )
+        # unchanged images are not rebuilt.
+        assert await start("Built(1)", "Built(2)") == []
+        (tmp_path / "Dockerfile").write_text("FROM scratch\n")
+        assert await start("Built(1)") == [("build", "r8:Built_1_")]
+        assert not DockerChallenge.builds
+
+    asyncio.run(main())
+
+
+def test_backend_interface():
+    class Incomplete(docker_backends.DockerBackend):
+        async def run(self, *args, **kwargs):
+            return b""
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_container_config():
+    config = docker_backends.container_config(DockerChallenge.docker_args)
+    assert config["User"] == "nobody"
+    assert config["HostConfig"]["NetworkMode"] == "none"
+    assert config["HostConfig"]["Memory"] == 512 * 1024 * 1024
+    assert config["HostConfig"]["CapDrop"] == ["all"]
+    assert docker_backends.container_config(["--read-only", "--cpus=1.5"]) == {
+        "HostConfig": {"ReadonlyRootfs": True, "NanoCpus": 1_500_000_000}
+    }
+    with pytest.raises(ValueError):
+        docker_backends.container_config(["--privileged"])
+
+
+def _multiplexed(stdout: bytes, stderr: bytes) -> bytes:
+    return b"".join(
+        struct.pack(">BxxxL", stream, len(data)) + data
+        for stream, data in ((1, stdout), (2, stderr))
+        if data
+    )
+
+
+def fake_engine(containers: dict) -> web.Application:
+    """A minimal Docker Engine API server."""
+    routes = web.RouteTableDef()
+    prefix = f"/{docker_backends.API_VERSION}"
+
+    def no_such_container(name):
+        return web.json_response({"message": f"No such container: {name}"}, status=404)
+
+    @routes.get(prefix + "/_ping")
+    async def ping(request):
+        return web.Response(text="OK")
+
+    @routes.get(prefix + "/images/{name:.+}/json")
+    async def inspect_image(request):
+        if request.match_info["name"] == "r8:test":
+            return web.json_response({"Id": "sha256:1234", "Config": {"Labels": None}})
+        return web.json_response({"message": "No such image: x"}, status=404)
+
+    @routes.post(prefix + "/containers/create")
+    async def create(request):
+        config = await request.json()
+        containers[request.query["name"]] = {"config": config, "running": False}
+        if config["Cmd"] == ["slow-create"]:
+            await asyncio.sleep(1)
+        return web.json_response({"Id": "1234"}, status=201)
+
+    @routes.post(prefix + "/containers/{name}/start")
+    async def start(request):
+        containers[request.match_info["name"]]["running"] = True
+        return web.Response(status=204)
+
+    @routes.post(prefix + "/containers/{name}/wait")
+    async def wait(request):
+        container = containers[request.match_info["name"]]
+        while container["config"]["Cmd"] == ["hang"] and container["running"]:
+            await asyncio.sleep(0.01)
+        container["running"] = False
+        return web.json_response({"StatusCode": int(container["config"]["Cmd"][0])})
+
+    @routes.get(prefix + "/containers/{name}/logs")
+    async def logs(request):
+        cmd = containers[request.match_info["name"]]["config"]["Cmd"]
+        return web.Response(body=_multiplexed(cmd[1].encode(), cmd[2].encode()))
+
+    @routes.post(prefix + "/containers/{name}/kill")
+    async def kill(request):
+        name = request.match_info["name"]
+        if name not in containers:
+            return no_such_container(name)
+        containers[name]["running"] = False
+        return web.Response(status=204)
+
+    @routes.delete(prefix + "/containers/{name}")
+    async def remove(request):
+        name = request.match_info["name"]
+        if (container := containers.pop(name, None)) is None:
+            return no_such_container(name)
+        container["running"] = False
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.add_routes(routes)
+    return app
+
+
+def test_api_backend(tmp_path, monkeypatch):
+    socket = str(tmp_path / "docker.sock")
+    monkeypatch.setattr(
+        "r8.settings", {"docker_backend": "api", "docker_socket": socket}
+    )
+
+    async def main():
+        containers = {}
+        runner = web.AppRunner(fake_engine(containers))
+        await runner.setup()
+        await web.UnixSite(runner, socket).start()
+
+        inst = Pooled("Pooled")
+        inst.docker_pool = None
+        await inst.start()
+        assert isinstance(inst.docker, docker_backends.APIBackend)
+        assert inst.docker_started
+
+        assert await inst.docker_run_unlimited("0", "hello\n", "") == "hello"
+        with pytest.raises(DockerError) as e:
+            await inst.docker_run_unlimited("1", "out", "err")
+        assert "return code: 1" in str(e.value)
+        assert "[stderr]\nerr" in str(e.value)
+        with pytest.raises(DockerError, match="timed out"):
+            await inst.docker_run_unlimited("hang")
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(
+                inst.docker.run("slow", "r8:test", [], ["slow-create"]), 0.1
+            )
+        # all containers have been cleaned up.
+        assert not containers
+        assert await inst.docker.image_labels("r8:test") == {}
+        assert await inst.docker.image_labels("r8:missing") is None
+
+        await inst.stop()
+        assert docker_backends._shared is None
+        await runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_shared_backend(monkeypatch):
+    connected = []
+
+    async def connect():
+        await asyncio.sleep(0.01)
+        connected.append(FakeBackend())
+        return connected[-1]
+
+    monkeypatch.setattr(docker_backends, "_connect", connect)
+
+    async def main():
+        backends = await asyncio.gather(*[docker_backends.acquire() for _ in range(3)])
+        assert len(connected) == 1
+        assert all(b is connected[0] for b in backends)
+        for _ in range(2):
+            await docker_backends.release()
+        assert docker_backends._shared is not None
+        await docker_backends.release()
+        assert docker_backends._shared is None
+
+    asyncio.run(main())
+
+
+def test_scheduler():
+    a = types.SimpleNamespace(id="A", docker_weight=1, docker_quota=None)
+    b = types.SimpleNamespace(id="B", docker_weight=1, docker_quota=1)
+    scheduler = Scheduler(limit=1, max_queue=3, max_wait=100)
+    order = []
+    release = asyncio.Event()
+
+    async def run(user, challenge):
+        async with scheduler.slot(user, challenge):
+            order.append((user, challenge.id))
+            await release.wait()
+
+    async def main():
+        tasks = [
+            asyncio.create_task(run(user, challenge))
+            for user, challenge in [
+                ("alice", a),
+                ("alice", b),
+                ("bob", a),
+                ("carol", a),
+            ]
+        ]
+        await _settle()
+        assert order == [("alice", "A")]
+        # one request per user and challenge at a time.
+        with pytest.raises(DockerError, match="previous request"):
+            await run("alice", a)
+        # the queue is full.
+        with pytest.raises(DockerBusy) as e:
+            await run("dave", a)
+        assert e.value.retry_after >= 1
+        assert scheduler.status("alice", a) == {
+            "position": 0,
+            "wait": 0,
+            "limit": 1,
+            "running": 1,
+            "queued": 3,
+        }
+        assert scheduler.status("carol", a)["position"] == 2
+
+        # alice's second request has to wait for bob and carol.
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == [
+            ("alice", "A"),
+            ("bob", "A"),
+            ("carol", "A"),
+            ("alice", "B"),
+        ]
+        assert not scheduler.active and not scheduler.running
+
+    asyncio.run(main())
+
+
+def test_scheduler_quota():
+    a = types.SimpleNamespace(id="A", docker_weight=1, docker_quota=1)
+    b = types.SimpleNamespace(id="B", docker_weight=1, docker_quota=None)
+    scheduler = Scheduler(limit=2, max_queue=10, max_wait=100)
+    running = []
+    release = asyncio.Event()
+
+    async def run(user, challenge):
+        async with scheduler.slot(user, challenge):
+            running.append((user, challenge.id))
+            await release.wait()
+
+    async def main():
+        tasks = [
+            asyncio.create_task(run(user, challenge))
+            for user, challenge in [("alice", a), ("bob", a), ("carol", b)]
+        ]
+        await _settle()
+        # bob is queued because of A's quota, carol can run in the meantime.
+        assert running == [("alice", "A"), ("carol", "B")]
+        assert scheduler.status("bob", a)["position"] == 1
+        tasks[0].cancel()
+        await _settle()
+        assert running[-1] == ("bob", "A")
+        release.set()
+        await asyncio.gather(*tasks[1:])
+
+    asyncio.run(main())
+
+
+def test_adaptive_limit():
+    limit = AdaptiveLimit(4, 2, 6)
+    assert limit.duration("A") == 1.0
+    # the limit only grows if it is fully used.
+    limit.update("A", 1, 1.0, timed_out=False, saturated=False)
+    assert limit.value == 4
+    for i in range(12):
+        limit.update("A", 2 + i, 1.0, timed_out=False, saturated=True)
+    assert limit.value == 6
+    # timeouts decrease the limit, but only once per round of runs.
+    limit.update("A", 10, 10.0, timed_out=True, saturated=True)
+    assert limit.value == 4
+    limit.update("A", 11, 10.0, timed_out=True, saturated=True)
+    assert limit.value == 4
+    # single slow runs are not congestion, but a sustained slowdown is.
+    limit._last_decrease = 0
+    limit.update("A", 12, 5.0, timed_out=False, saturated=True)
+    assert limit.value == 4
+    for i in range(20):
+        limit._last_decrease = 0
+        limit.update("A", 13 + i, 5.0, timed_out=False, saturated=True)
+    assert limit.value == 2
+    # the recent average is also the scheduler's estimate for the next run.
+    assert 4.0 < limit.duration("A") < 5.0
+    assert limit.duration("B") == 1.0
+
+
+def test_queue_status_js():
+    challenge = types.SimpleNamespace(id='Docker("</script><script>alert(1)")')
+    js = DockerChallenge.queue_status_js(challenge)
+    assert js.count("</script>") == 1
+    assert '"Docker(\\"<\\/script><script>alert(1)\\")"' in js
@@ -0,0 +1,98 @@
+import pytest
+
+from r8 import bundles
+from r8 import jsx
+
+
+def test_compile():
+    assert jsx.compile("<div/>") == 'React.createElement("div", null)'
+    assert jsx.compile("<></>") == "React.createElement(React.Fragment, null)"
+    assert jsx.compile('<a href="x&amp;y" data-id={1} disabled>hi</a>') == (
+        'React.createElement("a", {href: "x&y", "data-id": 1, disabled: true}, "hi")'
+    )
+    assert jsx.compile("<Foo.Bar {...props}/>") == (
+        "React.createElement(Foo.Bar, {...props})"
+    )
+    assert jsx.compile(
+        """
+        <p>
+            Hello {name}!{/* comment */}
+            <b>x</b>
+        </p>
+        """
+    ) == (
+        'React.createElement("p", null, "Hello ", name, "!", '
+        'React.createElement("b", null, "x"))'
+    )
+    assert jsx.compile("x = a.map(x => <i key={x}>{`${x}`}</i>)") == (
+        'x = a.map(x => React.createElement("i", {key: x}, `${x}`))'
+    )
+    assert jsx.compile("`${<br/>}`") == '`${React.createElement("br", null)}`'
+
+
+def test_compile_no_jsx():
+    code = 'if (a < b && c<d) { s = "<p>" + `<p>` + /<p>/.source; } // <p>'
+    assert jsx.compile(code) == code
+    assert jsx.compile("return x / 2 / y") == "return x / 2 / y"
+
+
+def test_minify():
+    code = """
+        // comment
+        function f(a, b) {
+            /* comment */
+            let x = a + +b;
+            return x
+        }
+        f(1, 2)
+    """
+    assert jsx.compile(code, minify=True) == (
+        "function f(a,b){let x=a+ +b;return x}\nf(1,2)"
+    )
+
+
+def test_syntax_error():
+    with pytest.raises(jsx.JSXSyntaxError, match="line 2"):
+        jsx.compile("\n<div>")
+    with pytest.raises(jsx.JSXSyntaxError):
+        jsx.compile("<div></span>")
+    with pytest.raises(jsx.JSXSyntaxError, match="line 3"):
+        jsx.compile("<p>\n\n  a < b\n</p>")
+    with pytest.raises(jsx.JSXSyntaxError):
+        jsx.compile("<a href=< />")
+    # comparisons in expression containers are not tags.
+    assert jsx.compile("<p>{a < b}{a <b}</p>") == (
+        'React.createElement("p", null, a < b, a <b)'
+    )
+
+
+def test_bundles(tmp_path):
+    static = tmp_path / "static"
+    custom = tmp_path / "custom"
+    static.mkdir()
+    custom.mkdir()
+    (static / "_base.html").write_text(
+        "<title>{% block title %}{% endblock %}</title>\n"
+        '<script src="js/babel.js"></script>\n'
+        '<script type="text/babel">\n'
+        "    ReactDOM.render(<h1>{{ self.title() }}</h1>, root);\n"
+        "</script>"
+    )
+    (static / "index.html").write_text(
+        '{% extends "_base.html" %}{% block title %}CTF{% endblock %}'
+    )
+    (static / "plain.html").write_text("no scripts")
+
+    built = bundles.build(static, static, {})
+    assert sorted(built.values()) == ["_base.html", "index.html"]
+    path = next(path for path, page in built.items() if page == "index.html")
+    assert (static / path).read_text() == (
+        'ReactDOM.render(React.createElement("h1",null,"CTF"),root);'
+    )
+
+    page = '<script src="js/babel.js"></script>\n<script type="text/babel">\n    ReactDOM.render(<h1>CTF</h1>, root);\n</script>'
+    assert bundles.apply(page, static) == f'<script src="{path}"></script>'
+    # custom templates that have not been built fall back to in-browser compilation.
+    custom_page = page.replace("CTF", "Custom CTF")
+    assert bundles.apply(custom_page, [custom, static]) == custom_page
+    assert bundles.apply("no scripts", static) == "no scripts"
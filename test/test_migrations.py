@@ -0,0 +1,22 @@
+import sqlite3
+
+from r8 import migrations
+
+
+def test_migrate():
+    conn = sqlite3.connect(":memory:")
+    assert migrations.current_version(conn) == 0
+    assert migrations.migrate(conn) == list(range(1, migrations.LATEST_VERSION + 1))
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+    assert migrations.migrate(conn) == []
+
+
+def test_migrate_legacy_database():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(migrations.MIGRATIONS[0])
+    assert migrations.current_version(conn) == 1
+    assert migrations.migrate(conn) == list(range(2, migrations.LATEST_VERSION + 1))
+    indexes = {
+        x[0] for x in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    }
+    assert "submissions_fid" in indexes
@@ -0,0 +1,42 @@
+import os
+
+import jinja2
+from aiohttp.test_utils import make_mocked_request
+
+from r8.pages import Pages
+
+
+def test_pages(tmp_path):
+    (tmp_path / "_base.html").write_text("{% block title %}{% endblock %}: {{ x }}")
+    (tmp_path / "index.html").write_text(
+        '{% extends "_base.html" %}{% block title %}CTF{% endblock %}'
+    )
+    (tmp_path / "clock.html").write_text("{{ time }}")
+    (tmp_path / "excluded.html").write_text("{{ x }}")
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(tmp_path))
+    context = {"x": 1, "time": 0}
+    pages = Pages(env, tmp_path, context, exclude=["excluded.html"])
+
+    body, etag = pages.render("index.html")
+    assert body == b"CTF: 1"
+    context["x"] = 2
+    assert pages.render("index.html") == (body, etag)
+
+    # changes to the base template invalidate the page.
+    base = tmp_path / "_base.html"
+    base.write_text("{% block title %}{% endblock %} - {{ x }}")
+    os.utime(base, (0, base.stat().st_mtime + 10))
+    body, new_etag = pages.render("index.html")
+    assert body == b"CTF - 2"
+    assert new_etag != etag
+
+    assert pages.render("clock.html") == (b"0", None)
+    context["time"] = 1
+    assert pages.render("clock.html") == (b"1", None)
+    assert pages.render("excluded.html") == (b"2", None)
+
+    req = make_mocked_request("GET", "/", headers={"If-None-Match": new_etag})
+    assert pages.response("index.html", req).status == 304
+    req = make_mocked_request("GET", "/")
+    assert pages.response("index.html", req).status == 200
+    assert pages.response("nope.html", req).status == 404
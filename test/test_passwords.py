@@ -0,0 +1,43 @@
+import asyncio
+
+import argon2
+import pytest
+
+from r8 import passwords
+
+
+def test_verify():
+    hash = passwords.hash_password("foo")
+    assert passwords.verify(hash, "foo") is None
+    with pytest.raises(argon2.exceptions.VerificationError):
+        passwords.verify(hash, "bar")
+
+    new = passwords.verify("$plain$foo", "foo")
+    assert new and passwords.verify(new, "foo") is None
+    with pytest.raises(argon2.exceptions.VerificationError):
+        passwords.verify("$plain$foo", "bar")
+
+    outdated = argon2.PasswordHasher(time_cost=1).hash("foo")
+    new = passwords.verify(outdated, "foo")
+    assert new and not passwords.ph.check_needs_rehash(new)
+
+
+def test_pool():
+    async def main():
+        pool = passwords.PasswordPool(concurrency=1, queue_timeout=0)
+        try:
+            hash = await pool.hash_password("foo")
+            assert await pool.verify(hash, "foo") is None
+            with pytest.raises(argon2.exceptions.VerificationError):
+                await pool.verify(hash, "bar")
+            results = await asyncio.gather(
+                pool.verify(hash, "foo"),
+                pool.verify(hash, "foo"),
+                return_exceptions=True,
+            )
+            assert results[0] is None
+            assert isinstance(results[1], passwords.Overloaded)
+        finally:
+            pool.close()
+
+    asyncio.run(main())
@@ -0,0 +1,181 @@
+import asyncio
+import collections
+import json
+import sqlite3
+import time
+
+import r8
+from r8 import migrations
+from r8.rest_api import scoreboard
+from r8.scoring import ScoreHistory
+
+
+def test_state_cache(monkeypatch):
+    monkeypatch.setitem(r8.settings, "scoring", True)
+    history = ScoreHistory(1_600_000_000)
+    challenges = [
+        {"cid": "cid1", "points": 500},
+        {"cid": "cid2", "points": 0},
+        {"cid": "hidden", "points": 500},
+    ]
+    teams = ["foo", "bar", "_admin"]
+
+    class Hidden(r8.Challenge):
+        async def visible(self, user: str) -> bool:
+            return user == "admin"
+
+    monkeypatch.setattr(
+        r8.challenges,
+        "_instances",
+        {
+            "cid1": r8.Challenge("cid1"),
+            "cid2": r8.Challenge("cid2"),
+            "hidden": Hidden("hidden"),
+        },
+    )
+    monkeypatch.setattr(scoreboard, "history", history, raising=False)
+    monkeypatch.setattr(r8.state.solves, "data_version", 0)
+    monkeypatch.setattr(r8.state.solves, "challenge_list", lambda: challenges)
+    monkeypatch.setattr(r8.util, "get_teams", lambda: teams)
+    cache = scoreboard.StateCache()
+
+    async def main():
+        payload = await cache.payload("alice")
+        state = json.loads(payload.body)
+        assert state["seq"] == 0
+        assert state["epoch"] == scoreboard.epoch
+        assert state["teams"] == ["foo", "bar"]
+        assert [c["cid"] for c in state["challenges"]] == ["cid1"]
+        assert "hidden" not in state["solves"]
+        assert state["scoreboards"] == history.to_json()
+
+        assert await cache.payload("bob") is payload
+        admin = json.loads((await cache.payload("admin")).body)
+        assert [c["cid"] for c in admin["challenges"]] == ["cid1", "hidden"]
+
+        history.solve("foo", r8.Challenge("cid1"), 1_600_000_010)
+        history.solve("bar", r8.Challenge("cid1"), 1_600_000_020)
+        payload = await cache.payload("alice")
+        state = json.loads(payload.body)
+        assert state["seq"] == 2
+        assert state["solves"]["cid1"] == ["foo", "bar"]
+        assert state["scoreboards"] == history.to_json()
+
+        # payloads are rebuilt once the next challenge starts.
+        cache.expires = 0
+        assert await cache.payload("alice") is not payload
+
+        header = payload.header
+        assert (
+            json.loads(cache.encode(header, cache.start_seq(1)))["scoreboards"]
+            == (history.to_json()[2:])
+        )
+        assert (
+            json.loads(cache.encode(header, cache.start_seq(1_600_000_010)))[
+                "scoreboards"
+            ]
+            == (history.to_json()[2:])
+        )
+        assert json.loads(cache.encode(header, cache.start_seq(1_500_000_000)))[
+            "scoreboards"
+        ] == (history.to_json())
+
+    asyncio.run(main())
+
+    loaded = ScoreHistory.load(json.loads(json.dumps(history.dump())))
+    assert loaded.timestamps == history.timestamps == [1_600_000_010, 1_600_000_020]
+    loaded.rebase(1_600_000_015)
+    assert loaded.timestamps == [1_600_000_020]
+
+
+def test_checkpoint(monkeypatch):
+    monkeypatch.setitem(r8.settings, "scoring", True)
+    monkeypatch.setattr(
+        r8.challenges, "_instances", {c: r8.Challenge(c) for c in ("a", "b")}
+    )
+    conn = sqlite3.connect(":memory:")
+    migrations.migrate(conn)
+    conn.executescript(
+        """
+        INSERT INTO users (uid, password) VALUES ('alice', ''), ('bob', ''), ('carol', '');
+        INSERT INTO teams (uid, tid) VALUES ('alice', 'A'), ('bob', 'B'), ('carol', 'C');
+        INSERT INTO challenges (cid, team, t_start, t_stop) VALUES
+            ('a', 0, datetime('now'), datetime('now')),
+            ('b', 0, datetime('now'), datetime('now'));
+        INSERT INTO flags (fid, cid, max_submissions) VALUES ('a', 'a', 99), ('b', 'b', 99);
+        INSERT INTO submissions (uid, fid, timestamp) VALUES
+            ('alice', 'a', datetime('now', '-2 hours')),
+            ('bob', 'a', datetime('now', '-1 hours'));
+        """
+    )
+    start = time.time() - 86400
+
+    def load():
+        history, replayed = scoreboard._load_history(conn, start)
+        return history.to_json(), replayed
+
+    full, replayed = load()
+    assert replayed == 2
+    assert load() == (full, 0)
+
+    conn.execute("INSERT INTO submissions (uid, fid) VALUES ('alice', 'b')")
+    full, replayed = load()
+    assert replayed == 1
+    assert len(full) == 4
+
+    # e.g. `r8 flags revoke`
+    conn.execute("DELETE FROM submissions WHERE uid = 'bob'")
+    full, replayed = load()
+    assert replayed == 2
+    assert len(full) == 3
+    assert load() == (full, 0)
+
+    # later checkpoints are saved from the in-memory history.
+    history, _ = scoreboard._load_history(conn, start)
+    # e.g. a submission from another process that is not in the history.
+    conn.execute("INSERT INTO submissions (uid, fid) VALUES ('carol', 'a')")
+    rowid = conn.execute(
+        "INSERT INTO submissions (uid, fid) VALUES ('bob', 'b')"
+    ).lastrowid
+    history.solve("B", r8.challenges["b"], time.time())
+    data = json.dumps(history.dump())
+    assert not scoreboard._save_checkpoint(conn, data, rowid, 1)
+    history, replayed = scoreboard._load_history(conn, start)
+    assert replayed == 2
+
+    rowid = conn.execute(
+        "INSERT INTO submissions (uid, fid) VALUES ('bob', 'a')"
+    ).lastrowid
+    history.solve("B", r8.challenges["a"], time.time())
+    data = json.dumps(history.dump())
+    # submissions that are still being processed do not prevent saving.
+    conn.execute("INSERT INTO submissions (uid, fid) VALUES ('carol', 'b')")
+    assert scoreboard._save_checkpoint(conn, data, rowid, 1)
+    full, replayed = load()
+    assert replayed == 1
+    assert len(full) == len(history) + 1
+
+    monkeypatch.setitem(r8.settings, "scoring_alpha", 0.5)
+    assert load()[1] == 6
+
+
+def test_missed_messages(monkeypatch):
+    monkeypatch.setitem(r8.settings, "scoring", True)
+    history = ScoreHistory(0)
+    recent = collections.deque(maxlen=2)
+    monkeypatch.setattr(scoreboard, "history", history, raising=False)
+    monkeypatch.setattr(scoreboard, "recent", recent, raising=False)
+    for i, team in enumerate(["a", "b", "c"], 1):
+        history.solve(team, r8.Challenge("cid"), i)
+        recent.append((i, f"delta {i}"))
+
+    monkeypatch.setattr(scoreboard, "epoch", "current")
+    assert scoreboard.missed_messages(3, "current") == []
+    assert scoreboard.missed_messages(2, "current") == ["delta 3"]
+    assert scoreboard.missed_messages(1, "current") == ["delta 2", "delta 3"]
+    # not covered by the ring buffer anymore.
+    assert scoreboard.missed_messages(0, "current") is None
+    assert scoreboard.missed_messages(4, "current") is None
+    # sequence numbers from before a server restart.
+    assert scoreboard.missed_messages(2, "previous") is None
+    assert scoreboard.missed_messages(2, "") is None
@@ -1,4 +1,7 @@
+import pytest
+
 import r8
+from r8.scoring import ScoreHistory
 from r8.scoring import Scoreboard
 
 
@@ -63,3 +66,33 @@ def test_scoreboard_time(monkeypatch):
     assert s.scores["baz"] == 264.9876543209
 
     assert repr(s) == "Scoreboard[#1 bar (500), #2 foo (265), #3 baz (265)]"
+
+
+def test_score_history(monkeypatch):
+    monkeypatch.setitem(r8.settings, "scoring", True)
+    monkeypatch.setitem(r8.settings, "scoring_alpha", 0.1)
+    monkeypatch.setitem(r8.settings, "scoring_beta", 1.5)
+    monkeypatch.setitem(r8.settings, "scoring_first_solve_bonus", 8)
+
+    solves = [
+        ("foo", "cid1", 50),  # before start
+        ("bar", "cid2", 110),
+        ("_admin", "cid2", 115),
+        ("baz", "cid1", 120),
+        ("bar", "cid1", 130),
+    ]
+    history = ScoreHistory(100)
+    snapshots = [Scoreboard(100)]
+    for team, cid, timestamp in solves:
+        history.solve(team, r8.Challenge(cid), timestamp)
+        if next := snapshots[-1].solve(team, r8.Challenge(cid), timestamp):
+            if timestamp < 100:
+                next.timestamp = 100
+                snapshots.clear()
+            snapshots.append(next)
+
+    assert history.to_json() == [x.to_json() for x in snapshots]
+    assert len(history) == 4
+    assert history.current.solves["cid1"] == ["foo", "baz", "bar"]
+    with pytest.raises(ValueError, match="already solved"):
+        history.solve("baz", r8.Challenge("cid1"), 140)
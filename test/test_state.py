@@ -0,0 +1,169 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import r8
+from r8 import migrations
+from r8.database import Database
+from r8.state import SolveIndex
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    filename = str(tmp_path / "test.db")
+    conn = sqlite3.connect(filename)
+    migrations.migrate(conn)
+    conn.executescript(
+        """
+        INSERT INTO users (uid, password) VALUES ('alice', ''), ('bob', ''), ('eve', '');
+        INSERT INTO teams (uid, tid) VALUES ('alice', 'team'), ('bob', 'team');
+        INSERT INTO challenges (cid, team, t_start, t_stop) VALUES
+            ('solo', 0, datetime('now', '-1 day'), datetime('now', '+1 day')),
+            ('shared', 1, datetime('now', '-1 day'), datetime('now', '+1 day')),
+            ('expired', 0, datetime('now', '-2 day'), datetime('now', '-1 day'));
+        INSERT INTO flags (fid, cid, max_submissions) VALUES
+            ('solo', 'solo', 99), ('solo-once', 'solo', 1),
+            ('shared', 'shared', 99), ('expired', 'expired', 99);
+        """
+    )
+    conn.close()
+    db = Database(filename)
+    monkeypatch.setattr(r8, "async_db", db, raising=False)
+    monkeypatch.setattr(r8.state, "solves", SolveIndex())
+    yield filename
+    db.close()
+
+
+def test_submit_flag(db):
+    async def main():
+        assert await r8.util.submit_flag_async("solo", "alice", "127.0.0.1") == "solo"
+        assert r8.util.has_solved("alice", "solo")
+        assert not r8.util.has_solved("bob", "solo")
+        with pytest.raises(ValueError, match="already solved"):
+            await r8.util.submit_flag_async("solo", "alice", "127.0.0.1")
+
+        assert await r8.util.submit_flag_async("shared", "bob", "127.0.0.1") == "shared"
+        assert r8.util.has_solved("alice", "shared")
+        with pytest.raises(ValueError, match="already solved"):
+            await r8.util.submit_flag_async("shared", "alice", "127.0.0.1")
+
+        with pytest.raises(ValueError, match="Unknown user"):
+            await r8.util.submit_flag_async("solo", "mallory", "127.0.0.1")
+        with pytest.raises(ValueError, match="Unknown Flag"):
+            await r8.util.submit_flag_async("nope", "alice", "127.0.0.1")
+        with pytest.raises(ValueError, match="not active"):
+            await r8.util.submit_flag_async("expired", "alice", "127.0.0.1")
+        assert await r8.util.submit_flag_async("expired", "alice", "::1", force=True)
+
+        assert await r8.util.submit_flag_async("solo-once", "bob", "127.0.0.1")
+        with pytest.raises(ValueError, match="used too often"):
+            await r8.util.submit_flag_async("solo-once", "eve", "127.0.0.1")
+
+    asyncio.run(main())
+
+
+def test_external_modification(db):
+    async def main():
+        assert await r8.util.submit_flag_async("solo", "alice", "127.0.0.1")
+
+        # e.g. `r8 flags revoke` in another process.
+        with sqlite3.connect(db) as conn:
+            conn.execute("DELETE FROM submissions WHERE uid = 'alice'")
+
+        assert await r8.util.submit_flag_async("solo", "alice", "127.0.0.1")
+        assert await r8.async_db.fetchall("SELECT uid, fid FROM submissions") == [
+            ("alice", "solo")
+        ]
+
+    asyncio.run(main())
+
+
+def test_directory(db):
+    async def main():
+        await r8.state.solves.reload()
+        directory = r8.state.solves.directory
+        assert r8.util.get_team("alice") == "team"
+        assert r8.util.get_team("eve") is None
+        assert r8.util.get_teams() == ["team"]
+        assert sorted(r8.util.get_users()) == ["alice", "bob", "eve"]
+
+        directory.add_user("mallory", "evil")
+        assert r8.util.get_teams() == ["team", "evil"]
+
+        # e.g. `r8 teams rename` in another process.
+        with sqlite3.connect(db) as conn:
+            conn.execute("UPDATE teams SET tid = 'renamed' WHERE tid = 'team'")
+        await r8.state.solves.reload()
+        assert r8.util.get_team("alice") == "renamed"
+        assert r8.util.get_teams() == ["renamed"]
+
+    asyncio.run(main())
+
+
+def test_challenge_list_version(db):
+    async def main():
+        index = r8.state.solves
+        await index.reload()
+        alice = index.challenge_list_version("alice", 60)
+        assert alice == index.challenge_list_version("alice", 60)
+        assert alice != index.challenge_list_version("bob", 60)
+
+        await r8.util.submit_flag_async("solo", "eve", "127.0.0.1")
+        assert alice != index.challenge_list_version("alice", 60)
+
+    asyncio.run(main())
+
+
+def test_reload_on_indexed_changes(db):
+    async def main():
+        index = r8.state.solves
+        await index.reload()
+        await r8.util.submit_flag_async("solo", "alice", "127.0.0.1")
+        r8.util.create_flag("solo")
+        directory = index.directory
+
+        # r8's own writes and writes to other tables do not trigger a reload.
+        with sqlite3.connect(db) as conn:
+            conn.execute("INSERT INTO events (ip, type) VALUES ('127.0.0.1', 'test')")
+        await index.reload()
+        assert index.directory is directory
+
+        with sqlite3.connect(db) as conn:
+            conn.execute("INSERT INTO users (uid, password) VALUES ('mallory', '')")
+        await index.reload()
+        assert index.directory is not directory
+        assert "mallory" in r8.util.get_users()
+
+    asyncio.run(main())
+
+
+def test_sync_api(db):
+    # e.g. `r8 flags submit`, outside of the event loop.
+    assert r8.util.submit_flag("solo", "alice", "127.0.0.1") == "solo"
+    assert r8.util.has_solved("alice", "solo")
+    with pytest.raises(ValueError, match="already solved"):
+        r8.util.submit_flag("solo", "alice", "127.0.0.1")
+
+    # modifications by other processes are picked up without a running watch task.
+    with sqlite3.connect(db) as conn:
+        conn.execute("DELETE FROM submissions WHERE uid = 'alice'")
+    assert not r8.util.has_solved("alice", "solo")
+
+    assert r8.Challenge("solo").active
+    assert not r8.Challenge("expired").active
+
+
+def test_challenge_data(db):
+    inst = r8.Challenge("solo")
+    assert inst.get_data("key") is None
+    inst.set_data("key", [1, 2])
+    assert inst.get_data("key") == [1, 2]
+
+    async def main():
+        inst.set_data("key", {"a": 1})
+        # set_data returns immediately, but the write is visible to subsequent reads.
+        assert await inst.get_data_async("key") == {"a": 1}
+        assert await inst.get_data_async("key", cid="shared") is None
+
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import asyncio
+import gzip
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from r8 import staticfiles
+from r8.staticfiles import StaticFiles
+
+
+def get(files: StaticFiles, path: str, **headers):
+    async def serve():
+        request = make_mocked_request("GET", "/" + path, headers=headers)
+        resp = files.serve(path, request)
+        await resp.prepare(request)
+        return resp
+
+    return asyncio.run(serve())
+
+
+def test_static_files(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    (tmp_path / "a" / "index.html").write_text("a")
+    (tmp_path / "b" / "index.html").write_text("b")
+    (tmp_path / "b" / "app.js").write_text("console.log(1)")
+    (tmp_path / "b" / "app.js.gz").write_bytes(gzip.compress(b"console.log(1)"))
+    (tmp_path / "b" / "js" / "bundles").mkdir(parents=True)
+    (tmp_path / "b" / "js" / "bundles" / "index.0123456789ab.js").write_text("")
+    (tmp_path / "b" / "img.deadbeef.png").write_text("")
+    (tmp_path / "secret").write_text("secret")
+    os.symlink(tmp_path / "secret", tmp_path / "b" / "secret")
+    files = StaticFiles([tmp_path / "a", tmp_path / "b"])
+
+    resp = get(files, "")
+    assert resp.status == 200
+    assert resp.body == b"a"
+    assert resp.headers["Cache-Control"] == "no-cache"
+    assert get(files, "nope").status == 404
+    assert get(files, "secret").status == 404
+    assert get(files, "../secret").status == 400
+
+    # the first request reads the file in a thread, afterwards it is cached.
+    resp = get(files, "app.js")
+    assert resp.body == b"console.log(1)"
+    assert "Content-Encoding" not in resp.headers
+    etag = resp.headers["ETag"]
+    assert get(files, "app.js").headers["ETag"] == etag
+    assert get(files, "app.js", **{"If-None-Match": etag}).status == 304
+    last_modified = resp.headers["Last-Modified"]
+    assert get(files, "app.js", **{"If-Modified-Since": last_modified}).status == 304
+
+    resp = get(files, "app.js", **{"Accept-Encoding": "gzip, deflate"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(resp.body) == b"console.log(1)"
+    assert resp.headers["ETag"] != etag
+    assert resp.headers["Vary"] == "Accept-Encoding"
+
+    resp = get(files, "js/bundles/index.0123456789ab.js")
+    assert "immutable" in resp.headers["Cache-Control"]
+    resp = get(files, "img.deadbeef.png")
+    assert resp.headers["Cache-Control"] == "no-cache"
+
+
+def test_static_files_cache_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(staticfiles, "cache", staticfiles._Cache(10))
+    for name in "abc":
+        (tmp_path / name).write_text(name * 4)
+    files = StaticFiles([tmp_path])
+
+    assert get(files, "a").body == b"aaaa"
+    assert get(files, "b").body == b"bbbb"
+    assert get(files, "a").body == b"aaaa"
+    assert get(files, "c").body == b"cccc"
+    assert staticfiles.cache.size == 8
+    assert [f.path.name for f, _ in staticfiles.cache.entries] == ["a", "c"]
+    assert get(files, "b").body == b"bbbb"
+
+
+def test_static_files_rescan(tmp_path):
+    files = StaticFiles([tmp_path], rescan_interval=0)
+    assert get(files, "new.txt").status == 404
+    (tmp_path / "new.txt").write_text("new")
+    assert get(files, "new.txt").body == b"new"
+
+
+def test_static_files_added_later(tmp_path):
+    files = StaticFiles([tmp_path])
+    assert get(files, "new.txt").status == 404
+    (tmp_path / "new.txt").write_text("new")
+    (tmp_path / "new.txt.gz").write_bytes(gzip.compress(b"new"))
+    resp = get(files, "new.txt", **{"Accept-Encoding": "gzip"})
+    assert gzip.decompress(resp.body) == b"new"
+    assert "new.txt" in files.files
+    (tmp_path / "dir").mkdir()
+    assert get(files, "dir").status == 404
+
+
+def test_static_files_range(tmp_path):
+    (tmp_path / "a.txt").write_text("0123456789")
+    files = StaticFiles([tmp_path])
+    # range requests are handled by aiohttp.
+    request = make_mocked_request("GET", "/a.txt", headers={"Range": "bytes=2-4"})
+    resp = files.serve("a.txt", request)
+    assert isinstance(resp, web.FileResponse)
+    assert resp.headers["Cache-Control"] == "no-cache"
+
+
+def test_preload(tmp_path, monkeypatch):
+    monkeypatch.setattr(staticfiles, "_indexes", {})
+    (tmp_path / "a.txt").write_text("a")
+    asyncio.run(staticfiles.preload([tmp_path]))
+    assert "a.txt" in staticfiles._indexes[(tmp_path,)].files